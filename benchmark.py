@@ -0,0 +1,282 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# 基准测试：离线生成字幕和字体，分别测量解析、读取字体、查找字体、子集化和修改字幕各阶段的耗时和内存峰值
+#
+# 用法：
+#   python3 benchmark.py                    与保存的基准结果比较，出现性能退化时返回 1
+#   python3 benchmark.py --save-baseline    保存本次结果作为基准
+#
+# 读取字体阶段使用进程池，内存峰值只统计主进程中的 Python 内存分配
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+
+# 解析码位范围，如 "4E00-9FFF"
+def parse_range(text):
+    start, _, end = text.partition('-')
+    return int(start, 16), int(end or start, 16)
+
+
+# 使用 FontBuilder 生成只有方块字形的 TrueType 字体
+def build_font(family, codepoints):
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+    glyph_names = [".notdef"] + [f"uni{codepoint:04X}" for codepoint in codepoints]
+    pen = TTGlyphPen(None)
+    pen.moveTo((50, 0))
+    pen.lineTo((50, 700))
+    pen.lineTo((550, 700))
+    pen.lineTo((550, 0))
+    pen.closePath()
+    glyph = pen.glyph()
+
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(glyph_names)
+    builder.setupCharacterMap({codepoint: f"uni{codepoint:04X}" for codepoint in codepoints})
+    builder.setupGlyf({name: glyph for name in glyph_names})
+    builder.setupHorizontalMetrics({name: (600, 50) for name in glyph_names})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({"familyName": family, "styleName": "Regular", "fullName": family, "psName": family.replace(" ", "")})
+    builder.setupOS2(usWeightClass=400)
+    builder.setupPost()
+    return builder.font
+
+
+# 生成字体库：普通字体和 TTC 字体，每个字体覆盖 ASCII 和部分 CJK 字符
+def build_font_corpus(fonts_dir, font_count, glyph_count, cjk_range):
+    from fontTools.ttLib import TTCollection
+
+    os.makedirs(fonts_dir, exist_ok=True)
+    ascii_codepoints = list(range(0x20, 0x7F))
+    cjk_codepoints = list(range(cjk_range[0], cjk_range[1] + 1))
+    families = []
+    collection = []
+    for i in range(font_count):
+        family = f"Bench Font {i:04d}"
+        codepoints = ascii_codepoints + cjk_codepoints[:glyph_count]
+        font = build_font(family, codepoints)
+        families.append(family)
+        # 每 10 个字体中的 2 个放入 TTC 文件
+        if i % 10 < 2:
+            collection.append((i, font))
+            if len(collection) == 2:
+                ttc = TTCollection()
+                ttc.fonts = [font for _, font in collection]
+                ttc.save(os.path.join(fonts_dir, f"bench{i:04d}.ttc"))
+                collection = []
+        else:
+            font.save(os.path.join(fonts_dir, f"bench{i:04d}.ttf"))
+    # 剩下的单个字体不组成 TTC
+    for i, font in collection:
+        font.save(os.path.join(fonts_dir, f"bench{i:04d}.ttf"))
+    return families
+
+
+# 生成 ASS 字幕，tag_density 为每段文本前插入控制序列的概率
+def build_subtitle(path, families, event_count, tag_density, cjk_range, subtitle_fonts, seed=0):
+    rng = random.Random(seed)
+    used_families = families[:subtitle_fonts]
+    cjk_codepoints = range(cjk_range[0], cjk_range[1] + 1)
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding",
+    ]
+    for i, family in enumerate(used_families):
+        lines.append(f"Style: Style{i},{family},48,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,2,2,2,10,10,10,1")
+    lines += [
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    for i in range(event_count):
+        parts = []
+        for _ in range(rng.randint(1, 6)):
+            if rng.random() < tag_density:
+                tag = rng.choice([r"\pos(640,360)", r"\blur2", r"\c&H00FF00&", r"\k20", r"\fad(100,100)"])
+                if rng.random() < 0.3:
+                    tag += rf"\fn{rng.choice(used_families)}"
+                parts.append("{" + tag + "}")
+            parts.append("".join(chr(rng.choice(cjk_codepoints)) for _ in range(rng.randint(2, 12))))
+            parts.append(rng.choice(["", r"\N", " ", ", ok"]))
+        start = i * 2
+        lines.append(f"Dialogue: 0,0:{start // 60 % 60:02d}:{start % 60:02d}.00,0:{start // 60 % 60:02d}:{start % 60:02d}.90,"
+                     f"Style{i % len(used_families)},,0,0,0,,{''.join(parts)}")
+        if i % 50 == 0:
+            lines.append(f"Comment: 0,0:00:00.00,0:00:01.00,Style0,,0,0,0,,comment {i}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+# 运行一个阶段，返回耗时最短的一次（秒）和内存峰值（字节）
+def measure(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+# 在 work_dir 中生成测试数据并运行所有阶段
+def run_benchmark(args, work_dir):
+    cjk_range = parse_range(args.cjk_range)
+    fonts_dir = os.path.join(work_dir, "fonts")
+    cache_dir = os.path.join(work_dir, "cache")
+    output_dir = os.path.join(work_dir, "output")
+    subtitle_path = os.path.join(work_dir, "bench.ass")
+    os.makedirs(output_dir, exist_ok=True)
+
+    # 只扫描临时目录中的字体，缓存目录指向临时目录，导入前设置环境变量
+    os.environ["ASSFONTSUBSET_SYSTEM_FONTS"] = "0"
+    os.environ["ASSFONTSUBSET_FONT_DIRS"] = fonts_dir
+    os.environ["ASSFONTSUBSET_CACHE_DIR"] = cache_dir
+    import subtitle_subsetter
+
+    print(f"生成 {args.fonts} 个字体和 {args.events} 行字幕: {work_dir}", file=sys.stderr)
+    families = build_font_corpus(fonts_dir, args.fonts, args.glyphs, cjk_range)
+    build_subtitle(subtitle_path, families, args.events, args.tag_density, cjk_range, args.subtitle_fonts)
+
+    results = {}
+
+    # 读取字体：冷启动需要清空内存索引和缓存数据库
+    def load_cold():
+        subtitle_subsetter.font_files.clear()
+        subtitle_subsetter.all_fonts.clear()
+        subtitle_subsetter.font_name_index.clear()
+        subtitle_subsetter.font_name_keys = None
+        subtitle_subsetter.font_dir_mtimes.clear()
+        index_path = os.path.join(cache_dir, "font_index.db")
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        subtitle_subsetter.load_all_fonts()
+
+    results["load_all_fonts_cold"] = measure(load_cold, args.repeat)
+    results["load_all_fonts_warm"] = measure(subtitle_subsetter.load_all_fonts, args.repeat)
+
+    parsed = {}
+
+    def parse():
+        parsed["styles"], parsed["dialogues"] = subtitle_subsetter.parse_ass_file(subtitle_path)
+
+    results["parse_ass_file"] = measure(parse, args.repeat)
+
+    # 查找字体：每个字体名称查找多次，包括不存在的字体
+    lookup_names = families + [f"Missing Font {i}" for i in range(len(families) // 10 + 1)]
+
+    def lookup():
+        for _ in range(10):
+            for name in lookup_names:
+                subtitle_subsetter.find_font_path(name)
+
+    results["find_font_path"] = measure(lookup, args.repeat)
+
+    # 子集化：在当前进程中直接子集化，不使用子集化缓存
+    font_paths = {face: subtitle_subsetter.find_font_path(*face) for face in parsed["dialogues"]}
+
+    def subset(options=None):
+        for i, (face, (font_path, face_index)) in enumerate(font_paths.items()):
+            output_path = os.path.join(output_dir, f"BENCH{i:03d}.ttf")
+            if not subtitle_subsetter.subset_font(font_path, parsed["dialogues"][face], output_path, f"BENCH{i:03d}", None, face_index, options=options):
+                raise RuntimeError(f"子集化失败: {subtitle_subsetter.face_label(face)}")
+
+    results["subset_font"] = measure(subset, args.repeat)
+
+    # 每个子集化配置的耗时和输出大小
+    def output_size():
+        return sum(os.path.getsize(os.path.join(output_dir, f"BENCH{i:03d}.ttf")) for i in range(len(font_paths)))
+
+    output_sizes = {"default": output_size()}
+    for profile in subtitle_subsetter.SUBSET_PROFILES:
+        if profile == "default":
+            continue
+        options = subtitle_subsetter.subset_profile_options(profile)
+        results[f"subset_font_{profile}"] = measure(lambda: subset(options), args.repeat)
+        output_sizes[profile] = output_size()
+
+    font_mapping = {font_name: f"BENCH{i:03d}" for i, font_name in enumerate(dict.fromkeys(face[0] for face in font_paths))}
+    results["modify_subtitle_file"] = measure(lambda: subtitle_subsetter.modify_subtitle_file(subtitle_path, font_mapping, output_dir), args.repeat)
+
+    return {
+        "config": {key: getattr(args, key) for key in ("events", "tag_density", "cjk_range", "fonts", "glyphs", "subtitle_fonts")},
+        "stages": {stage: {"seconds": round(seconds, 6), "peak_memory": peak} for stage, (seconds, peak) in results.items()},
+        "output_bytes": output_sizes,
+    }
+
+
+# 与基准结果比较，返回退化的阶段列表
+def compare_with_baseline(report, baseline, tolerance):
+    regressions = []
+    if baseline.get("config") != report["config"]:
+        print("基准结果的测试配置不同，跳过比较", file=sys.stderr)
+        return regressions
+    for stage, result in report["stages"].items():
+        base = baseline["stages"].get(stage)
+        if base is None:
+            continue
+        for key in ("seconds", "peak_memory"):
+            if base[key] and result[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{stage} {key}: {base[key]} -> {result[key]}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="字幕字体子集化基准测试")
+    parser.add_argument("--events", type=int, default=5000, help="字幕行数（默认: 5000）")
+    parser.add_argument("--tag-density", type=float, default=0.5, help="控制序列密度 0~1（默认: 0.5）")
+    parser.add_argument("--cjk-range", default="4E00-5DFF", help="字幕使用的 CJK 码位范围（默认: 4E00-5DFF）")
+    parser.add_argument("--fonts", type=int, default=200, help="字体库中的字体数（默认: 200）")
+    parser.add_argument("--glyphs", type=int, default=4000, help="每个字体中的 CJK 字形数（默认: 4000）")
+    parser.add_argument("--subtitle-fonts", type=int, default=8, help="字幕使用的字体数（默认: 8）")
+    parser.add_argument("--repeat", type=int, default=3, help="每个阶段重复次数，取最短耗时（默认: 3）")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="基准结果文件")
+    parser.add_argument("--save-baseline", action="store_true", help="保存本次结果作为基准")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的退化比例（默认: 0.2）")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="assfontsubset-bench-")
+    try:
+        report = run_benchmark(args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    for stage, result in report["stages"].items():
+        print(f"{stage:<24} {result['seconds'] * 1000:10.1f} ms {result['peak_memory'] / 1024 / 1024:10.1f} MB")
+    for profile, size in report["output_bytes"].items():
+        print(f"{'output_' + profile:<24} {size / 1024:10.1f} KB")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基准结果已保存到: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"没有基准结果，使用 --save-baseline 保存: {args.baseline}")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare_with_baseline(report, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"性能退化: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,309 +1,1801 @@
-import gradio as gr
 import re
 import os
-from fontTools.ttLib import TTFont
-from fontTools.subset import Subsetter
+import argparse
+import atexit
+import base64
+import bisect
+import contextlib
+import datetime
+import functools
+import glob
+import hashlib
+import io
+import json
+import mmap
+import multiprocessing
+import queue
+try:
+    import resource
+except ImportError:
+    resource = None
+import shutil
+import socket
+import sqlite3
+import string
+import struct
+import sys
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import CancelledError, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import Counter, OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+try:
+    import py7zr
+except ImportError:
+    py7zr = None
+try:
+    from py7zr.io import Py7zIO, WriterFactory
+except ImportError:
+    # py7zr 1.0 之前没有 factory 接口
+    Py7zIO = WriterFactory = object
+try:
+    import brotli
+except ImportError:
+    brotli = None
+import fontTools
+from fontTools.ttLib import TTFont, newTable
+from fontTools.subset import Options, Subsetter
 
 # 全局变量：存储系统中所有字体的信息
 all_fonts = {}
+# 全局变量：字体文件索引，字体路径 -> {"size", "mtime_ns", "faces"}
+font_files = {}
+# 全局变量：字体名称索引，规范化的字体名称 -> [(优先级, 字体路径, 字体编号)]
+font_name_index = {}
+# 全局变量：排序后的字体名称，用于前缀匹配，索引变化时置为 None
+font_name_keys = None
+# 全局变量：字体查找和字体索引更新的锁，读取字体文件时不持有 font_index_lock，只在修改索引时短暂持有
+font_index_lock = threading.RLock()
+font_update_lock = threading.RLock()
+# 全局变量：首次通过字体索引查找字体时连接字体服务或读取字体的锁，避免多个线程同时读取
+font_index_init_lock = threading.Lock()
+# 全局变量：字体来源，是否扫描系统字体目录和用户设置的项目字体文件夹
+use_system_fonts = os.environ.get('ASSFONTSUBSET_SYSTEM_FONTS', '1') != '0'
+project_font_dirs = [font_dir for font_dir in os.environ.get('ASSFONTSUBSET_FONT_DIRS', '').split(os.pathsep) if font_dir]
+# 全局变量：上次扫描的字体目录和其中每个目录的修改时间，用于监视目录变化
+font_watched_dirs = []
+font_dir_mtimes = {}
+font_watcher = None
+font_watcher_stop = threading.Event()
+# 全局变量：压缩包中字体的读取缓存，(虚拟路径, 压缩包大小, 修改时间) -> 字体数据，按最近使用排序
+archive_font_cache = OrderedDict()
+archive_font_cache_memory = 0
+# 全局变量：已打开的 zip 压缩包和压缩包中的字体列表，压缩包路径 -> ((大小, 修改时间), 内容)
+zip_archives = OrderedDict()
+archive_listings = {}
+archive_lock = threading.RLock()
+# 全局变量：子集化进程池，在多次子集化之间复用，进程数固定，每次子集化的并行数由各自的信号量限制
+subset_executor = None
+subset_executor_workers = 0
+# 全局变量：字体缓存池和子集化进程池中各进程的压缩包缓存上限之和（字节），从内存预算中预留
+subset_cache_reserved = 0
+subset_executor_lock = threading.Lock()
+# 全局变量：子集化任务共享的内存预算（字节，0 表示不限制）和已占用的内存
+subset_memory_budget = int(os.environ.get('ASSFONTSUBSET_MEMORY_BUDGET', 0))
+subset_memory_in_use = 0
+subset_memory_condition = threading.Condition()
+# 全局变量：字体原始数据和 cmap 的缓存池，(字体路径, 字体编号) -> 缓存项，按最近使用排序
+# 字体数据放在共享内存中，所有子集化进程共用同一份，每个字体只读取一次
+font_pool = OrderedDict()
+font_pool_memory = 0
+font_pool_counters = {"hits": 0, "misses": 0, "evictions": 0}
+font_pool_lock = threading.Lock()
+# 全局变量：界面提交的子集化任务队列，用户 -> 该用户排队中的任务，按轮转顺序排列
+job_queues = OrderedDict()
+# 全局变量：未结束的子集化任务，任务编号 -> 任务
+subset_jobs = {}
+job_condition = threading.Condition()
+job_workers = []
+job_counter = 0
+# 全局变量：多个字幕同时写入同一个输出目录的构建清单时加锁，只在同一进程内有效，
+# 不同进程（如多个命令行实例）不能同时写入同一个输出目录，需要共用时应通过字体服务处理
+manifest_lock = threading.Lock()
+# 子集化字体的文件名：8位家族名称，家族中的其他字体加序号，只删除这种形式的文件
+SUBSET_OUTPUT_PATTERN = re.compile(r'[A-Z0-9]{8}(?:-\d+)?\.[A-Za-z0-9]+')
+# 全局变量：正在进行的子集化将要生成或使用的字体输出文件（绝对路径） -> 引用数，更新构建清单时不删除这些文件
+subset_output_claims = Counter()
+# 全局变量：是否尝试使用字体服务，以及正在使用的字体服务的套接字路径（None 表示在当前进程中读取字体）
+use_font_service = os.environ.get('ASSFONTSUBSET_DAEMON', '1') != '0'
+font_service_socket = None
+font_service_stop = threading.Event()
 # 标记是否已读取字体列表
 fonts_loaded = False
 
 version = "0.1.1"
 
+# ASS 内嵌字体编码表：base64 字母表中的第 i 个字符 -> chr(33 + i)
+UUENCODE_TABLE = bytes.maketrans((string.ascii_uppercase + string.ascii_lowercase + string.digits + '+/').encode('ascii'), bytes(range(33, 97)))
+# ASS 控制序列 {...}
+OVERRIDE_BLOCK_PATTERN = re.compile(r'\{([^}]*)\}')
+# 控制序列中的 \t(...) 动画，其中的标签不改变字体；动画中可以有带括号的标签，如 \t(\clip(...))
+ANIMATION_TAG_PATTERN = re.compile(r'\\t\((?:[^()]|\([^()]*\)?)*\)?')
+# 控制序列中的 \b、\i、\p 标签，参数只能是数字或为空，用于区分 \bord、\iclip、\pos 等标签
+TOGGLE_TAG_PATTERN = re.compile(r'([bip])(\d*)')
+
+# 字体文件扩展名
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc', '.TTF', '.OTF', '.TTC')
+# 字体索引缓存格式版本
+FONT_INDEX_SCHEMA_VERSION = 5
+# 需要索引的名称 ID：家族名 (1/16)、子家族名 (2/17)、全名 (4)、PostScript 名 (6)
+NAME_ID_KEYS = {1: "family_names", 16: "family_names", 2: "subfamily_names", 17: "subfamily_names", 4: "full_names", 6: "postscript_names"}
+# cmap 子表的选择顺序，与 fontTools 的 getBestCmap 一致
+CMAP_SUBTABLE_PRIORITY = ((3, 10), (0, 6), (0, 4), (3, 1), (0, 3), (0, 2), (0, 1), (0, 0))
+# 内存中保留的解压后的码位位图数
+COVERAGE_CACHE_SIZE = 256
+# 常规字重的子家族名
+REGULAR_SUBFAMILY_NAMES = {"regular", "normal", "book", "roman", "standard", "標準", "常规", "标准"}
+# 前缀匹配时允许的后缀词：只有字体名后是常规、粗体、斜体等样式名时才视为同一个字体，"Arial" 不匹配 "Arial Black"
+STYLE_SUFFIX_WORDS = REGULAR_SUBFAMILY_NAMES | {"bold", "italic", "oblique", "粗体", "斜体"}
+# 并行读取字体时每个任务处理的文件数
+SCAN_BATCH_SIZE = 64
+# 子进程的启动方式：当前进程中的其他线程（批量处理、界面任务、字体服务连接、监视线程）可能正持有锁或 SQLite 事务，
+# fork 会把这些锁的状态复制到子进程中，使子进程中的缓存数据库一直处于锁定状态，因此始终启动新的解释器
+PROCESS_CONTEXT = multiprocessing.get_context("spawn")
+# 字体压缩包扩展名和压缩包中字体的虚拟路径分隔符
+ARCHIVE_EXTENSIONS = ('.zip', '.7z')
+ARCHIVE_SEPARATOR = '::'
+# 压缩包字体读取缓存的容量上限（字节，主进程中的上限，也是所有子集化进程合计的上限）和同时打开的 zip 压缩包数
+ARCHIVE_CACHE_MAX_BYTES = int(os.environ.get('ASSFONTSUBSET_ARCHIVE_CACHE_SIZE', 128 * 1024 * 1024))
+ZIP_ARCHIVE_CACHE_SIZE = 8
+# 检查字体目录变化的间隔（秒），0 表示不监视
+FONT_WATCH_INTERVAL = float(os.environ.get('ASSFONTSUBSET_FONT_WATCH_INTERVAL', 2))
+# 子集化缓存的容量上限（字节）
+SUBSET_CACHE_MAX_BYTES = int(os.environ.get('ASSFONTSUBSET_SUBSET_CACHE_SIZE', 1024 * 1024 * 1024))
+# 字体缓存池的内存预算（字节），缓存池在主进程中，通过共享内存提供给所有子集化进程
+FONT_POOL_MAX_BYTES = int(os.environ.get('ASSFONTSUBSET_FONT_POOL_SIZE', 512 * 1024 * 1024))
+# 子集化进程池的进程数，所有子集化共用
+SUBSET_POOL_WORKERS = int(os.environ.get('ASSFONTSUBSET_POOL_WORKERS', 0)) or os.cpu_count() or 1
+# 估算子集化内存时字体文件大小的倍数
+SUBSET_MEMORY_FACTOR = 6
+SUBSET_MEMORY_FACTOR_LOW = 3
+# 子集化缓存格式版本，子集化结果变化时递增
+SUBSET_CACHE_VERSION = 4
+# 子集化配置：fontTools 子集化选项（Options 的属性），作为缓存键的一部分，所有配置都输出原格式（TTF/OTF）
+# - default：fontTools 的默认选项
+# - fastest：不对 GSUB 做字形闭包，不展开 CFF 子程序，子集化最快，只保留竖排（@字体）需要的替换字形，其他只能通过替换得到的字形会被删除
+# - smallest：删除微调指令、字形名称和多余的名称记录，展开 CFF 子程序，只保留渲染器默认启用的布局特性
+# - faithful：保留所有布局特性、脚本、名称记录、字形名称和微调指令
+SUBSET_PROFILES = {
+    "default": {},
+    "fastest": {"layout_closure": False, "desubroutinize": False},
+    "smallest": {"hinting": False, "desubroutinize": True, "glyph_names": False, "legacy_kern": False, "name_IDs": [1, 2, 3, 4, 6],
+                 # ASS 中无法开启可选特性，删除 HarfBuzz 默认不启用的特性
+                 "layout_features": [feature for feature in Options().layout_features if feature not in
+                                     ('BUZZ', 'Buzz', 'HARF', 'Harf', 'chws', 'cswh', 'dnom', 'frac', 'halt', 'jalt', 'numr', 'palt', 'rand', 'valt', 'vchw', 'vhal', 'vpal')]},
+    "faithful": {"hinting": True, "glyph_names": True, "legacy_kern": True, "notdef_outline": True, "layout_features": ["*"], "layout_scripts": ["*"],
+                 "name_IDs": ["*"], "name_languages": ["*"], "name_legacy": True},
+}
+# 默认的子集化配置
+SUBSET_PROFILE = os.environ.get('ASSFONTSUBSET_PROFILE', 'default')
+# 可选的压缩输出格式："woff" 为 zlib 压缩，"woff2" 需要 brotli；VSFilter 等使用 GDI 的渲染器和很多播放器不能加载，默认不使用，也不能内嵌到字幕中
+SUBSET_FLAVORS = ("woff", "woff2")
+# 竖排（@字体）时渲染器启用的 GSUB 特性，不做字形闭包时也保留其替换字形
+VERTICAL_FEATURES = ("vert", "vrt2")
+# 同时运行的界面子集化任务数，每个任务内部仍使用子集化进程池并行处理字体
+JOB_WORKERS = int(os.environ.get('ASSFONTSUBSET_JOB_WORKERS', 2))
+# 输出目录中的构建清单文件名和格式版本，格式变化时递增
+MANIFEST_FILE = 'subset_manifest.json'
+MANIFEST_VERSION = 4
+
+# 样式中 Bold 字段或 \b 标签的值对应的字重：1 或 -1 为粗体，0 为常规，大于 1 时为字重数值，无法解析时返回 default
+def parse_weight(value, default=400):
+    try:
+        value = int(value)
+    except ValueError:
+        return default
+    if value in (1, -1):
+        return 700
+    return 400 if value <= 0 else value
+
+# 样式中 Italic 字段或 \i 标签的值是否为斜体，无法解析时返回 default
+def parse_italic(value, default=False):
+    try:
+        return int(value) != 0
+    except ValueError:
+        return default
+
 # 解析带样式的文本
-def parse_text_with_style(style: str, text: str) -> dict:
+def parse_text_with_style(style: tuple, text: str, result: dict = None, styles: dict = None) -> dict:
     R"""
-    解析带 {\...} 控制序列的文本，支持 \fn 字体切换。
+    解析带 {\...} 控制序列的文本，按 (字体名, 字重, 斜体) 统计字符。
     
-    - 默认使用传入的 style。
-    - 遇到 {...} 时，尝试从中提取 \fn<font>。
-    - 字体名从 \fn 后开始，直到遇到 \ 或 } 为止。
-    - {...} 本身不输出字符，仅用于切换样式。
-    - {...} 后的普通文本按当前样式拆分为字符列表存入 dict。
+    - style 为行样式的 (字体名, 字重, 斜体)，styles 为 样式名 -> (字体名, 字重, 斜体)，用于 \rStyle。
+    - \fn 切换字体，\fn 后为空时恢复样式字体，字体名前的 @ 符号被忽略。
+    - \b、\i 切换字重和斜体，没有参数时恢复样式中的设置。
+    - \r 恢复为行样式，\rStyle 恢复为指定样式，样式不存在时使用行样式。
+    - \p1 及以上进入绘图模式，绘图命令不计入字符，\p0 恢复文字。
+    - \t(...) 中的标签只用于动画，不改变字体。
+    - {...} 后的普通文本按当前状态加入 result 中对应字体的字符集合。
     """
+    if result is None:
+        result = {}
+    if styles is None:
+        styles = {}
     text = text.replace("\\n", "").replace("\\N", "").replace("\\h", "") # 去除换行和空格控制符
-    result = {}
-    current_style = style
-    current_chars = []
+    base_style = style
+    font_name, weight, italic = style
+    drawing = False
     
     # 用于遍历：记录上一个处理位置
     pos = 0
-    n = len(text)
-    
-    while pos < n:
-        # 查找下一个 '{'
-        brace_start = text.find('{', pos)
-        if brace_start == -1:
-            # 没有更多 {，剩余全是普通文本
-            remaining = text[pos:]
-            current_chars.extend(list(remaining))
-            break
+    for block in OVERRIDE_BLOCK_PATTERN.finditer(text):
+        # 先处理 '{' 之前的内容（普通文本），绘图模式中的内容是绘图命令
+        if block.start() > pos and not drawing:
+            result.setdefault((font_name, weight, italic), set()).update(text[pos:block.start()])
+        pos = block.end()
         
-        # 先处理 '{' 之前的内容（普通文本）
-        plain_text = text[pos:brace_start]
-        if plain_text:
-            current_chars.extend(list(plain_text))
-        
-        # 查找匹配的 '}'
-        brace_end = text.find('}', brace_start)
-        if brace_end == -1:
-            # 没有闭合 }，将剩余全部视为普通文本（或报错，这里保守处理）
-            remaining = text[brace_start:]
-            current_chars.extend(list(remaining))
-            break
-        
-        # 提取 {...} 内容
-        control_block = text[brace_start + 1:brace_end]
-        
-        # 在 control_block 中查找 \fn
-        # 使用正则：匹配 \fn 后接非 \ 和非 } 的字符序列
-        fn_match = re.search(r'\\fn([^\\}]*)', control_block)
-        if fn_match:
-            font_name = fn_match.group(1).strip()
-            if font_name:
-                # 忽略前面的 @ 符号
-                if font_name.startswith('@'):
-                    font_name = font_name[1:]
-                # 保存当前已收集的字符
-                if current_chars:
-                    result.setdefault(current_style, []).extend(current_chars)
-                    current_chars = []
-                # 切换样式
-                current_style = font_name
-        
-        # 更新 pos 到 } 之后
-        pos = brace_end + 1
+        # 按顺序处理 {...} 中的标签，后面的标签覆盖前面的
+        control_block = block.group(1)
+        if '\\' not in control_block:
+            continue
+        for tag in ANIMATION_TAG_PATTERN.sub('', control_block).split('\\')[1:]:
+            tag = tag.strip()
+            if tag.startswith('fn'):
+                name = tag[2:].strip()
+                font_name = name.lstrip('@') if name else style[0]
+            elif match := TOGGLE_TAG_PATTERN.fullmatch(tag):
+                name, value = match.groups()
+                if name == 'b':
+                    weight = parse_weight(value, style[1])
+                elif name == 'i':
+                    italic = parse_italic(value, style[2])
+                else:
+                    drawing = value != '' and int(value) > 0
+            elif tag.startswith('r') and not tag.startswith('rnd'):
+                style = styles.get(tag[1:].strip(), base_style) if tag[1:].strip() else base_style
+                font_name, weight, italic = style
     
-    # 处理最后剩余的字符
-    if current_chars:
-        result.setdefault(current_style, []).extend(current_chars)
+    # 处理最后剩余的字符，没有闭合 } 的 { 视为普通文本
+    if pos < len(text) and not drawing:
+        result.setdefault((font_name, weight, italic), set()).update(text[pos:])
     
     return result
 
-# 解析 ASS 字幕文件
-def parse_ass_file(file_path):
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = f.read()
-    lines = data.splitlines()
+# 读取 Format 行中的字段顺序，返回字段名（小写） -> 位置
+def parse_format_line(line):
+    fields = [field.strip().lower() for field in line[len("Format:"):].split(",")]
+    return {field: i for i, field in enumerate(fields)}, len(fields)
 
-    styles = {}
-    dialogues = {}
-
-    for line in lines:
+# 逐行解析 ASS 字幕
+def iter_ass_dialogues(lines, styles=None):
+    R"""
+    逐行解析 ASS 字幕，产出每个对话行的 (行号, 样式的 (字体名, 字重, 斜体), 文本)。
+    
+    - lines 可以是打开的文件对象，整个文件不需要读入内存。
+    - 遇到 Style 行时将 样式名 -> (字体名, 字重, 斜体) 写入 styles。
+    - 按 [V4+ Styles] 和 [Events] 中的 Format 行确定字段位置，没有 Format 行时使用标准字段顺序。
+    - 样式不存在的对话行会被跳过。
+    """
+    if styles is None:
+        styles = {}
+    style_fields, style_count = {"name": 0, "fontname": 1, "bold": 7, "italic": 8}, 23
+    event_fields, event_count = {"style": 3, "text": 9}, 10
+    section = ""
+    
+    for line_number, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
+        if line.startswith("["):
+            section = line.strip().lower()
+            continue
+        
+        if line.startswith("Format:"):
+            if section == "[events]":
+                event_fields, event_count = parse_format_line(line)
+            elif section.endswith("styles]"):
+                style_fields, style_count = parse_format_line(line)
+            continue
+        
         if line.startswith("Style:"):
-            style_data = line[len("Style:"):].strip().split(",")
-            if len(style_data) > 1:
-                style_name = style_data[0].strip()
-                font_name = style_data[1].strip()
+            style_data = line[len("Style:"):].split(",", style_count - 1)
+            name_index = style_fields.get("name", 0)
+            font_index = style_fields.get("fontname", 1)
+            bold_index = style_fields.get("bold")
+            italic_index = style_fields.get("italic")
+            if len(style_data) > max(name_index, font_index):
+                style_name = style_data[name_index].strip()
+                font_name = style_data[font_index].strip()
                 # 忽略前面的 @ 符号
                 if font_name.startswith('@'):
                     font_name = font_name[1:]
-                styles[style_name] = font_name
+                weight = parse_weight(style_data[bold_index]) if bold_index is not None and bold_index < len(style_data) else 400
+                italic = parse_italic(style_data[italic_index]) if italic_index is not None and italic_index < len(style_data) else False
+                styles[style_name] = (font_name, weight, italic)
             continue
         
         if line.startswith("Dialogue:"):
-            dialogue_data = line[len("Dialogue:"):].strip().split(",", 9)
-            if len(dialogue_data) > 9:
-                style_name = dialogue_data[3].strip()
-                text = dialogue_data[9].strip()
-                if style_name in styles:
-                    parsed = parse_text_with_style(styles[style_name], text)
-                    for style, chars in parsed.items():
-                        dialogues.setdefault(style, []).extend(chars)
-            continue
+            # 文本是最后一个字段，可能包含逗号
+            dialogue_data = line[len("Dialogue:"):].split(",", event_count - 1)
+            style_index = event_fields.get("style", 3)
+            text_index = event_fields.get("text", event_count - 1)
+            if len(dialogue_data) > max(style_index, text_index):
+                style = styles.get(dialogue_data[style_index].strip())
+                if style is not None:
+                    yield line_number, style, dialogue_data[text_index].strip()
 
-    # 去重
-    for style in dialogues:
-        dialogues[style] = list(set(dialogues[style]))
-    
+# 逐行解析 ASS 字幕，产出每个对话行的 (行号, (字体名, 字重, 斜体) -> 字符集合)
+def iter_ass_dialogue_chars(lines, styles=None):
+    if styles is None:
+        styles = {}
+    for line_number, style, text in iter_ass_dialogues(lines, styles):
+        yield line_number, parse_text_with_style(style, text, styles=styles)
+
+# 解析 ASS 字幕行，返回 (样式名 -> (字体名, 字重, 斜体), (字体名, 字重, 斜体) -> 字符集合)
+def parse_ass_lines(lines):
+    styles = {}
+    dialogues = {}
+    for _, style, text in iter_ass_dialogues(lines, styles):
+        parse_text_with_style(style, text, dialogues, styles)
     return styles, dialogues
 
-# 读取系统中所有字体的信息
-def load_all_fonts():
-    global all_fonts
-    global fonts_loaded
+# 字体的显示名称：常规字重且非斜体时为字体名，否则在后面注明字重和斜体，如 "Arial (Bold Italic)"
+def face_label(face):
+    font_name, weight, italic = face
+    parts = []
+    if weight != 400:
+        parts.append("Bold" if weight == 700 else f"W{weight}")
+    if italic:
+        parts.append("Italic")
+    return f"{font_name} ({' '.join(parts)})" if parts else font_name
+
+# 解析 ASS 字幕文件
+def parse_ass_file(file_path):
+    with open(file_path, "r", encoding="utf-8-sig") as f:
+        return parse_ass_lines(f)
+
+# 字体索引缓存的存放目录
+def get_cache_dir():
+    cache_dir = os.environ.get('ASSFONTSUBSET_CACHE_DIR')
+    if not cache_dir:
+        if os.name == 'nt':
+            base_dir = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        else:
+            base_dir = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+        cache_dir = os.path.join(base_dir, 'py-AssFontSubset')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+# 打开字体索引缓存数据库
+def open_font_index_db():
+    db = sqlite3.connect(os.path.join(get_cache_dir(), 'font_index.db'), timeout=30)
+    # 缓存格式变化时直接重建
+    if db.execute('PRAGMA user_version').fetchone()[0] != FONT_INDEX_SCHEMA_VERSION:
+        db.execute('DROP TABLE IF EXISTS font_files')
+        db.execute(f'PRAGMA user_version = {FONT_INDEX_SCHEMA_VERSION}')
+    db.execute('CREATE TABLE IF NOT EXISTS font_files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, faces TEXT NOT NULL)')
+    return db
+
+# 读取 fontconfig 配置中的字体目录，跟随 <include> 引用的配置文件和目录
+def fontconfig_font_dirs(conf_path=None, visited=None):
+    import xml.etree.ElementTree as ElementTree
     
-    all_fonts = {}
-    fonts_loaded = False
+    if conf_path is None:
+        conf_path = os.environ.get('FONTCONFIG_FILE') or os.path.join(os.environ.get('FONTCONFIG_PATH', '/etc/fonts'), 'fonts.conf')
+    if visited is None:
+        visited = set()
+    conf_path = os.path.realpath(conf_path)
+    if conf_path in visited:
+        return []
+    visited.add(conf_path)
     
-    try:
-        # 字体目录列表
+    # include 可以是目录，读取其中所有 .conf 文件
+    if os.path.isdir(conf_path):
         font_dirs = []
-        
+        for name in sorted(os.listdir(conf_path)):
+            if name.endswith('.conf'):
+                font_dirs.extend(fontconfig_font_dirs(os.path.join(conf_path, name), visited))
+        return font_dirs
+    try:
+        root = ElementTree.parse(conf_path).getroot()
+    except (OSError, ElementTree.ParseError):
+        return []
+    
+    def expand(element):
+        path = (element.text or '').strip()
+        prefix = element.get('prefix')
+        if prefix == 'xdg':
+            # <dir> 相对于 XDG_DATA_HOME，<include> 相对于 XDG_CONFIG_HOME
+            if element.tag == 'dir':
+                base = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+            else:
+                base = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+            return os.path.join(base, path)
+        if path.startswith('~'):
+            return os.path.expanduser(path)
+        if prefix == 'relative' or (element.tag == 'include' and not os.path.isabs(path)):
+            return os.path.join(os.path.dirname(conf_path), path)
+        return path
+    
+    font_dirs = []
+    for element in root:
+        if element.tag == 'dir' and element.text:
+            font_dirs.append(expand(element))
+        elif element.tag == 'include' and element.text:
+            font_dirs.extend(fontconfig_font_dirs(expand(element), visited))
+    return font_dirs
+
+# 当前系统的字体目录
+def system_font_dirs():
+    if sys.platform == 'win32':
         # 1. 系统字体目录
         system_fonts_dir = os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts')
-        if os.path.exists(system_fonts_dir):
-            font_dirs.append(system_fonts_dir)
-        
         # 2. 用户字体目录
         user_fonts_dir = os.path.join(os.environ.get('LOCALAPPDATA', 'C:\\Users\\Default\\AppData\\Local'), 'Microsoft\\Windows\\Fonts')
-        if os.path.exists(user_fonts_dir):
-            font_dirs.append(user_fonts_dir)
-        
-        total_font_files = 0
-        processed_files = 0
-        
-        print(f"开始读取系统字体，共 {len(font_dirs)} 个字体目录...")
-        
-        # 统计所有字体文件
-        all_font_files = []
-        for fonts_dir in font_dirs:
-            font_files = [os.path.join(fonts_dir, file) for file in os.listdir(fonts_dir) if file.endswith(('.ttf', '.otf', '.ttc', '.TTF', '.OTF', '.TTC'))]
-            all_font_files.extend(font_files)
-        
-        total_font_files = len(all_font_files)
-        print(f"发现 {total_font_files} 个字体文件...")
-        
-        # 处理所有字体文件
-        for font_path in all_font_files:
-            try:
-                file = os.path.basename(font_path)
-                # 处理 TTC 文件（TrueType Collection）
-                if file.endswith(('.ttc', '.TTC')):
-                    # 尝试读取 TTC 文件中的第一个字体
-                    font = TTFont(font_path, fontNumber=0)
-                    # 获取字体名称
-                    for record in font['name'].names:
-                        if record.nameID == 4:  # 字体全名
-                            try:
-                                font_full_name = record.toUnicode()
-                                all_fonts[font_full_name] = font_path
-                            except:
-                                pass
-                    # 尝试读取 TTC 文件中的第二个字体
+        return [system_fonts_dir, user_fonts_dir]
+    if sys.platform == 'darwin':
+        return ['/System/Library/Fonts', '/Library/Fonts', os.path.expanduser('~/Library/Fonts')]
+    # Linux 等系统：fontconfig 配置的目录和常见的默认目录
+    data_home = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+    return fontconfig_font_dirs() + ['/usr/share/fonts', '/usr/local/share/fonts', os.path.join(data_home, 'fonts'), os.path.expanduser('~/.fonts')]
+
+# 设置字体来源：项目字体文件夹和是否扫描系统字体目录，返回设置后的字体目录
+def configure_font_sources(font_dirs, system_fonts=True):
+    global use_system_fonts
+    
+    use_system_fonts = system_fonts
+    project_font_dirs[:] = [os.path.abspath(os.path.expanduser(font_dir.strip())) for font_dir in font_dirs if font_dir.strip()]
+    return get_font_dirs()
+
+# 获取需要扫描的字体目录：系统字体目录和项目字体文件夹，去掉不存在、重复和嵌套在其他目录中的目录
+def get_font_dirs():
+    candidates = (system_font_dirs() if use_system_fonts else []) + project_font_dirs
+    font_dirs = []
+    for font_dir in dict.fromkeys(os.path.realpath(font_dir) for font_dir in candidates):
+        if os.path.isdir(font_dir):
+            font_dirs.append(font_dir)
+    # 子目录会被递归扫描，不需要单独列出
+    return [font_dir for font_dir in font_dirs
+            if not any(font_dir != other and font_dir.startswith(os.path.join(other, '')) for other in font_dirs)]
+
+# 拆分字体路径：压缩包中的字体使用虚拟路径 "压缩包路径::成员名"，普通字体文件返回 (路径, None)
+def split_font_path(font_path):
+    archive_path, separator, member = font_path.partition(ARCHIVE_SEPARATOR)
+    if not separator or not archive_path.lower().endswith(ARCHIVE_EXTENSIONS):
+        return font_path, None
+    return archive_path, member
+
+# 打开 zip 压缩包，已打开的压缩包按路径缓存，压缩包变化时重新打开
+def open_zip_archive(archive_path):
+    stat = os.stat(archive_path)
+    with archive_lock:
+        entry = zip_archives.get(archive_path)
+        if entry is not None and entry[0] == (stat.st_size, stat.st_mtime_ns):
+            zip_archives.move_to_end(archive_path)
+            return entry[1]
+        if entry is not None:
+            entry[1].close()
+        archive = zipfile.ZipFile(archive_path)
+        zip_archives[archive_path] = ((stat.st_size, stat.st_mtime_ns), archive)
+        while len(zip_archives) > ZIP_ARCHIVE_CACHE_SIZE:
+            zip_archives.popitem(last=False)[1][1].close()
+        return archive
+
+# 列出压缩包中的字体文件：成员名 -> 大小，stat 为压缩包的状态，压缩包未变化时使用上次的结果
+def list_archive_fonts(archive_path, stat=None):
+    if stat is None:
+        stat = os.stat(archive_path)
+    with archive_lock:
+        entry = archive_listings.get(archive_path)
+        if entry is not None and entry[0] == (stat.st_size, stat.st_mtime_ns):
+            return entry[1]
+    if archive_path.lower().endswith('.7z'):
+        if py7zr is None:
+            print(f"需要安装 py7zr 才能读取 7z 压缩包: {archive_path}")
+            return {}
+        with py7zr.SevenZipFile(archive_path, 'r') as archive:
+            members = {info.filename: info.uncompressed for info in archive.list() if not info.is_directory}
+    else:
+        members = {info.filename: info.file_size for info in open_zip_archive(archive_path).infolist() if not info.is_dir()}
+    members = {member: size for member, size in members.items() if member.endswith(FONT_EXTENSIONS)}
+    with archive_lock:
+        archive_listings[archive_path] = ((stat.st_size, stat.st_mtime_ns), members)
+    return members
+
+# 7z 成员的解压目标：写满预期大小后把数据交给 callback(成员名, 数据)，随即释放
+class SevenZipMemberWriter(io.BytesIO, Py7zIO):
+    def __init__(self, member, expected_size, callback):
+        super().__init__()
+        self.member = member
+        self.expected_size = expected_size
+        self.callback = callback
+        self.written = 0
+        self.done = False
+    
+    def write(self, data):
+        written = super().write(data)
+        self.written += written
+        if self.expected_size and self.written >= self.expected_size:
+            self.finish()
+        return written
+    
+    def size(self):
+        return self.written
+    
+    def finish(self):
+        if self.done:
+            return
+        self.done = True
+        data = self.getvalue()
+        self.seek(0)
+        self.truncate()
+        self.callback(self.member, data)
+
+# 为 py7zr 的 extract(factory=...) 创建解压目标
+class SevenZipMemberFactory(WriterFactory):
+    def __init__(self, sizes, callback):
+        self.sizes = sizes
+        self.callback = callback
+        self.products = []
+    
+    def create(self, filename):
+        product = SevenZipMemberWriter(filename, self.sizes.get(filename, 0), self.callback)
+        self.products.append(product)
+        return product
+    
+    # 交出大小未知或未写满的成员
+    def finish(self):
+        for product in self.products:
+            product.finish()
+        self.products.clear()
+
+# 顺序解压 7z 压缩包中的多个成员，每个成员解压完成后调用 callback(成员名, 数据)
+# 固实压缩的 7z 不能单独读取某个成员，一次顺序解压可以避免重复解压前面的数据，且同时只保留一个成员的数据
+# py7zr 1.0 起移除了 read()，改为通过 extract(factory=...) 逐个接收解压出的成员
+def stream_7z_members(archive_path, members, callback):
+    if py7zr is None:
+        raise ValueError(f"需要安装 py7zr 才能读取 7z 压缩包: {archive_path}")
+    with py7zr.SevenZipFile(archive_path, 'r') as archive:
+        if hasattr(archive, 'read'):
+            # 旧版本只能一次读出所有成员
+            results = archive.read(members)
+            for member in list(results):
+                callback(member, results.pop(member).read())
+            return
+        factory = SevenZipMemberFactory(list_archive_fonts(archive_path), callback)
+        archive.extract(targets=members, factory=factory)
+        factory.finish()
+
+# 从 7z 压缩包中一次读出多个成员：成员名 -> 数据
+def read_7z_members(archive_path, members):
+    results = {}
+    stream_7z_members(archive_path, members, results.__setitem__)
+    for member in members:
+        if member not in results:
+            raise ValueError(f"压缩包中找不到字体: {archive_path}{ARCHIVE_SEPARATOR}{member}")
+    return results
+
+# 读取压缩包中完整的字体数据，cache 为真时放入按最近使用淘汰的缓存，供重复子集化使用
+def read_archive_font(font_path, cache=True):
+    global archive_font_cache_memory
+    
+    archive_path, member = split_font_path(font_path)
+    stat = os.stat(archive_path)
+    key = (font_path, stat.st_size, stat.st_mtime_ns)
+    with archive_lock:
+        data = archive_font_cache.get(key)
+        if data is not None:
+            archive_font_cache.move_to_end(key)
+            return data
+    
+    if archive_path.lower().endswith('.7z'):
+        data = read_7z_members(archive_path, [member])[member]
+    else:
+        with archive_lock:
+            data = open_zip_archive(archive_path).read(member)
+    if cache and len(data) <= ARCHIVE_CACHE_MAX_BYTES:
+        with archive_lock:
+            if key not in archive_font_cache:
+                archive_font_cache[key] = data
+                archive_font_cache_memory += len(data)
+            while archive_font_cache_memory > ARCHIVE_CACHE_MAX_BYTES:
+                archive_font_cache_memory -= len(archive_font_cache.popitem(last=False)[1])
+    return data
+
+# 字体文件的 (大小, 修改时间)，压缩包中的字体使用成员大小和压缩包的修改时间
+def font_file_stat(font_path):
+    archive_path, member = split_font_path(font_path)
+    stat = os.stat(archive_path)
+    if member is None:
+        return stat.st_size, stat.st_mtime_ns
+    members = list_archive_fonts(archive_path, stat)
+    if member not in members:
+        raise FileNotFoundError(f"压缩包中没有该字体: {font_path}")
+    return members[member], stat.st_mtime_ns
+
+# 打开字体文件用于读取，stream 为真时以流的方式读取 zip 压缩包中的字体，只解压读到的部分，不放入缓存
+@contextlib.contextmanager
+def open_font_file(font_path, stream=False):
+    archive_path, member = split_font_path(font_path)
+    if member is None:
+        with open(font_path, 'rb') as f:
+            yield f
+    elif stream and not archive_path.lower().endswith('.7z'):
+        # 复用已打开的压缩包，避免每个字体重新读取压缩包目录
+        with archive_lock, open_zip_archive(archive_path).open(member) as f:
+            yield f
+    else:
+        yield io.BytesIO(read_archive_font(font_path, cache=not stream))
+
+# 递归列出字体目录中的所有字体文件：路径 -> (大小, 修改时间)，压缩包中的字体使用虚拟路径
+# dir_mtimes 不为空时记录扫描过的每个目录的修改时间，用于监视目录变化
+def list_font_files(font_dirs, dir_mtimes=None):
+    font_files = {}
+    visited = set()
+    pending = list(font_dirs)
+    while pending:
+        fonts_dir = pending.pop()
+        try:
+            stat = os.stat(fonts_dir)
+            # 跳过符号链接造成的重复目录
+            if (stat.st_dev, stat.st_ino) in visited:
+                continue
+            visited.add((stat.st_dev, stat.st_ino))
+            if dir_mtimes is not None:
+                dir_mtimes[fonts_dir] = stat.st_mtime_ns
+            with os.scandir(fonts_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        pending.append(entry.path)
+                        continue
+                    archive = entry.name.lower().endswith(ARCHIVE_EXTENSIONS)
+                    if not archive and not entry.name.endswith(FONT_EXTENSIONS):
+                        continue
                     try:
-                        font = TTFont(font_path, fontNumber=1)
-                        # 获取字体名称
-                        for record in font['name'].names:
-                            if record.nameID == 4:  # 字体全名
-                                try:
-                                    font_full_name = record.toUnicode()
-                                    all_fonts[font_full_name] = font_path
-                                except:
-                                    pass
-                    except:
-                        pass
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    if not archive:
+                        font_files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                        continue
+                    # 压缩包只读取目录，字体名称在扫描时从压缩包中读取
+                    try:
+                        members = list_archive_fonts(entry.path, stat)
+                    except Exception as e:
+                        print(f"读取字体压缩包时出错: {entry.path}: {e}")
+                        continue
+                    for member, size in members.items():
+                        font_files[f"{entry.path}{ARCHIVE_SEPARATOR}{member}"] = (size, stat.st_mtime_ns)
+        except OSError:
+            continue
+    return font_files
+
+# 从 sfnt 字体中读取多个表的原始数据：表标签 -> 数据，按表在文件中的位置顺序读取，流式读取时不需要回退
+def read_sfnt_tables(f, offset, tags):
+    f.seek(offset)
+    sfnt_header = f.read(12)
+    if len(sfnt_header) < 12:
+        raise ValueError("字体文件头不完整")
+    num_tables = struct.unpack('>H', sfnt_header[4:6])[0]
+    table_records = f.read(16 * num_tables)
+    records = []
+    for i in range(len(table_records) // 16):
+        record_tag, _, table_offset, length = struct.unpack_from('>4sIII', table_records, i * 16)
+        if record_tag in tags:
+            records.append((table_offset, length, record_tag))
+    tables = {}
+    for table_offset, length, record_tag in sorted(records):
+        f.seek(table_offset)
+        tables[record_tag] = f.read(length)
+    return tables
+
+# 读取字体文件中每个字体在文件中的起始位置，TTC 文件通过文件头列出所有字体
+def read_sfnt_offsets(f):
+    f.seek(0)
+    header = f.read(12)
+    if header[:4] == b'ttcf':
+        num_fonts = struct.unpack('>I', header[8:12])[0]
+        return struct.unpack(f'>{num_fonts}I', f.read(4 * num_fonts))
+    return (0,)
+
+# 解析 name 表，读取所有语言记录中的家族名、子家族名、全名和 PostScript 名
+def parse_name_table(data):
+    name_table = newTable('name')
+    name_table.decompile(data, None)
+    names = {key: [] for key in NAME_ID_KEYS.values()}
+    for record in name_table.names:
+        key = NAME_ID_KEYS.get(record.nameID)
+        if key is None:
+            continue
+        try:
+            names[key].append(record.toUnicode())
+        except Exception:
+            pass
+    # 同一名称可能在多个平台和语言的记录中重复出现
+    return {key: list(dict.fromkeys(values)) for key, values in names.items()}
+
+# 将位图中 start 到 end（包含）的位置为 1
+def set_bit_range(bits, start, end):
+    first_byte, last_byte = start >> 3, end >> 3
+    if first_byte == last_byte:
+        bits[first_byte] |= (0xFF << (start & 7)) & (0xFF >> (7 - (end & 7)))
+        return
+    bits[first_byte] |= (0xFF << (start & 7)) & 0xFF
+    bits[first_byte + 1:last_byte] = b'\xff' * (last_byte - first_byte - 1)
+    bits[last_byte] |= 0xFF >> (7 - (end & 7))
+
+# 解析 cmap 表，返回字体包含的码位位图（第 n 位表示码位 n），只解析 fontTools getBestCmap 会选择的 Unicode 子表
+def parse_cmap_coverage(data):
+    num_tables = struct.unpack_from('>H', data, 2)[0]
+    subtables = {}
+    for i in range(num_tables):
+        platform_id, encoding_id, offset = struct.unpack_from('>HHI', data, 4 + 8 * i)
+        subtables.setdefault((platform_id, encoding_id), offset)
+    for key in CMAP_SUBTABLE_PRIORITY:
+        offset = subtables.get(key)
+        if offset is None:
+            continue
+        coverage = parse_cmap_subtable(data, offset)
+        if coverage is not None:
+            return coverage
+    return bytearray()
+
+# 解析单个 cmap 子表（格式 0、4、6、12、13），不支持的格式返回 None
+def parse_cmap_subtable(data, offset):
+    fmt = struct.unpack_from('>H', data, offset)[0]
+    codepoints = []
+    ranges = []
+    if fmt == 0:
+        codepoints = [code for code, glyph in enumerate(data[offset + 6:offset + 262]) if glyph]
+    elif fmt == 4:
+        seg_count = struct.unpack_from('>H', data, offset + 6)[0] // 2
+        ends_offset = offset + 14
+        starts_offset = ends_offset + 2 * seg_count + 2
+        deltas_offset = starts_offset + 2 * seg_count
+        range_offsets_offset = deltas_offset + 2 * seg_count
+        ends = struct.unpack_from(f'>{seg_count}H', data, ends_offset)
+        starts = struct.unpack_from(f'>{seg_count}H', data, starts_offset)
+        deltas = struct.unpack_from(f'>{seg_count}H', data, deltas_offset)
+        range_offsets = struct.unpack_from(f'>{seg_count}H', data, range_offsets_offset)
+        for i in range(seg_count):
+            start, end = starts[i], ends[i]
+            # 最后一段 0xFFFF 只是结束标记
+            if start == 0xFFFF or start > end:
+                continue
+            if range_offsets[i] == 0:
+                # 映射到字形 0 的码位视为缺字
+                missing = (-deltas[i]) & 0xFFFF
+                if start <= missing <= end:
+                    if start < missing:
+                        ranges.append((start, missing - 1))
+                    if missing < end:
+                        ranges.append((missing + 1, end))
                 else:
-                    # 处理普通字体文件
-                    font = TTFont(font_path)
-                    # 获取字体名称
-                    for record in font['name'].names:
-                        if record.nameID == 4:  # 字体全名
-                            try:
-                                font_full_name = record.toUnicode()
-                                all_fonts[font_full_name] = font_path
-                            except:
-                                pass
-            except Exception as font_error:
-                # 字体文件读取失败，跳过
-                pass
+                    ranges.append((start, end))
+                continue
+            glyphs_offset = range_offsets_offset + 2 * i + range_offsets[i]
+            count = min(end - start + 1, max((len(data) - glyphs_offset) // 2, 0))
+            glyphs = struct.unpack_from(f'>{count}H', data, glyphs_offset)
+            codepoints.extend(start + j for j, glyph in enumerate(glyphs) if glyph)
+    elif fmt == 6:
+        first_code, entry_count = struct.unpack_from('>HH', data, offset + 6)
+        glyphs = struct.unpack_from(f'>{entry_count}H', data, offset + 10)
+        codepoints = [first_code + j for j, glyph in enumerate(glyphs) if glyph]
+    elif fmt in (12, 13):
+        num_groups = struct.unpack_from('>I', data, offset + 12)[0]
+        for i in range(num_groups):
+            start, end, glyph = struct.unpack_from('>III', data, offset + 16 + 12 * i)
+            if end > 0x10FFFF or start > end:
+                continue
+            # 格式 12 中字形 0 只影响组内第一个码位，格式 13 中整组映射到同一个字形
+            if glyph == 0 and (fmt == 13 or start == end):
+                continue
+            if glyph == 0:
+                start += 1
+            ranges.append((start, end))
+    else:
+        return None
+    
+    max_code = max([end for _, end in ranges] + codepoints + [-1])
+    bits = bytearray((max_code >> 3) + 1 if max_code >= 0 else 0)
+    for start, end in ranges:
+        set_bit_range(bits, start, end)
+    for code in codepoints:
+        bits[code >> 3] |= 1 << (code & 7)
+    return bits
+
+# 压缩码位位图，保存在字体索引中
+def encode_coverage(bits):
+    return base64.b64encode(zlib.compress(bytes(bits), 9)).decode('ascii')
+
+# 解压码位位图，最近使用的位图保留在内存中
+@functools.lru_cache(maxsize=COVERAGE_CACHE_SIZE)
+def decode_coverage(encoded):
+    return zlib.decompress(base64.b64decode(encoded))
+
+# 位图中是否包含码位
+def coverage_contains(bits, code):
+    return (code >> 3) < len(bits) and bits[code >> 3] >> (code & 7) & 1
+
+# 读取字体的字重和是否为斜体：优先使用 OS/2 表的 usWeightClass 和 fsSelection，没有 OS/2 表时使用 head 表的 macStyle
+def parse_face_style(os2_data, head_data):
+    if os2_data and len(os2_data) >= 64:
+        weight, = struct.unpack_from('>H', os2_data, 4)
+        fs_selection, = struct.unpack_from('>H', os2_data, 62)
+        return weight or 400, bool(fs_selection & 0x01)
+    if head_data and len(head_data) >= 46:
+        mac_style, = struct.unpack_from('>H', head_data, 44)
+        return (700 if mac_style & 0x01 else 400), bool(mac_style & 0x02)
+    return 400, False
+
+# 读取单个字体文件中各个字体的名称、字重、斜体和码位位图，只解析 name、cmap、OS/2 和 head 表，
+# data 不为空时从已读出的字体数据中读取
+def read_font_faces(font_path, data=None):
+    faces = []
+    with (io.BytesIO(data) if data is not None else open_font_file(font_path, stream=True)) as f:
+        for index, offset in enumerate(read_sfnt_offsets(f)):
+            tables = read_sfnt_tables(f, offset, (b'name', b'cmap', b'OS/2', b'head'))
+            if not tables.get(b'name'):
+                continue
+            face = parse_name_table(tables[b'name'])
+            face["index"] = index
+            face["weight"], face["italic"] = parse_face_style(tables.get(b'OS/2'), tables.get(b'head'))
+            # 无法解析 cmap 时不检查缺字
+            try:
+                face["coverage"] = encode_coverage(parse_cmap_coverage(tables[b'cmap'])) if tables.get(b'cmap') else None
+            except (struct.error, IndexError):
+                face["coverage"] = None
+            faces.append(face)
+    return faces
+
+# 在子进程中读取一批字体文件，读取失败的文件记录为 None
+def scan_font_batch(font_paths):
+    results = []
+    for font_path in font_paths:
+        try:
+            faces = read_font_faces(font_path)
+        except Exception as e:
+            print(f"读取字体文件时出错: {font_path}: {e}")
+            faces = None
+        results.append((font_path, faces))
+    return results
+
+# 在子进程中顺序解压一个 7z 压缩包，每个成员解压出来后立即读取字体信息并丢弃数据
+def scan_7z_archive(archive_path, members):
+    faces_by_member = {}
+    def scan_member(member, data):
+        font_path = f"{archive_path}{ARCHIVE_SEPARATOR}{member}"
+        try:
+            faces_by_member[member] = read_font_faces(font_path, data)
+        except Exception as e:
+            print(f"读取字体文件时出错: {font_path}: {e}")
+    try:
+        stream_7z_members(archive_path, members, scan_member)
+    except Exception as e:
+        print(f"读取字体压缩包时出错: {archive_path}: {e}")
+    return [(f"{archive_path}{ARCHIVE_SEPARATOR}{member}", faces_by_member.get(member)) for member in members]
+
+# 并行读取字体文件，progress(已处理数, 总数) 用于报告进度
+def scan_font_files(font_paths, progress=None, max_workers=None):
+    total = len(font_paths)
+    processed = 0
+    # 同一个 7z 压缩包中的字体作为一个任务，只解压一遍
+    sevenzip_members = {}
+    other_paths = []
+    for font_path in font_paths:
+        archive_path, member = split_font_path(font_path)
+        if member is not None and archive_path.lower().endswith('.7z'):
+            sevenzip_members.setdefault(archive_path, []).append(member)
+        else:
+            other_paths.append(font_path)
+    tasks = [(scan_7z_archive, archive_path, members) for archive_path, members in sevenzip_members.items()]
+    tasks += [(scan_font_batch, other_paths[i:i + SCAN_BATCH_SIZE]) for i in range(0, len(other_paths), SCAN_BATCH_SIZE)]
+    # 文件较少时直接在当前进程读取，省去启动进程池的开销
+    if len(tasks) <= 1:
+        for fn, *args in tasks:
+            for result in fn(*args):
+                processed += 1
+                yield result
+            if progress:
+                progress(processed, total)
+        return
+    
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=PROCESS_CONTEXT) as executor:
+        futures = [executor.submit(*task) for task in tasks]
+        for future in as_completed(futures):
+            for result in future.result():
+                processed += 1
+                yield result
+            if progress:
+                progress(processed, total)
+
+# 规范化字体名称：忽略大小写、首尾空白、连续空白和竖排字体的 @ 前缀
+def normalize_font_name(font_name):
+    return ' '.join(font_name.strip().lstrip('@').casefold().split())
+
+# 字体名称在索引中的优先级，数值越小越优先
+def font_name_priorities(face):
+    # 家族名匹配时优先选择常规字重的字体
+    regular = any(normalize_font_name(name) in REGULAR_SUBFAMILY_NAMES for name in face["subfamily_names"])
+    yield 0, face["full_names"]
+    yield 1, face["postscript_names"]
+    yield (2 if regular else 3), face["family_names"]
+
+# 将字体文件加入内存索引
+def add_font_file(font_path, size, mtime_ns, faces):
+    global font_name_keys
+    
+    font_files[font_path] = {"size": size, "mtime_ns": mtime_ns, "faces": faces}
+    for face in faces:
+        for font_full_name in face["full_names"]:
+            all_fonts[font_full_name] = font_path
+        for priority, names in font_name_priorities(face):
+            for name in names:
+                entries = font_name_index.setdefault(normalize_font_name(name), [])
+                entries.append((priority, font_path, face["index"]))
+                entries.sort(key=lambda entry: entry[0])
+    font_name_keys = None
+
+# 将字体文件从内存索引中移除
+def remove_font_file(font_path):
+    global font_name_keys
+    
+    entry = font_files.pop(font_path, None)
+    if entry is None:
+        return
+    for face in entry["faces"]:
+        for font_full_name in face["full_names"]:
+            if all_fonts.get(font_full_name) == font_path:
+                del all_fonts[font_full_name]
+        for _, names in font_name_priorities(face):
+            for name in names:
+                key = normalize_font_name(name)
+                entries = [entry for entry in font_name_index.get(key, []) if entry[1] != font_path]
+                if entries:
+                    font_name_index[key] = entries
+                else:
+                    font_name_index.pop(key, None)
+    font_name_keys = None
+
+# 从缓存数据库恢复内存索引
+def load_font_index_cache(db):
+    for font_path, size, mtime_ns, faces in db.execute('SELECT path, size, mtime_ns, faces FROM font_files'):
+        add_font_file(font_path, size, mtime_ns, json.loads(faces))
+
+# 将扫描到的字体文件与索引对比，重新读取新增和修改的字体文件，移除已删除的字体文件
+# scope(字体路径) 判断已索引的字体文件是否在本次扫描范围内，为空时表示全部；progress(已处理数, 总数) 用于报告进度
+def update_font_files(db, current_files, scope=None, progress=None):
+    with font_index_lock:
+        removed_files = [font_path for font_path in font_files if font_path not in current_files and (scope is None or scope(font_path))]
+        changed_files = []
+        for font_path, (size, mtime_ns) in current_files.items():
+            entry = font_files.get(font_path)
+            if entry is None or entry["size"] != size or entry["mtime_ns"] != mtime_ns:
+                changed_files.append(font_path)
+    print(f"需要重新读取 {len(changed_files)} 个字体文件，移除 {len(removed_files)} 个字体文件")
+    
+    def report_progress(processed, total):
+        print(f"已处理 {processed}/{total} 个字体文件...")
+        if progress:
+            progress(processed, total)
+    
+    # 读取字体文件时不持有索引锁，不影响界面查找字体
+    # 读取失败的字体文件不写入索引和缓存，下次扫描时重新读取
+    scanned = [(font_path, faces) for font_path, faces in scan_font_files(changed_files, report_progress) if faces is not None]
+    failed_files = sorted(set(changed_files) - {font_path for font_path, _ in scanned})
+    with font_index_lock:
+        for font_path in removed_files + changed_files:
+            remove_font_file(font_path)
+        for font_path, faces in scanned:
+            size, mtime_ns = current_files[font_path]
+            add_font_file(font_path, size, mtime_ns, faces)
+    
+    db.executemany('DELETE FROM font_files WHERE path = ?', [(font_path,) for font_path in removed_files + failed_files])
+    db.executemany('INSERT OR REPLACE INTO font_files (path, size, mtime_ns, faces) VALUES (?, ?, ?, ?)',
+                   [(font_path, *current_files[font_path], json.dumps(faces, ensure_ascii=False)) for font_path, faces in scanned])
+    db.commit()
+    return len(changed_files), len(removed_files)
+
+# 读取系统中所有字体的信息（增量），progress(已处理数, 总数) 用于报告进度
+def load_all_fonts(progress=None):
+    global fonts_loaded
+    
+    fonts_loaded = False
+    
+    try:
+        with font_update_lock:
+            font_dirs = get_font_dirs()
+            print(f"开始读取系统字体，共 {len(font_dirs)} 个字体目录...")
             
-            processed_files += 1
-            if processed_files % 10 == 0:
-                print(f"已处理 {processed_files}/{total_font_files} 个字体文件...")
+            db = open_font_index_db()
+            try:
+                # 首次读取时从缓存恢复索引
+                if not font_files:
+                    with font_index_lock:
+                        load_font_index_cache(db)
+                    print(f"从缓存中读取到 {len(font_files)} 个字体文件")
+                
+                dir_mtimes = {}
+                current_files = list_font_files(font_dirs, dir_mtimes)
+                print(f"发现 {len(current_files)} 个字体文件...")
+                update_font_files(db, current_files, progress=progress)
+            finally:
+                db.close()
+            
+            # 记录扫描过的目录，供监视线程对比
+            font_watched_dirs[:] = font_dirs
+            font_dir_mtimes.clear()
+            font_dir_mtimes.update(dir_mtimes)
         
         print(f"字体读取完成，共读取到 {len(all_fonts)} 个唯一字体")
         fonts_loaded = True
     except Exception as e:
         print(f"读取字体时出错: {e}")
 
+# 检查字体目录是否变化，只重新扫描修改时间变化的目录，返回是否有变化
+# 新增、删除或重命名字体文件会改变所在目录的修改时间；字体来源变化时重新扫描全部目录
+def poll_font_dirs():
+    with font_update_lock:
+        if get_font_dirs() != font_watched_dirs:
+            load_all_fonts()
+            return True
+        
+        changed_dirs = []
+        for font_dir, mtime_ns in font_dir_mtimes.items():
+            try:
+                if os.stat(font_dir).st_mtime_ns != mtime_ns:
+                    changed_dirs.append(font_dir)
+            except OSError:
+                changed_dirs.append(font_dir)
+        if changed_dirs:
+            # 只保留最上层的变化目录，其子目录会被递归扫描
+            changed_dirs = [font_dir for font_dir in changed_dirs
+                            if not any(font_dir != other and font_dir.startswith(os.path.join(other, '')) for other in changed_dirs)]
+            in_scope = lambda path: any(path.startswith(os.path.join(font_dir, '')) for font_dir in changed_dirs)
+            print(f"字体目录发生变化: {', '.join(changed_dirs)}")
+            
+            dir_mtimes = {}
+            current_files = list_font_files([font_dir for font_dir in changed_dirs if os.path.isdir(font_dir)], dir_mtimes)
+            db = open_font_index_db()
+            try:
+                update_font_files(db, current_files, in_scope)
+            finally:
+                db.close()
+            for font_dir in [font_dir for font_dir in font_dir_mtimes if font_dir in changed_dirs or in_scope(font_dir)]:
+                del font_dir_mtimes[font_dir]
+            font_dir_mtimes.update(dir_mtimes)
+        
+        # 原地改写的字体文件不会改变所在目录的修改时间，需要检查已索引文件本身
+        changed_files = find_changed_font_files()
+        if changed_files:
+            print(f"字体文件发生变化: {', '.join(sorted(changed_files))}")
+            current_files = list_changed_font_files(changed_files)
+            db = open_font_index_db()
+            try:
+                update_font_files(db, current_files, lambda path: split_font_path(path)[0] in changed_files)
+            finally:
+                db.close()
+        
+        if not changed_dirs and not changed_files:
+            return False
+        print(f"字体索引已更新，共 {len(all_fonts)} 个唯一字体")
+        return True
+
+# 找出大小或修改时间与索引不同的已索引字体文件，压缩包中的字体按压缩包的修改时间检查，返回变化的文件（或压缩包）路径
+def find_changed_font_files():
+    with font_index_lock:
+        indexed = [(font_path, entry["size"], entry["mtime_ns"]) for font_path, entry in font_files.items()]
+    changed_files = set()
+    archive_mtimes = {}
+    for font_path, size, mtime_ns in indexed:
+        archive_path, member = split_font_path(font_path)
+        if member is not None:
+            archive_mtimes.setdefault(archive_path, set()).add(mtime_ns)
+            continue
+        try:
+            stat = os.stat(font_path)
+        except OSError:
+            changed_files.add(font_path)
+            continue
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+            changed_files.add(font_path)
+    for archive_path, mtimes in archive_mtimes.items():
+        try:
+            if mtimes != {os.stat(archive_path).st_mtime_ns}:
+                changed_files.add(archive_path)
+        except OSError:
+            changed_files.add(archive_path)
+    return changed_files
+
+# 重新列出变化的字体文件和压缩包中的字体：路径 -> (大小, 修改时间)，已删除的文件不在结果中
+def list_changed_font_files(changed_files):
+    current_files = {}
+    for path in changed_files:
+        try:
+            stat = os.stat(path)
+            if not path.lower().endswith(ARCHIVE_EXTENSIONS):
+                current_files[path] = (stat.st_size, stat.st_mtime_ns)
+                continue
+            members = list_archive_fonts(path, stat)
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            print(f"读取字体压缩包时出错: {path}: {e}")
+            continue
+        for member, size in members.items():
+            current_files[f"{path}{ARCHIVE_SEPARATOR}{member}"] = (size, stat.st_mtime_ns)
+    return current_files
+
+# 监视线程：定期检查字体目录
+def watch_font_dirs(interval):
+    while not font_watcher_stop.wait(interval):
+        try:
+            poll_font_dirs()
+        except Exception as e:
+            print(f"监视字体目录时出错: {e}")
+
+# 启动字体目录监视线程，已启动或 interval 为 0 时不做任何事
+def start_font_watcher(interval=FONT_WATCH_INTERVAL):
+    global font_watcher
+    
+    if interval <= 0 or (font_watcher is not None and font_watcher.is_alive()):
+        return
+    font_watcher_stop.clear()
+    font_watcher = threading.Thread(target=watch_font_dirs, args=(interval,), daemon=True)
+    font_watcher.start()
+
+# 停止字体目录监视线程
+def stop_font_watcher():
+    font_watcher_stop.set()
+
+# 根据字体名称查找字体，返回 (字体路径, 字体编号)，找不到时返回 None
+# 名称为家族名时在家族中选择字重和斜体最接近 weight 和 italic 的字体，名称只是全名或 PostScript 名时返回该字体；
+# 家族中没有对应的粗体或斜体时返回最接近的字体，由渲染器模拟
+def resolve_font(font_name, weight=400, italic=False):
+    global font_name_keys
+    
+    handled, result = call_font_service("resolve", font_name=font_name, weight=weight, italic=italic)
+    if handled:
+        return tuple(result) if result else None
+    key = normalize_font_name(font_name)
+    if not key:
+        return None
+    
+    # 监视线程可能同时更新索引
+    with font_index_lock:
+        # 精确匹配
+        entries = font_name_index.get(key)
+        if not entries:
+            # 前缀匹配：在有序的名称列表中查找以该名称开头、后面只有样式名的字体，如 "Arial" 匹配 "Arial Regular"
+            if font_name_keys is None:
+                font_name_keys = sorted(font_name_index)
+            candidates = []
+            for candidate in font_name_keys[bisect.bisect_left(font_name_keys, key):]:
+                if not candidate.startswith(key):
+                    break
+                suffix = candidate[len(key):]
+                words = suffix.replace('-', ' ').split()
+                if suffix[0] not in ' -' or not words or not all(word in STYLE_SUFFIX_WORDS for word in words):
+                    continue
+                regular = suffix.strip(' -') in REGULAR_SUBFAMILY_NAMES
+                candidates.append((not regular, len(candidate), font_name_index[candidate][0][0], candidate))
+            if not candidates:
+                return None
+            entries = font_name_index[min(candidates)[3]]
+        
+        # 名称只是某个字体的全名或 PostScript 名时直接使用该字体
+        family_entries = [entry for entry in entries if entry[0] >= 2]
+        if not family_entries:
+            _, font_path, face_index = entries[0]
+            return font_path, face_index
+        
+        # 家族名匹配：按斜体是否一致、字重差距和优先级选择
+        def style_distance(entry):
+            face = font_face(entry[1], entry[2]) or {}
+            return (face.get("italic", False) != italic, abs(face.get("weight", 400) - weight), entry[0])
+        _, font_path, face_index = min(family_entries, key=style_distance)
+        return font_path, face_index
+
+# 索引中某个字体文件的某个字体，找不到时返回 None
+def font_face(font_path, face_index):
+    with font_index_lock:
+        entry = font_files.get(font_path)
+        if entry is None:
+            return None
+        return next((face for face in entry["faces"] if face["index"] == face_index), None)
+
 # 检查字体是否安装
 def check_font_installed(font_name):
-    global all_fonts
+    return resolve_font(font_name) is not None
+
+# 根据字体名称查找字体路径，返回 (字体路径, 字体编号)，weight 和 italic 用于在家族中选择字体
+def find_font_path(font_name, weight=400, italic=False):
+    return resolve_font(font_name, weight, italic)
+
+# 子集化缓存目录
+def get_subset_cache_dir():
+    cache_dir = os.path.join(get_cache_dir(), 'subset_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+# 打开子集化缓存数据库
+def open_subset_cache_db():
+    db = sqlite3.connect(os.path.join(get_subset_cache_dir(), 'index.db'), timeout=30)
+    db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)')
+    db.execute('CREATE TABLE IF NOT EXISTS font_digests (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL)')
+    return db
+
+# 计算字体文件内容的哈希，按路径、大小和修改时间缓存结果
+def font_file_digest(font_path):
+    size, mtime_ns = font_file_stat(font_path)
+    db = open_subset_cache_db()
+    try:
+        row = db.execute('SELECT digest FROM font_digests WHERE path = ? AND size = ? AND mtime_ns = ?',
+                         (font_path, size, mtime_ns)).fetchone()
+        if row:
+            return row[0]
+        digest = hashlib.sha256()
+        with open_font_file(font_path) as f:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        db.execute('INSERT OR REPLACE INTO font_digests (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)',
+                   (font_path, size, mtime_ns, digest))
+        db.commit()
+        return digest
+    finally:
+        db.close()
+
+# 子集化缓存的键：字体内容哈希、字体编号、排序后的码位和子集化选项
+def subset_cache_key(font_digest, face_index, chars, options):
+    codepoints = sorted({ord(char) for char in chars})
+    payload = json.dumps([SUBSET_CACHE_VERSION, fontTools.version, font_digest, face_index, codepoints, options], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# 由缓存键生成8位字体名称，相同的输入总是得到相同的名称
+def generate_subset_name(cache_key):
+    alphabet = string.ascii_uppercase + string.digits
+    return ''.join(alphabet[byte % len(alphabet)] for byte in bytes.fromhex(cache_key[:16]))
+
+# 从缓存中取出子集化结果，命中时硬链接或复制到 output_path
+def fetch_subset_cache(cache_key, output_path):
+    cached_path = os.path.join(get_subset_cache_dir(), f"{cache_key}.bin")
+    if not os.path.exists(cached_path):
+        return False
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    try:
+        os.link(cached_path, output_path)
+    except OSError:
+        shutil.copyfile(cached_path, output_path)
+    db = open_subset_cache_db()
+    try:
+        db.execute('INSERT OR REPLACE INTO entries (key, size, last_access) VALUES (?, ?, ?)',
+                   (cache_key, os.path.getsize(cached_path), time.time()))
+        db.commit()
+    finally:
+        db.close()
+    return True
+
+# 将子集化结果存入缓存，超过容量上限时按最近最少使用淘汰
+def store_subset_cache(cache_key, output_path):
+    cache_dir = get_subset_cache_dir()
+    cached_path = os.path.join(cache_dir, f"{cache_key}.bin")
+    temp_path = f"{cached_path}.{os.getpid()}.tmp"
+    shutil.copyfile(output_path, temp_path)
+    os.replace(temp_path, cached_path)
+    db = open_subset_cache_db()
+    try:
+        db.execute('INSERT OR REPLACE INTO entries (key, size, last_access) VALUES (?, ?, ?)',
+                   (cache_key, os.path.getsize(cached_path), time.time()))
+        total_size = db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total_size > SUBSET_CACHE_MAX_BYTES:
+            for key, size in db.execute('SELECT key, size FROM entries ORDER BY last_access').fetchall():
+                if total_size <= SUBSET_CACHE_MAX_BYTES:
+                    break
+                try:
+                    os.remove(os.path.join(cache_dir, f"{key}.bin"))
+                except FileNotFoundError:
+                    pass
+                db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                total_size -= size
+        db.commit()
+    finally:
+        db.close()
+
+# 查看子集化缓存的使用情况
+def subset_cache_info():
+    db = open_subset_cache_db()
+    try:
+        count, total_size = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+    finally:
+        db.close()
+    return f"子集化缓存：{count} 个字体，{total_size / 1024 / 1024:.1f} MB / {SUBSET_CACHE_MAX_BYTES / 1024 / 1024:.0f} MB（{get_subset_cache_dir()}）"
+
+# 清空子集化缓存
+def clear_subset_cache():
+    cache_dir = get_subset_cache_dir()
+    db = open_subset_cache_db()
+    try:
+        for (key,) in db.execute('SELECT key FROM entries').fetchall():
+            try:
+                os.remove(os.path.join(cache_dir, f"{key}.bin"))
+            except FileNotFoundError:
+                pass
+        db.execute('DELETE FROM entries')
+        db.commit()
+    finally:
+        db.close()
+    return "子集化缓存已清空"
+
+# 从字体文件中提取单个字体的原始表，组成独立的字体数据，TTC 中共享的表会被复制
+def extract_sfnt_face(f, offset):
+    f.seek(offset)
+    sfnt_header = f.read(12)
+    num_tables = struct.unpack('>H', sfnt_header[4:6])[0]
+    table_records = [struct.unpack('>4sIII', f.read(16)) for _ in range(num_tables)]
     
-    # 检查字体名称是否在字体字典中
-    for font_full_name in all_fonts:
-        if font_name in font_full_name:
-            return True
-    return False
+    directory = [sfnt_header]
+    tables = []
+    table_offset = 12 + 16 * num_tables
+    for tag, checksum, offset, length in table_records:
+        f.seek(offset)
+        data = f.read(length)
+        directory.append(struct.pack('>4sIII', tag, checksum, table_offset, length))
+        tables.append(data + b'\0' * (-length % 4))
+        table_offset += length + (-length % 4)
+    return b''.join(directory + tables)
 
-# 根据字体名称查找字体路径
-def find_font_path(font_name):
-    global all_fonts
+# 读取字体的原始数据（TTC 中的字体提取为独立的字体数据）并解析 cmap，作为缓存池中的一项
+# 子集化时仍然从原始数据重新解析需要的字体表，缓存池省去的是读取文件、解压、提取字体和解析 cmap
+def load_font_pool_entry(font_path, face_index, stat):
+    with open_font_file(font_path) as f:
+        offsets = read_sfnt_offsets(f)
+        if len(offsets) == 1 and offsets[0] == 0:
+            f.seek(0)
+            data = f.read()
+        else:
+            data = extract_sfnt_face(f, offsets[face_index])
+    font = TTFont(io.BytesIO(data), lazy=True)
+    try:
+        cmap = font.getBestCmap() or {}
+    finally:
+        font.close()
+    # 内存占用按原始数据大小加上 cmap 的估算值计算
+    memory = len(data) + 100 * len(cmap)
+    return {"size": stat[0], "mtime_ns": stat[1], "data": data, "cmap": cmap, "memory": memory}
+
+# 字体缓存池的容量上限（字节）：设置了内存预算时不超过预算的 1/5
+def font_pool_limit():
+    if subset_memory_budget:
+        return min(FONT_POOL_MAX_BYTES, subset_memory_budget // 5)
+    return FONT_POOL_MAX_BYTES
+
+# 释放缓存项的共享内存，调用时需持有 font_pool_lock
+def free_pooled_font(entry):
+    entry["shm"].close()
+    try:
+        entry["shm"].unlink()
+    except FileNotFoundError:
+        pass
+
+# 把缓存项移出缓存池，正在被子集化任务使用的缓存项在最后一个任务结束后释放，调用时需持有 font_pool_lock
+def discard_pooled_font(entry):
+    global font_pool_memory
     
-    # 查找字体路径
-    for font_full_name in all_fonts:
-        if font_name in font_full_name:
-            return all_fonts[font_full_name]
-    return None
+    font_pool_memory -= entry["memory"]
+    entry["discarded"] = True
+    if not entry["users"]:
+        free_pooled_font(entry)
+
+# 从缓存池中获取字体的原始数据（共享内存）和 cmap 并占用缓存项，字体文件变化时重新读取，超出内存预算时按最近最少使用淘汰
+# 字体超过整个预算时返回 None，由子集化进程自行读取；使用结束后调用 release_pooled_font
+def get_pooled_font(font_path, face_index=0):
+    global font_pool_memory
+    
+    stat = font_file_stat(font_path)
+    key = (font_path, face_index)
+    max_bytes = font_pool_limit()
+    with font_pool_lock:
+        entry = font_pool.get(key)
+        if entry is not None and (entry["size"], entry["mtime_ns"]) == stat:
+            font_pool.move_to_end(key)
+            font_pool_counters["hits"] += 1
+            entry["users"] += 1
+            return entry
+        font_pool_counters["misses"] += 1
+    if stat[0] > max_bytes:
+        return None
+    
+    loaded = load_font_pool_entry(font_path, face_index, stat)
+    if loaded["memory"] > max_bytes:
+        return None
+    data = loaded.pop("data")
+    shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    shm.buf[:len(data)] = data
+    entry = {**loaded, "shm": shm, "length": len(data), "users": 1, "discarded": False}
+    with font_pool_lock:
+        old_entry = font_pool.pop(key, None)
+        if old_entry is not None:
+            discard_pooled_font(old_entry)
+        font_pool[key] = entry
+        font_pool_memory += entry["memory"]
+        while font_pool_memory > max_bytes and font_pool:
+            _, evicted = font_pool.popitem(last=False)
+            discard_pooled_font(evicted)
+            font_pool_counters["evictions"] += 1
+    return entry
+
+# 结束对缓存项的占用
+def release_pooled_font(entry):
+    with font_pool_lock:
+        entry["users"] -= 1
+        if entry["discarded"] and not entry["users"]:
+            free_pooled_font(entry)
+
+# 清空字体缓存池，进程退出时释放所有共享内存
+def clear_font_pool():
+    with font_pool_lock:
+        while font_pool:
+            _, entry = font_pool.popitem()
+            discard_pooled_font(entry)
+
+atexit.register(clear_font_pool)
+
+# 字体缓存池的状态
+def font_pool_stats():
+    with font_pool_lock:
+        return {"entries": len(font_pool), "memory": font_pool_memory, "max_memory": font_pool_limit(), **font_pool_counters}
 
-# 生成8位随机字符串
-def generate_random_name():
-    import random
-    import string
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+# 字体缓存池状态的说明文字
+def font_pool_info():
+    stats = font_pool_stats()
+    hits, misses = stats["hits"], stats["misses"]
+    if not hits + misses:
+        return "字体缓存池：尚未进行子集化"
+    return (f"字体缓存池：{stats['entries']} 个字体，命中率 {hits / (hits + misses) * 100:.1f}%（{hits}/{hits + misses}），"
+            f"内存 {stats['memory'] / 1024 / 1024:.1f} MB（上限 {stats['max_memory'] / 1024 / 1024:.0f} MB），"
+            f"淘汰 {stats['evictions']} 次")
 
-# 子集化字体
-def subset_font(font_path, chars, output_path, random_name):
+# 子集化配置对应的子集化选项，profile 为空时使用默认配置，flavor 为 SUBSET_FLAVORS 中的压缩输出格式，为空时输出原格式；
+# 没有安装 brotli 时 WOFF2 改为 WOFF
+def subset_profile_options(profile=None, flavor=None):
+    profile = profile or SUBSET_PROFILE
+    if profile not in SUBSET_PROFILES:
+        raise ValueError(f"未知的子集化配置: {profile}，可用的配置: {', '.join(SUBSET_PROFILES)}")
+    options = dict(SUBSET_PROFILES[profile])
+    if flavor:
+        if flavor not in SUBSET_FLAVORS:
+            raise ValueError(f"未知的输出格式: {flavor}，可用的格式: {', '.join(SUBSET_FLAVORS)}")
+        if flavor == "woff2" and brotli is None:
+            print("没有安装 brotli，使用 WOFF 格式代替 WOFF2")
+            flavor = "woff"
+        options["flavor"] = flavor
+    return options
+
+# 压缩输出格式不能内嵌到字幕中：渲染器只能加载内嵌的 TTF/OTF 字体
+def check_output_flavor(flavor, embed_fonts):
+    if flavor and embed_fonts:
+        raise ValueError(f"{flavor} 格式的字体不能内嵌到字幕中")
+
+# 子集化字体的扩展名：WOFF/WOFF2 格式使用 .woff/.woff2，否则为 ext
+def subset_font_ext(options, ext):
+    return f".{options['flavor']}" if options.get("flavor") else ext
+
+# 子集化字体，face_index 为 TTC 文件中的字体编号，cache_key 不为空时先查找缓存，子集化成功后写入缓存
+# options 为 subset_profile_options 返回的子集化选项，metrics 不为空时记录输入输出字节数、字形数和是否命中缓存
+# pooled 为字体缓存池中该字体的 (共享内存名称, 数据长度)，chars 应已按缓存项的 cmap 过滤
+def subset_font(font_path, chars, output_path, random_name, cache_key=None, face_index=0, low_memory=False, options=None, metrics=None, pooled=None):
+    if metrics is None:
+        metrics = {}
+    if cache_key and fetch_subset_cache(cache_key, output_path):
+        print(f"使用缓存的子集化字体: {os.path.basename(output_path)}")
+        metrics.update(cache_hit=True, output_bytes=os.path.getsize(output_path))
+        return True
+    metrics["cache_hit"] = False
+    success = subset_font_file(font_path, chars, output_path, random_name, face_index, low_memory, metrics, options, pooled)
+    if success and cache_key:
+        try:
+            store_subset_cache(cache_key, output_path)
+        except Exception as e:
+            print(f"写入子集化缓存时出错: {e}")
+    return success
+
+# 在子集化进程中执行的任务，同时返回该字体的耗时、CPU 时间、内存峰值等统计
+# 子集化进程一次只执行一个任务，能重置内存峰值时 peak_rss 为该任务期间的进程内存峰值，
+# 否则只能记录 process_peak_rss，即进程启动以来的内存峰值（进程被复用时只增不减）
+def subset_font_job(*args, pooled=None):
+    metrics = {}
+    job_peak = reset_peak_rss()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    success = subset_font(*args, metrics=metrics, pooled=pooled)
+    metrics.update(wall=round(time.perf_counter() - wall_start, 6), cpu=round(time.process_time() - cpu_start, 6))
+    if job_peak:
+        metrics["peak_rss"] = current_peak_rss()
+    else:
+        metrics["process_peak_rss"] = peak_rss()
+    return success, metrics
+
+# 使用 fontTools 子集化字体，low_memory 为真时通过内存映射读取字体文件，不使用字体缓存池
+# 压缩包中的字体不能内存映射，低内存模式下读出后不放入缓存
+# pooled 不为空时从字体缓存池的共享内存中复制字体数据，否则读取字体并解析 cmap，不放入缓存池
+def subset_font_file(font_path, chars, output_path, random_name, face_index=0, low_memory=False, metrics=None, options=None, pooled=None):
+    if metrics is None:
+        metrics = {}
     try:
-        # 尝试处理 TTC 文件，使用不同的字体编号
-        if font_path.endswith(('.ttc', '.TTC')):
-            # 尝试不同的字体编号
-            for font_number in range(5):  # 尝试前 5 个字体
+        # 已存在的输出文件可能是缓存文件的硬链接，先删除再写入，避免改写缓存
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        
+        with contextlib.ExitStack() as stack:
+            if low_memory:
+                # 只有 Subsetter 用到的表会从内存映射中读出并解析
+                if split_font_path(font_path)[1] is None:
+                    f = stack.enter_context(open(font_path, 'rb'))
+                    source = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                else:
+                    source = io.BytesIO(read_archive_font(font_path, cache=False))
+                font_number = face_index
+                unicodes = [ord(char) for char in chars]
+                metrics["input_bytes"] = len(source) if isinstance(source, mmap.mmap) else len(source.getbuffer())
+            elif pooled is not None:
+                # 缓存池中是字体索引中记录的字体编号对应的字体，主进程已用预先解析的 cmap 跳过字体中没有的字符
+                shm = shared_memory.SharedMemory(name=pooled[0])
                 try:
-                    font = TTFont(font_path, fontNumber=font_number)
-                    subsetter = Subsetter()
-                    subsetter.populate(text=''.join(chars))
-                    subsetter.subset(font)
-
-                    name_table = font["name"]
-                    for record in name_table.names:
-                        if record.nameID == 1: # Family Name
-                            encoding = record.getEncoding()
-                            record.string = random_name.encode(encoding) if encoding else random_name.encode("utf-8")
-                            
-                    font.save(output_path)
-                    return True
-                except Exception as e:
-                    # 如果是字体编号错误，继续尝试下一个编号
-                    if "specify a font number" in str(e):
-                        continue
-                    else:
-                        print(f"子集化字体时出错: {e}")
-                        return False
-            return False
-        else:
-            # 处理普通字体文件
-            font = TTFont(font_path)
-            subsetter = Subsetter()
-            subsetter.populate(text=''.join(chars))
-            subsetter.subset(font)
-
-            name_table = font["name"]
-            for record in name_table.names:
-                if record.nameID == 1: # Family Name
-                    encoding = record.getEncoding()
-                    record.string = random_name.encode(encoding) if encoding else random_name.encode("utf-8")
-                    
-            font.save(output_path)
-            return True
+                    data = bytes(shm.buf[:pooled[1]])
+                finally:
+                    shm.close()
+                source = io.BytesIO(data)
+                font_number = -1
+                unicodes = [ord(char) for char in chars]
+                metrics["input_bytes"] = len(data)
+            else:
+                entry = load_font_pool_entry(font_path, face_index, font_file_stat(font_path))
+                source = io.BytesIO(entry["data"])
+                font_number = -1
+                unicodes = [ord(char) for char in chars if ord(char) in entry["cmap"]]
+                metrics["input_bytes"] = len(entry["data"])
+            
+            subset_font_source(source, font_number, unicodes, random_name, output_path, metrics, options)
+        metrics["output_bytes"] = os.path.getsize(output_path)
+        return True
     except Exception as e:
         print(f"子集化字体时出错: {e}")
         return False
 
-# 主函数
-def process_subtitle(file):
+# 字体的 GSUB 竖排特性（VERTICAL_FEATURES）中 unicodes 对应字形的替换字形，只处理单字形替换（包括扩展查找）
+def vertical_substitute_glyphs(font, unicodes):
+    if 'GSUB' not in font:
+        return set()
+    table = font['GSUB'].table
+    if not table.FeatureList or not table.LookupList:
+        return set()
+    lookup_indices = {index for record in table.FeatureList.FeatureRecord if record.FeatureTag in VERTICAL_FEATURES
+                      for index in record.Feature.LookupListIndex}
+    cmap = font.getBestCmap() or {}
+    glyphs = {cmap[code] for code in unicodes if code in cmap}
+    substitutes = set()
+    for index in sorted(lookup_indices):
+        lookup = table.LookupList.Lookup[index]
+        for subtable in lookup.SubTable:
+            if lookup.LookupType == 7:
+                subtable = subtable.ExtSubTable
+            mapping = getattr(subtable, 'mapping', None)
+            if subtable.LookupType == 1 and mapping:
+                substitutes.update(mapping[glyph] for glyph in glyphs if glyph in mapping)
+    return substitutes
+
+# 子集化已打开的字体（文件对象或内存映射），将家族名改为 random_name 后保存到 output（路径或文件对象）
+# font_number 为 TTC 中的字体编号，单个字体时为 -1，options 为子集化选项，为空时使用 fontTools 的默认选项
+def subset_font_source(source, font_number, unicodes, random_name, output, metrics, options=None):
+    options = Options(**(options or {}))
+    # 字体表按需解析，Subsetter 删除的表不会被解析
+    font = TTFont(source, fontNumber=font_number, lazy=True,
+                  recalcBBoxes=options.recalc_bounds, recalcTimestamp=options.recalc_timestamp)
+    try:
+        metrics["glyphs_before"] = len(font.getGlyphOrder())
+        subsetter = Subsetter(options)
+        subsetter.populate(unicodes=unicodes)
+        # 不做字形闭包时仍保留竖排替换字形，否则 @字体 的竖排文字会缺字
+        if not options.layout_closure:
+            subsetter.populate(glyphs=vertical_substitute_glyphs(font, unicodes))
+        subsetter.subset(font)
+        metrics["glyphs_after"] = len(font.getGlyphOrder())
+        
+        name_table = font["name"]
+        for record in name_table.names:
+            if record.nameID == 1: # Family Name
+                encoding = record.getEncoding()
+                record.string = random_name.encode(encoding) if encoding else random_name.encode("utf-8")
+        
+        font.flavor = options.flavor
+        font.save(output)
+    finally:
+        # 保存后立即释放字体
+        font.close()
+
+# 估算子集化一个字体需要的内存（字节）
+def estimate_subset_memory(font_path, low_memory=False):
+    return font_file_stat(font_path)[0] * (SUBSET_MEMORY_FACTOR_LOW if low_memory else SUBSET_MEMORY_FACTOR)
+
+# 设置所有子集化任务共享的内存预算（字节），0 表示不限制
+# 子集化进程中缓存的上限在创建进程池时确定，因此应在第一次子集化之前设置
+def set_subset_memory_budget(budget):
+    global subset_memory_budget
+    
+    with subset_memory_condition:
+        subset_memory_budget = max(int(budget), 0)
+        subset_memory_condition.notify_all()
+
+# 占用内存预算，预算不足时等待其他任务结束；单个任务超过整个预算时等到没有其他任务时运行
+# 子集化进程中的字体缓存池和压缩包缓存可能占用的内存不能用于任务
+def acquire_subset_memory(cost):
+    global subset_memory_in_use
+    
+    with subset_memory_condition:
+        while subset_memory_budget and subset_memory_in_use and subset_memory_in_use + cost > subset_memory_budget - subset_cache_reserved:
+            subset_memory_condition.wait()
+        subset_memory_in_use += cost
+
+# 释放内存预算
+def release_subset_memory(cost):
+    global subset_memory_in_use
+    
+    with subset_memory_condition:
+        subset_memory_in_use -= cost
+        subset_memory_condition.notify_all()
+
+# 重置当前进程的内存峰值（VmHWM），只有 Linux 支持，返回是否成功
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+# 当前进程自上次重置以来的内存峰值（字节），读取失败时返回 None
+def current_peak_rss():
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+# 当前进程启动以来的内存峰值（字节），系统不支持时返回 None
+def peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以字节为单位，其他系统以 KB 为单位
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+# 记录一个阶段的耗时、CPU 时间和进程启动以来的内存峰值，写入 report["stages"][stage]
+# 主进程中可能同时运行多个阶段，不能重置内存峰值，因此记录的不是该阶段自己的峰值
+@contextlib.contextmanager
+def measure_stage(report, stage):
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        report.setdefault("stages", {})[stage] = {
+            "wall": round(time.perf_counter() - wall_start, 6),
+            "cpu": round(time.process_time() - cpu_start, 6),
+            "process_peak_rss": peak_rss(),
+        }
+
+# 将运行统计保存为 JSON 文件
+def write_run_report(report, report_path):
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+# 运行统计的简要说明，用于显示在结果中
+def format_run_report(report):
+    stage_names = {"parse": "解析字幕", "lookup": "查找字体", "coverage": "缺字检查", "subset": "子集化", "rewrite": "修改字幕"}
+    stages = report.get("stages", {})
+    parts = [f"{label} {stages[stage]['wall'] * 1000:.0f} ms" for stage, label in stage_names.items() if stage in stages]
+    lines = ["耗时：" + "，".join(parts)] if parts else []
+    
+    fonts = [(font_name, font) for font_name, font in report.get("fonts", {}).items() if font.get("success")]
+    if fonts:
+        input_bytes = sum(font.get("input_bytes") or 0 for _, font in fonts)
+        output_bytes = sum(font.get("output_bytes") or 0 for _, font in fonts)
+        cache_hits = sum(1 for _, font in fonts if font.get("cache_hit"))
+        profile = f"（{report['profile']}）" if report.get("profile") else ""
+        lines.append(f"字体{profile}：{len(fonts)} 个，{input_bytes / 1024:.0f} KB -> {output_bytes / 1024:.0f} KB，缓存命中 {cache_hits} 个")
+        slowest_name, slowest = max(fonts, key=lambda item: item[1].get("wall") or 0)
+        lines.append(f"最慢的字体：{slowest_name} {(slowest.get('wall') or 0) * 1000:.0f} ms")
+    missing = report.get("missing_glyphs")
+    if missing:
+        lines.append(f"缺字：{len(missing)} 个字体缺少 {sum(len(info['chars']) for info in missing.values())} 个字符")
+    if report.get("report_path"):
+        lines.append(f"详细统计: {report['report_path']}")
+    return "\n".join(lines)
+
+# 字体中缺少的字符，按码位排序；字体不在索引中或没有码位位图时返回空字符串
+def font_missing_chars(font_path, face_index, chars):
+    handled, result = call_font_service("coverage", font_path=font_path, face_index=face_index, chars="".join(chars))
+    if handled:
+        return result
+    face = font_face(font_path, face_index)
+    if face is None or not face.get("coverage"):
+        return ""
+    bits = decode_coverage(face["coverage"])
+    # 控制字符不需要字形
+    return "".join(sorted(char for char in chars if ord(char) >= 0x20 and not coverage_contains(bits, ord(char))))
+
+# 检查字幕使用的字符是否都在字体中，返回 字体显示名称 -> {"chars": 缺少的字符, "lines": [[行号, 该行缺少的字符]]}
+# 只有存在缺字时才再次读取字幕文件，找出缺字所在的行
+def check_coverage(subtitle_file, dialogues, font_paths):
+    missing = {}
+    for face, (font_path, face_index) in font_paths.items():
+        chars = font_missing_chars(font_path, face_index, dialogues.get(face, ()))
+        if chars:
+            missing[face] = {"chars": chars, "lines": []}
+    if missing:
+        with open(subtitle_file, "r", encoding="utf-8-sig") as f:
+            for line_number, line_chars in iter_ass_dialogue_chars(f):
+                for face, chars in line_chars.items():
+                    if face not in missing:
+                        continue
+                    line_missing = "".join(sorted(set(missing[face]["chars"]).intersection(chars)))
+                    if line_missing:
+                        missing[face]["lines"].append([line_number, line_missing])
+    return {face_label(face): info for face, info in missing.items()}
+
+# 缺字检查结果的说明，每个字体最多列出 max_lines 行
+def format_missing_glyphs(missing, max_lines=20):
+    if not missing:
+        return "所有字符均包含在字体中"
+    lines = []
+    for font_name, info in missing.items():
+        lines.append(f"字体 {font_name} 缺少 {len(info['chars'])} 个字符: {info['chars']}")
+        for line_number, chars in info["lines"][:max_lines]:
+            lines.append(f"  第 {line_number} 行: {chars}")
+        if len(info["lines"]) > max_lines:
+            lines.append(f"  ……另有 {len(info['lines']) - max_lines} 行")
+    return "\n".join(lines)
+
+# 主函数，file 为上传的文件对象或字幕文件路径，report 不为空时记录解析、查找字体和缺字检查阶段的统计，
+# 缺字检查结果记录在 report["missing_glyphs"] 中
+def process_subtitle(file, report=None):
+    if report is None:
+        report = {}
+    
     # 解析字幕文件
-    styles, dialogues = parse_ass_file(file.name)
+    subtitle_file = getattr(file, 'name', file)
+    with measure_stage(report, "parse"):
+        styles, dialogues = parse_ass_file(subtitle_file)
     
     # 提取字体列表
-    font_list = list(dialogues.keys())
+    font_list = list(dict.fromkeys(font_name for font_name, _, _ in dialogues))
     
     # 检查字体安装状态
     all_installed = True
     uninstalled_fonts = []
     font_paths = {}
-    for font in font_list:
-        installed = check_font_installed(font)
-        if not installed:
-            all_installed = False
-            uninstalled_fonts.append(font)
-        else:
-            # 查找字体路径
-            font_path = find_font_path(font)
-            if font_path:
-                font_paths[font] = font_path
+    with measure_stage(report, "lookup"):
+        for font in font_list:
+            if find_font_path(font) is None:
+                all_installed = False
+                uninstalled_fonts.append(font)
+        # 按字重和斜体查找每个字体的路径和字体编号
+        for face in dialogues:
+            if face[0] not in uninstalled_fonts:
+                font_paths[face] = find_font_path(*face)
+    
+    # 检查已安装的字体是否包含字幕使用的所有字符
+    with measure_stage(report, "coverage"):
+        report["missing_glyphs"] = check_coverage(subtitle_file, dialogues, font_paths)
+    if report["missing_glyphs"]:
+        print(f"缺字检查: {subtitle_file}")
+        print(format_missing_glyphs(report["missing_glyphs"]))
     
     return font_list, all_installed, uninstalled_fonts, font_paths, dialogues
 
@@ -318,301 +1810,1500 @@ def check_fonts(font_list):
             uninstalled_fonts.append(font)
     return all_installed, uninstalled_fonts
 
-# 子集化处理
-def perform_subsetting(dialogues, font_paths, subtitle_file, output_dir):
-    try:
-        # 确保输出目录存在
-        os.makedirs(output_dir, exist_ok=True)
+# 子集化进程的初始化：设置该进程中压缩包缓存的容量上限
+def init_subset_worker(archive_cache_max_bytes):
+    global ARCHIVE_CACHE_MAX_BYTES
+    ARCHIVE_CACHE_MAX_BYTES = archive_cache_max_bytes
+
+# 每个子集化进程的压缩包缓存上限（字节）：由所有子集化进程平分，设置了内存预算时合计不超过预算的 1/20
+# 字体缓存池在主进程中，不需要在子集化进程中缓存
+def subset_worker_cache_limit(workers):
+    archive_cache_bytes = ARCHIVE_CACHE_MAX_BYTES
+    if subset_memory_budget:
+        archive_cache_bytes = min(archive_cache_bytes, subset_memory_budget // 20)
+    return archive_cache_bytes // workers
+
+# 获取子集化进程池，进程数为 SUBSET_POOL_WORKERS；其他子集化可能正在使用进程池，因此不会因为进程数不同而替换进程池
+def get_subset_executor():
+    global subset_executor
+    global subset_executor_workers
+    global subset_cache_reserved
+    
+    with subset_executor_lock:
+        if subset_executor is None:
+            # 各进程的缓存上限在创建进程池时由当前的内存预算决定，缓存可能占用的内存从预算中预留
+            cache_limit = subset_worker_cache_limit(SUBSET_POOL_WORKERS)
+            subset_executor = ProcessPoolExecutor(max_workers=SUBSET_POOL_WORKERS, mp_context=PROCESS_CONTEXT,
+                                                  initializer=init_subset_worker, initargs=(cache_limit,))
+            subset_executor_workers = SUBSET_POOL_WORKERS
+            subset_cache_reserved = font_pool_limit() + cache_limit * SUBSET_POOL_WORKERS
+        return subset_executor
+
+# 子进程意外退出后丢弃进程池，下次使用时重新创建
+def reset_subset_executor(executor):
+    global subset_executor
+    
+    with subset_executor_lock:
+        if subset_executor is executor:
+            subset_executor = None
+    executor.shutdown(wait=False)
+
+# 子集化字体，max_workers 为本次同时运行的子集化任务数上限，默认（和上限）为共用进程池的进程数，use_cache 控制是否使用子集化缓存，
+# low_memory 控制是否使用低内存模式，同时运行的任务受内存预算限制
+# dialogues 和 font_paths 以 (字体名, 字重, 斜体) 为键，同一字体名称使用的所有字体共用一个子集化字体名称，
+# 渲染器按字重和斜体在其中选择字体
+# progress 不为空时每完成一个字体调用 progress(字体显示名称, 已完成数, 总数)，cancel_event 被设置后不再提交新任务并取消未开始的任务
+# profile 为 SUBSET_PROFILES 中的子集化配置，为空时使用默认配置，flavor 为压缩输出格式，为空时输出原格式
+# previous_fonts 为构建清单中上次的子集化结果，缓存键相同且输出文件仍存在的字体直接使用，不再子集化
+# claimed_outputs 不为空时在使用每个输出文件前登记，避免同时更新构建清单的其他字幕删除该文件，由调用方释放
+# 返回 (原字体名称 -> 子集化字体名称, 字体显示名称 -> 子集化结果)
+def subset_fonts(dialogues, font_paths, output_dir, max_workers=None, use_cache=True, low_memory=False, progress=None, cancel_event=None, profile=None, previous_fonts=None, claimed_outputs=None, flavor=None):
+    options = subset_profile_options(profile, flavor)
+    # 确保输出目录存在
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # 生成的字体文件映射：原字体名称 -> 子集化字体名称
+    font_mapping = {}
+    font_results = {}
+    
+    # 按字体名称分组，同一字体名称的不同字重可能对应同一个字体（由渲染器模拟粗体和斜体），按实际使用的字体合并字符
+    families = {}
+    for face, (font_path, face_index) in font_paths.items():
+        # 获取该字体使用的字符
+        chars = dialogues.get(face)
+        if not chars:
+            continue
+        group = families.setdefault(face[0], {}).setdefault((font_path, face_index), {"faces": [], "chars": set()})
+        group["faces"].append(face)
+        group["chars"].update(chars)
+    
+    # 将每个字体的子集化任务提交到进程池
+    executor = get_subset_executor()
+    # 进程池由所有子集化共用，本次子集化同时提交的任务数不超过 max_workers
+    slots = threading.BoundedSemaphore(min(max_workers or subset_executor_workers, subset_executor_workers))
+    jobs = []
+    for font_name, groups in families.items():
+        if cancel_event is not None and cancel_event.is_set():
+            break
         
-        # 生成的字体文件映射：原字体名称 -> 子集化字体名称
-        font_mapping = {}
+        for (font_path, face_index), group in groups.items():
+            font_results[face_label(group["faces"][0])] = {
+                "font_name": font_name, "styles": [face_label(face) for face in group["faces"]],
+                "font_path": font_path, "face_index": face_index, "chars": len(group["chars"]),
+                "subset_name": None, "output_path": None, "success": False}
+        try:
+            digests = [font_file_digest(font_path) for font_path, _ in groups]
+        except Exception as e:
+            print(f"读取字体文件时出错: {font_name}: {e}")
+            print(f"子集化失败: {font_name}")
+            continue
         
-        # 处理每个字体
-        for font_name, font_path in font_paths.items():
-            # 获取该字体使用的字符
-            chars = dialogues.get(font_name, [])
-            if not chars:
+        # 由家族中所有字体的缓存键生成8位家族名称，家族名称也是缓存键的一部分
+        base_keys = [subset_cache_key(digest, face_index, group["chars"], options)
+                     for digest, ((_, face_index), group) in zip(digests, groups.items())]
+        random_name = generate_subset_name(hashlib.sha256('\n'.join(sorted(base_keys)).encode('ascii')).hexdigest())
+        for number, (digest, ((font_path, face_index), group)) in enumerate(zip(digests, groups.items())):
+            label = face_label(group["faces"][0])
+            cache_key = subset_cache_key(digest, face_index, group["chars"], {**options, "family_name": random_name})
+            # 保持原字体文件扩展名，TTC 文件中的单个字体保存为 .ttf，家族中的其他字体在文件名后加序号
+            ext = os.path.splitext(font_path)[1]
+            if ext.lower() == '.ttc':
+                ext = '.ttf'
+            ext = subset_font_ext(options, ext)
+            output_path = os.path.join(output_dir, f"{random_name}{ext}" if number == 0 else f"{random_name}-{number}{ext}")
+            font_results[label]["cache_key"] = cache_key
+            if claimed_outputs is not None:
+                claim_subset_output(output_path, claimed_outputs)
+            
+            # 字符集、字体和子集化配置都没有变化时使用上次的输出文件
+            previous = (previous_fonts or {}).get(label)
+            if (use_cache and previous and previous["cache_key"] == cache_key
+                    and previous["output_path"] == output_path and os.path.exists(output_path)):
+                font_mapping[font_name] = random_name
+                font_results[label].update(subset_name=random_name, output_path=output_path, success=True, reused=True,
+                                           output_bytes=os.path.getsize(output_path))
+                print(f"子集化字体未变化: {label} -> {os.path.basename(output_path)}")
                 continue
             
-            # 生成8位随机文件名
-            random_name = generate_random_name()
-            # 保持原字体文件扩展名
-            ext = os.path.splitext(font_path)[1]
-            output_path = os.path.join(output_dir, f"{random_name}{ext}")
+            # 执行子集化，同时运行的任务数达到上限或内存预算不足时等待正在运行的任务结束
+            cost = estimate_subset_memory(font_path, low_memory)
+            slots.acquire()
+            acquire_subset_memory(cost)
+            entry = None
+            try:
+                # 字体数据从缓存池的共享内存传给子集化进程，任务结束前缓存项不会被释放
+                chars = group["chars"]
+                if not low_memory:
+                    try:
+                        entry = get_pooled_font(font_path, face_index)
+                    except Exception as e:
+                        print(f"读取字体文件时出错: {label}: {e}")
+                if entry is not None:
+                    chars = {char for char in chars if ord(char) in entry["cmap"]}
+                pooled = (entry["shm"].name, entry["length"]) if entry is not None else None
+                future = executor.submit(subset_font_job, font_path, chars, output_path, random_name, cache_key if use_cache else None, face_index, low_memory, options, pooled=pooled)
+            except Exception:
+                if entry is not None:
+                    release_pooled_font(entry)
+                release_subset_memory(cost)
+                slots.release()
+                raise
+            future.add_done_callback(lambda _, cost=cost, entry=entry: (entry is not None and release_pooled_font(entry),
+                                                                        release_subset_memory(cost), slots.release()))
+            jobs.append((label, font_name, random_name, output_path, future))
+    
+    # 按完成顺序收集结果，单个字体失败不影响其他字体
+    future_jobs = {future: (label, font_name, random_name, output_path) for label, font_name, random_name, output_path, future in jobs}
+    for completed, future in enumerate(as_completed(future_jobs), 1):
+        label, font_name, random_name, output_path = future_jobs[future]
+        if cancel_event is not None and cancel_event.is_set():
+            # 取消尚未开始的任务，正在运行的任务会继续完成
+            for pending in future_jobs:
+                pending.cancel()
+        try:
+            success, metrics = future.result()
+            font_results[label].update(metrics)
+        except CancelledError:
+            print(f"已取消子集化: {label}")
+            success = False
+        except BrokenProcessPool as e:
+            print(f"子集化进程意外退出: {label}: {e}")
+            reset_subset_executor(executor)
+            success = False
+        except Exception as e:
+            print(f"子集化字体时出错: {label}: {e}")
+            success = False
+        if success:
+            # 家族中任一字体子集化成功即替换字幕中的字体名称，失败的字重由渲染器模拟
+            font_mapping[font_name] = random_name
+            font_results[label].update(subset_name=random_name, output_path=output_path, success=True)
+            print(f"成功子集化字体: {label} -> {os.path.basename(output_path)}")
+        else:
+            print(f"子集化失败: {label}")
+        if progress is not None:
+            progress(label, completed, len(future_jobs))
+    
+    # 映射按提交顺序排列，与完成顺序无关
+    font_mapping = {font_name: font_mapping[font_name] for font_name in families if font_name in font_mapping}
+    return font_mapping, font_results
+
+# 码位集合的紧凑表示，连续的码位合并为范围，如 "20-7E,4F60,597D"
+def format_codepoints(chars):
+    ranges = []
+    for codepoint in sorted({ord(char) for char in chars}):
+        if ranges and ranges[-1][1] == codepoint - 1:
+            ranges[-1][1] = codepoint
+        else:
+            ranges.append([codepoint, codepoint])
+    return ",".join(f"{start:X}" if start == end else f"{start:X}-{end:X}" for start, end in ranges)
+
+# format_codepoints 的逆运算
+def parse_codepoints(text):
+    chars = set()
+    for part in filter(None, text.split(",")):
+        start, _, end = part.partition("-")
+        chars.update(map(chr, range(int(start, 16), int(end or start, 16) + 1)))
+    return chars
+
+# 字幕文件内容的哈希
+def subtitle_digest(subtitle_file):
+    digest = hashlib.sha256()
+    with open(subtitle_file, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# 读取输出目录中的构建清单，不存在或格式版本不同时返回空清单
+def load_build_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"version": MANIFEST_VERSION, "subtitles": {}}
+
+# 构建清单中的输出文件名（相对于输出目录）对应的路径，不是输出目录中的文件名时返回 None
+def manifest_output_path(output_dir, name):
+    if not isinstance(name, str) or name in ('', os.curdir, os.pardir) or name != os.path.basename(name) or '/' in name or '\\' in name:
+        return None
+    return os.path.join(output_dir, name)
+
+# 构建清单中的记录换成输出文件的路径，记录中有不在输出目录中的文件时不使用该记录，返回 None
+def resolve_manifest_entry(output_dir, entry):
+    output_subtitle = manifest_output_path(output_dir, entry["output_subtitle"])
+    fonts = {label: {**font, "output_path": manifest_output_path(output_dir, font["output_path"])} for label, font in entry["fonts"].items()}
+    if output_subtitle is None or any(font["output_path"] is None for font in fonts.values()):
+        return None
+    return {**entry, "output_subtitle": output_subtitle, "fonts": fonts}
+
+# 构建清单中字幕文件的记录，以字幕文件的绝对路径为键，输出文件换成路径，没有记录时返回 None
+# 没有该路径的记录时使用输出到同一个字幕文件的记录（如界面每次上传的临时文件路径都不同）
+def get_manifest_entry(output_dir, subtitle_file):
+    subtitles = load_build_manifest(output_dir)["subtitles"]
+    entry = subtitles.get(os.path.abspath(subtitle_file))
+    if entry is None:
+        output_subtitle = os.path.basename(subtitle_output_path(subtitle_file, output_dir))
+        entry = next((other for other in subtitles.values() if other["output_subtitle"] == output_subtitle), None)
+    return resolve_manifest_entry(output_dir, entry) if entry is not None else None
+
+# 删除构建清单中列出的不再使用的子集化字体：只删除输出目录中（不经过符号链接）子集化字体形式的文件名，
+# 避免复制或下载来的构建清单删除其他文件
+def remove_stale_output(output_dir, name):
+    output_path = manifest_output_path(output_dir, name)
+    if output_path is None or not SUBSET_OUTPUT_PATTERN.fullmatch(name):
+        return
+    if os.path.dirname(os.path.realpath(output_path)) != os.path.realpath(output_dir):
+        return
+    if os.path.abspath(output_path) in subset_output_claims or not os.path.isfile(output_path):
+        return
+    os.remove(output_path)
+    print(f"删除了不再使用的子集化字体: {name}")
+
+# 登记正在进行的子集化将要生成或使用的字体输出文件，claimed 记录本次登记的文件，结束后由 release_subset_outputs 释放
+def claim_subset_output(output_path, claimed):
+    output_path = os.path.abspath(output_path)
+    with manifest_lock:
+        if output_path not in claimed:
+            claimed.add(output_path)
+            subset_output_claims[output_path] += 1
+
+# 释放 claim_subset_output 登记的字体输出文件
+def release_subset_outputs(claimed):
+    with manifest_lock:
+        subset_output_claims.subtract(claimed)
+        for output_path in claimed:
+            if subset_output_claims[output_path] <= 0:
+                del subset_output_claims[output_path]
+        claimed.clear()
+
+# 由子集化结果生成构建清单中的记录：字幕内容哈希、每个字体的码位集合、字体文件状态、缓存键和输出文件，
+# 输出文件记录为相对于输出目录的文件名，与运行时的当前目录无关
+def build_manifest_entry(subtitle_sha256, result, dialogues, font_mapping, embed_fonts):
+    fonts = {}
+    for label, font in result["fonts"].items():
+        if not font["success"]:
+            continue
+        chars = set().union(*(dialogues[face] for face in dialogues if face_label(face) in font["styles"]))
+        fonts[label] = {"font_name": font["font_name"], "font_path": font["font_path"], "face_index": font["face_index"],
+                        "font_stat": list(font_file_stat(font["font_path"])), "codepoints": format_codepoints(chars),
+                        "cache_key": font["cache_key"], "output_path": os.path.basename(font["output_path"])}
+    return {"subtitle_sha256": subtitle_sha256, "output_subtitle": os.path.basename(result["output_subtitle"]),
+            "profile": result["profile"], "flavor": result["flavor"], "embed_fonts": embed_fonts, "font_mapping": font_mapping,
+            "updated_at": result["created_at"], "fonts": fonts}
+
+# 更新构建清单中一个字幕文件的记录，并删除上次生成、现在不再被任何字幕使用的子集化字体文件
+# 输出到同一个字幕文件的其他记录已被覆盖，一并移除；其他正在进行的子集化登记过的字体文件不删除
+def update_build_manifest(output_dir, subtitle_file, entry):
+    key = os.path.abspath(subtitle_file)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    with manifest_lock:
+        manifest = load_build_manifest(output_dir)
+        obsolete = [other for other in manifest["subtitles"] if other == key or manifest["subtitles"][other]["output_subtitle"] == entry["output_subtitle"]]
+        previous = [manifest["subtitles"].pop(other) for other in obsolete]
+        manifest["subtitles"][key] = entry
+        if previous:
+            used = {font["output_path"] for other in manifest["subtitles"].values() for font in other["fonts"].values()}
+            for font in (font for other in previous for font in other["fonts"].values()):
+                if font["output_path"] not in used:
+                    remove_stale_output(output_dir, font["output_path"])
+        # 先写入临时文件再替换，中断时不会留下不完整的清单
+        temp_path = f"{manifest_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, manifest_path)
+
+# 比较两次的码位集合，返回 字体显示名称 -> (增加的字符数, 减少的字符数)，新增的字体不列出
+def diff_manifest_codepoints(previous, entry):
+    changes = {}
+    for label, font in entry["fonts"].items():
+        old = previous["fonts"].get(label)
+        if old is None or old["codepoints"] == font["codepoints"]:
+            continue
+        old_chars, new_chars = parse_codepoints(old["codepoints"]), parse_codepoints(font["codepoints"])
+        changes[label] = (len(new_chars - old_chars), len(old_chars - new_chars))
+    return changes
+
+# 字幕文件和使用的字体文件自上次生成后都没有变化、输出文件都存在时返回构建清单中的记录，否则返回 None
+def up_to_date_manifest_entry(subtitle_file, output_dir, embed_fonts=False, profile=None, flavor=None):
+    entry = get_manifest_entry(output_dir, subtitle_file)
+    if (entry is None or entry["embed_fonts"] != embed_fonts or entry["profile"] != (profile or SUBSET_PROFILE) or entry["flavor"] != (flavor or None)
+            or not entry["output_subtitle"] or not os.path.exists(entry["output_subtitle"])):
+        return None
+    try:
+        if entry["subtitle_sha256"] != subtitle_digest(subtitle_file):
+            return None
+        for font in entry["fonts"].values():
+            if list(font_file_stat(font["font_path"])) != font["font_stat"]:
+                return None
+            if not embed_fonts and not os.path.exists(font["output_path"]):
+                return None
+    except OSError:
+        return None
+    return entry
+
+# 子集化成功的字体在 [Fonts] 部分中的文件名 -> 字体文件路径
+def embedded_subset_fonts(font_results):
+    return {embedded_font_name(os.path.basename(font["output_path"])): font["output_path"]
+            for font in font_results.values() if font["success"]}
+
+# 字体已内嵌到字幕中后删除输出目录中的子集化字体文件
+def remove_embedded_font_files(font_results):
+    for font in font_results.values():
+        if not font["success"]:
+            continue
+        try:
+            os.remove(font["output_path"])
+        except FileNotFoundError:
+            pass
+        font["embedded"] = True
+
+# 子集化处理，返回结果字典：fonts 为每个字体的子集化结果和统计，output_subtitle 为修改后的字幕文件，
+# stages 为各阶段的统计，message 为结果描述。report 为 process_subtitle 记录过的统计，结果会合并到其中，
+# 并保存为输出目录中的 <原文件名>_report.json。progress 和 cancel_event 见 subset_fonts，取消后不修改字幕文件
+# embed_fonts 为 True 时把子集化字体内嵌到字幕的 [Fonts] 部分，不保留单独的字体文件，profile 为子集化配置，flavor 为压缩输出格式
+# use_cache 为 True 时与输出目录中的构建清单比较，只重新生成字符集变化的字体，字幕和字体都没有变化时不重写字幕文件
+def run_subsetting(dialogues, font_paths, subtitle_file, output_dir, max_workers=None, use_cache=True, low_memory=False, report=None, progress=None, cancel_event=None, embed_fonts=False, profile=None, flavor=None):
+    result = report if report is not None else {}
+    result.update(version=version, created_at=datetime.datetime.now().isoformat(timespec='seconds'),
+                  subtitle=subtitle_file, output_subtitle=None, fonts={}, profile=profile or SUBSET_PROFILE, flavor=flavor or None, message="")
+    claimed_outputs = set()
+    try:
+        check_output_flavor(flavor, embed_fonts)
+        previous = get_manifest_entry(output_dir, subtitle_file) if use_cache else None
+        with measure_stage(result, "subset"):
+            font_mapping, result["fonts"] = subset_fonts(dialogues, font_paths, output_dir, max_workers, use_cache, low_memory, progress, cancel_event, profile,
+                                                         previous["fonts"] if previous else None, claimed_outputs, flavor)
+        result["stages"]["subset"]["worker_cpu"] = round(sum(font.get("cpu") or 0 for font in result["fonts"].values()), 6)
+        
+        # 所有任务结束后再修改字幕文件
+        if cancel_event is not None and cancel_event.is_set():
+            result["message"] = f"子集化已取消，已完成 {len(font_mapping)} 个字体，未修改字幕文件"
+        elif font_mapping:
+            # 字幕内容和所有子集化字体都与上次相同时不重写字幕文件
+            subtitle_sha256 = subtitle_digest(subtitle_file)
+            cache_keys = {label: font["cache_key"] for label, font in result["fonts"].items() if font["success"]}
+            unchanged = (previous is not None and previous["subtitle_sha256"] == subtitle_sha256 and previous["embed_fonts"] == embed_fonts
+                         and previous["font_mapping"] == font_mapping and {label: font["cache_key"] for label, font in previous["fonts"].items()} == cache_keys
+                         and previous["output_subtitle"] and os.path.exists(previous["output_subtitle"]))
+            embedded_fonts = embedded_subset_fonts(result["fonts"]) if embed_fonts else None
+            if unchanged:
+                result["output_subtitle"] = previous["output_subtitle"]
+            else:
+                # 修改字幕文件
+                with measure_stage(result, "rewrite"):
+                    result["output_subtitle"] = modify_subtitle_file(subtitle_file, font_mapping, output_dir, embedded_fonts)
+            if embed_fonts:
+                remove_embedded_font_files(result["fonts"])
             
-            # 执行子集化
-            success = subset_font(font_path, chars, output_path, random_name)
-            if success:
-                # 去掉文件后缀名
-                subset_font_name = os.path.basename(output_path)
-                subset_font_name_no_ext = os.path.splitext(subset_font_name)[0]
-                font_mapping[font_name] = subset_font_name_no_ext
-                print(f"成功子集化字体: {font_name} -> {subset_font_name_no_ext}")
+            reused = sum(1 for font in result["fonts"].values() if font.get("reused"))
+            if unchanged:
+                result["message"] = "字幕和字体均未变化，未重新生成"
+            elif embed_fonts:
+                result["message"] = f"子集化完成！{len(embedded_fonts)} 个子集化字体已内嵌到字幕文件中"
             else:
-                print(f"子集化失败: {font_name}")
-        
-        if font_mapping:
-            # 修改字幕文件
-            modify_subtitle_file(subtitle_file, font_mapping, output_dir)
-            return f"子集化完成！生成了 {len(font_mapping)} 个字体文件，并修改了字幕文件"
+                result["message"] = f"子集化完成！生成了 {sum(1 for font in result['fonts'].values() if font['success']) - reused} 个字体文件，并修改了字幕文件"
+            if reused and not unchanged:
+                result["message"] += f"，{reused} 个字体未变化"
+            
+            # 记录到构建清单，列出字符集变化的字体
+            entry = build_manifest_entry(subtitle_sha256, result, dialogues, font_mapping, embed_fonts)
+            if previous is not None:
+                result["codepoint_changes"] = diff_manifest_codepoints(previous, entry)
+                for label, (added, removed) in result["codepoint_changes"].items():
+                    print(f"字符集变化: {label} 增加 {added} 个，减少 {removed} 个")
+            update_build_manifest(output_dir, subtitle_file, entry)
         else:
-            return "子集化失败，未生成任何字体文件"
+            result["message"] = "子集化失败，未生成任何字体文件"
+        
+        # 保存运行统计
+        name_without_ext = os.path.splitext(os.path.basename(subtitle_file))[0]
+        result["report_path"] = os.path.join(output_dir, f"{name_without_ext}_report.json")
+        write_run_report(result, result["report_path"])
     except Exception as e:
         print(f"子集化处理时出错: {e}")
-        return f"子集化失败: {str(e)}"
+        result["message"] = f"子集化失败: {str(e)}"
+    finally:
+        release_subset_outputs(claimed_outputs)
+    return result
 
-# 修改字幕文件
-def modify_subtitle_file(subtitle_file, font_mapping, output_dir):
+# 合并子集化：多个字幕文件（如整季）中同一字体使用的字符取并集，每个字体只子集化一次，所有字幕共用子集化字体
+# 返回每个字幕文件的结果字典列表，格式与 run_subsetting 相同，embed_fonts 时每个字幕只内嵌自己用到的字体
+def run_merged_subsetting(subtitle_files, output_dir, max_workers=None, use_cache=True, low_memory=False, embed_fonts=False, profile=None, flavor=None):
+    check_output_flavor(flavor, embed_fonts)
+    handled, results = call_font_service("merge", subtitle_files=[os.path.abspath(subtitle_file) for subtitle_file in subtitle_files], output_dir=os.path.abspath(output_dir),
+                                         max_workers=max_workers, use_cache=use_cache, low_memory=low_memory, embed_fonts=embed_fonts, profile=profile, flavor=flavor)
+    if handled:
+        for subtitle_file, result in zip(subtitle_files, results):
+            result["subtitle"] = subtitle_file
+        return results
+    results = []
+    merged_dialogues = {}
+    merged_font_paths = {}
+    subtitle_fonts = {}
+    uninstalled = {}
+    for subtitle_file in subtitle_files:
+        result = {"version": version, "created_at": datetime.datetime.now().isoformat(timespec='seconds'),
+                  "subtitle": subtitle_file, "output_subtitle": None, "fonts": {}, "uninstalled_fonts": [],
+                  "profile": profile or SUBSET_PROFILE, "flavor": flavor or None, "message": ""}
+        results.append(result)
+        try:
+            font_list, all_installed, uninstalled_fonts, font_paths, dialogues = process_subtitle(subtitle_file, result)
+        except Exception as e:
+            print(f"解析字幕文件时出错: {subtitle_file}: {e}")
+            result["message"] = f"解析字幕文件时出错: {e}"
+            continue
+        result["uninstalled_fonts"] = uninstalled_fonts
+        uninstalled.update(dict.fromkeys(uninstalled_fonts))
+        subtitle_fonts[subtitle_file] = font_list
+        merged_font_paths.update(font_paths)
+        for font_name, chars in dialogues.items():
+            merged_dialogues.setdefault(font_name, set()).update(chars)
+    
+    # 与界面一致，有字体未安装时不进行子集化
+    if uninstalled:
+        print(f"有 {len(uninstalled)} 个字体未安装: {', '.join(uninstalled)}")
+        for result in results:
+            result["message"] = result["message"] or f"有 {len(uninstalled)} 个字体未安装"
+        return results
+    
+    # 所有字幕共用同一个子集化阶段的统计
+    subset_report = {}
     try:
-        # 读取字幕文件，使用utf-8-sig编码处理BOM
-        with open(subtitle_file, 'r', encoding='utf-8-sig') as f:
-            lines = f.readlines()
-        
-        # 查找[Script Info]部分
-        script_info_index = -1
-        for i, line in enumerate(lines):
-            if line.strip().startswith('[Script Info]'):
-                script_info_index = i
-                break
-        
-        # 生成字体子集化信息
-        import datetime
-        current_time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        font_subset_info = []
-        font_subset_info.append('; ----- Font Subset Information -----\n')
-        for original_font, subset_font in font_mapping.items():
-            font_subset_info.append(f'; Font Subset: {subset_font} - {original_font}\n')
-        font_subset_info.append('\n')
-        font_subset_info.append(f'; Generated by Subsetter v{version} at {current_time}\n')
-        font_subset_info.append('; ----- Font Subset Information End -----\n')
-        
-        # 在[Script Info]后插入字体子集化信息
-        if script_info_index != -1:
-            # 直接修改lines列表，在[Script Info]行之后插入
-            new_lines = lines[:script_info_index+1] + font_subset_info + lines[script_info_index+1:]
-            lines = new_lines
-        else:
-            # 如果没有找到[Script Info]，在文件开头添加
-            lines = font_subset_info + lines
-        
-        # 分析字幕文件，找出所有style
-        all_styles = {}
-        style_section_start = -1
-        style_section_end = -1
-        
-        # 找出[V4+ Styles]部分的开始和结束位置
-        for i, line in enumerate(lines):
-            if line.strip().startswith('[V4+ Styles]'):
-                style_section_start = i
-            elif style_section_start != -1 and line.strip().startswith('['):
-                style_section_end = i
-                break
-        if style_section_end == -1 and style_section_start != -1:
-            style_section_end = len(lines)
-        
-        # 提取所有style，跳过Comment行
-        if style_section_start != -1:
-            for line in lines[style_section_start+1:style_section_end]:
-                if line.startswith('Style:'):
-                    parts = line.split(',')
-                    if len(parts) > 1:
-                        font_name = parts[1].strip()
-                        style_name = line.split(',')[0].split(':')[1].strip()
-                        all_styles[style_name] = (font_name, line)
-        
-        # 过滤出使用的style：所有被子集化的字体对应的style
-        used_style_lines = []
-        if style_section_start != -1:
-            used_style_lines.append(lines[style_section_start])  # 保留[V4+ Styles]行
-            for style_name, (font_name, style_line) in all_styles.items():
-                if font_name in font_mapping:
-                    used_style_lines.append(style_line)
-        
-        # 重建字幕文件内容，跳过[Event]部分中的Comment行
-        rebuilt_lines = []
-        i = 0
-        in_event_section = False
-        while i < len(lines):
-            line = lines[i]
-            # 检查是否进入或退出[Event]部分
-            if line.strip().startswith('[Events]'):
-                in_event_section = True
-                rebuilt_lines.append(line)
-                i += 1
-            elif in_event_section and line.strip().startswith('['):
-                in_event_section = False
-                rebuilt_lines.append(line)
-                i += 1
-            elif style_section_start != -1 and i == style_section_start:
-                # 替换为过滤后的style
-                rebuilt_lines.extend(used_style_lines)
-                # 跳过原有的style部分
-                i = style_section_end
-            elif in_event_section and line.strip().startswith('Comment:'):
-                # 跳过[Event]部分中的Comment行
-                i += 1
+        with measure_stage(subset_report, "subset"):
+            font_mapping, font_results = subset_fonts(merged_dialogues, merged_font_paths, output_dir, max_workers, use_cache, low_memory, profile=profile, flavor=flavor)
+    except Exception as e:
+        print(f"子集化处理时出错: {e}")
+        for result in results:
+            result["message"] = result["message"] or f"子集化失败: {str(e)}"
+        return results
+    
+    # 每个字幕文件只引用自己用到的字体
+    for result in results:
+        if result["subtitle"] not in subtitle_fonts:
+            continue
+        used_fonts = subtitle_fonts[result["subtitle"]]
+        result["fonts"] = {label: font for label, font in font_results.items() if font["font_name"] in used_fonts}
+        subtitle_mapping = {font_name: font_mapping[font_name] for font_name in used_fonts if font_name in font_mapping}
+        if not subtitle_mapping:
+            result["message"] = "子集化失败，未生成任何字体文件"
+            continue
+        result["stages"]["subset"] = subset_report["stages"]["subset"]
+        try:
+            embedded_fonts = embedded_subset_fonts(result["fonts"]) if embed_fonts else None
+            with measure_stage(result, "rewrite"):
+                result["output_subtitle"] = modify_subtitle_file(result["subtitle"], subtitle_mapping, output_dir, embedded_fonts)
+            if embed_fonts:
+                result["message"] = f"子集化完成！{len(embedded_fonts)} 个子集化字体已内嵌到字幕文件中"
             else:
-                rebuilt_lines.append(line)
-                i += 1
-        
-        # 更新行数，用于后续处理
-        lines = rebuilt_lines
-        
-        # 替换字幕文件中的字体名称
-        modified_lines = []
-        for line in lines:
-            modified_line = line
-            for original_font, subset_font in font_mapping.items():
-                # 替换Style部分的字体名称
-                if line.startswith('Style:'):
-                    parts = line.split(',')
-                    if len(parts) > 1 and parts[1].strip() == original_font:
-                        parts[1] = subset_font  # 去掉空格
-                        modified_line = ','.join(parts)
-                # 替换\fn后的字体名称
-                modified_line = modified_line.replace(f'\\fn{original_font}', f'\\fn{subset_font}')
-            modified_lines.append(modified_line)
-        
-        # 生成输出文件名：原文件名_subset.ass
-        base_name = os.path.basename(subtitle_file)
-        name_without_ext = os.path.splitext(base_name)[0]
-        output_subtitle = os.path.join(output_dir, f"{name_without_ext}_subset.ass")
-        with open(output_subtitle, 'w', encoding='utf-8') as f:
-            f.writelines(modified_lines)
-        
-        # 计算删除的样式数量
-        used_style_count = 0
-        for style_name, (font_name, style_line) in all_styles.items():
-            if font_name in font_mapping:
-                used_style_count += 1
-        deleted_style_count = len(all_styles) - used_style_count
+                result["message"] = f"子集化完成！使用了 {len(subtitle_mapping)} 个共享的子集化字体，并修改了字幕文件"
+            name_without_ext = os.path.splitext(os.path.basename(result["subtitle"]))[0]
+            result["report_path"] = os.path.join(output_dir, f"{name_without_ext}_report.json")
+            write_run_report(result, result["report_path"])
+        except Exception as e:
+            result["message"] = f"修改字幕文件时出错: {str(e)}"
+    
+    # 所有字幕都写入后再删除共享的字体文件，各字幕的结果共用同一个字体结果字典
+    if embed_fonts:
+        remove_embedded_font_files(font_results)
+    return results
+
+# 子集化处理，返回结果描述和运行统计的简要说明
+def perform_subsetting(dialogues, font_paths, subtitle_file, output_dir, max_workers=None, use_cache=True, low_memory=False, report=None, progress=None, cancel_event=None, embed_fonts=False, profile=None, flavor=None):
+    # 使用字体服务时由字体服务重新解析字幕并子集化，不报告进度，也不能中途取消
+    handled, result = call_font_service("subset", subtitle_file=os.path.abspath(subtitle_file), output_dir=os.path.abspath(output_dir), max_workers=max_workers,
+                                        use_cache=use_cache, low_memory=low_memory, embed_fonts=embed_fonts, profile=profile, flavor=flavor)
+    if not handled:
+        result = run_subsetting(dialogues, font_paths, subtitle_file, output_dir, max_workers, use_cache, low_memory, report, progress, cancel_event, embed_fonts, profile, flavor)
+    summary = format_run_report(result)
+    return f"{result['message']}\n{summary}" if summary else result["message"]
+
+# 提交子集化任务，fn(progress, cancel_event) 在后台线程中执行，返回值为任务结果
+# 同一用户的任务按提交顺序执行，不同用户之间轮流执行，同时运行的任务数不超过 JOB_WORKERS
+def submit_subset_job(user, fn):
+    global job_counter
+    with job_condition:
+        job_counter += 1
+        job = {"id": job_counter, "user": user, "status": "queued", "fn": fn, "result": None,
+               "messages": queue.Queue(), "cancel_event": threading.Event()}
+        job_queues.setdefault(user, []).append(job)
+        subset_jobs[job["id"]] = job
+        # 按需启动后台线程
+        while len(job_workers) < max(JOB_WORKERS, 1):
+            thread = threading.Thread(target=subset_job_worker, daemon=True)
+            thread.start()
+            job_workers.append(thread)
+        job_condition.notify()
+    return job
+
+# 后台线程：轮流从各用户的队列中取出任务执行
+def subset_job_worker():
+    while True:
+        with job_condition:
+            while not job_queues:
+                job_condition.wait()
+            user, user_jobs = job_queues.popitem(last=False)
+            job = user_jobs.pop(0)
+            # 该用户还有任务时排到队尾
+            if user_jobs:
+                job_queues[user] = user_jobs
+            job["status"] = "running"
+        try:
+            job["result"] = job["fn"](job["messages"].put, job["cancel_event"])
+            job["status"] = "cancelled" if job["cancel_event"].is_set() else "done"
+        except Exception as e:
+            print(f"子集化任务出错: {e}")
+            job["result"] = f"子集化失败: {str(e)}"
+            job["status"] = "failed"
+        with job_condition:
+            subset_jobs.pop(job["id"], None)
+        job["messages"].put(None)
+
+# 任务在队列中的位置，1 表示下一个执行，不在排队时返回 0
+def subset_job_position(job):
+    with job_condition:
+        if job["status"] != "queued":
+            return 0
+        # 按轮转顺序模拟出队
+        position = 0
+        user_jobs = list(job_queues.values())
+        for round_index in range(max(len(jobs) for jobs in user_jobs)):
+            for jobs in user_jobs:
+                if round_index < len(jobs):
+                    position += 1
+                    if jobs[round_index] is job:
+                        return position
+        return 0
+
+# 取消任务：排队中的任务直接移出队列，正在运行的任务不再提交新的字体，已开始的字体会继续完成
+# 任务不存在或已结束时返回 False
+def cancel_subset_job(job_id):
+    with job_condition:
+        job = subset_jobs.get(job_id)
+        if job is None:
+            return False
+        job["cancel_event"].set()
+        if job["status"] != "queued":
+            return True
+        subset_jobs.pop(job_id)
+        user_jobs = job_queues.get(job["user"], [])
+        if job in user_jobs:
+            user_jobs.remove(job)
+            if not user_jobs:
+                del job_queues[job["user"]]
+        job["status"] = "cancelled"
+        job["result"] = "子集化已取消"
+    job["messages"].put(None)
+    return True
+
+# 等待任务完成，逐步产出排队位置和进度文本，最后产出任务结果
+def iter_subset_job(job, interval=0.5):
+    while True:
+        position = subset_job_position(job)
+        if position:
+            yield f"排队中，前面还有 {position - 1} 个任务..."
+        try:
+            message = job["messages"].get(timeout=interval)
+        except queue.Empty:
+            continue
+        if message is None:
+            break
+        yield message
+    yield job["result"]
+
+# 生成字体子集化信息
+def font_subset_info_lines(font_mapping):
+    current_time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    font_subset_info = []
+    font_subset_info.append('; ----- Font Subset Information -----\n')
+    for original_font, subset_font in font_mapping.items():
+        font_subset_info.append(f'; Font Subset: {subset_font} - {original_font}\n')
+    font_subset_info.append('\n')
+    font_subset_info.append(f'; Generated by Subsetter v{version} at {current_time}\n')
+    font_subset_info.append('; ----- Font Subset Information End -----\n')
+    return font_subset_info
+
+# 编译匹配所有原字体名称的 \fn 正则，较长的名称优先，字体名后只能是 \ 或 }
+def compile_fn_rename_pattern(font_mapping):
+    names = sorted(font_mapping, key=len, reverse=True)
+    return re.compile(r'\\fn(\s*@?)(' + '|'.join(map(re.escape, names)) + r')(?=\s*(?:\\|\}|$))')
+
+# 内嵌字体的附件名称：子集化字体文件名后加 _0，与 Aegisub 相同
+def embedded_font_name(file_name):
+    stem, ext = os.path.splitext(os.path.basename(file_name))
+    return f"{stem}_0{ext}"
+
+# 按 ASS 规范编码内嵌字体数据，f 为打开的字体文件或 bytes，逐块产出编码后的文本
+# 每 3 个字节编码为 4 个字符（6 位值加 33），结尾不足 3 个字节时只输出 2 或 3 个字符，每行 80 个字符。
+# 编码与 base64 的分组方式相同，只是字母表不同，因此先用 base64 编码再查表替换字符
+def iter_uuencoded_font(f, chunk_lines=1024):
+    if isinstance(f, (bytes, bytearray, memoryview)):
+        f = io.BytesIO(f)
+    # 每块为 60 字节的整数倍，块内编码结果正好是整行
+    while chunk := f.read(60 * chunk_lines):
+        encoded = base64.b64encode(chunk).rstrip(b'=').translate(UUENCODE_TABLE)
+        lines = [encoded[i:i + 80] for i in range(0, len(encoded), 80)]
+        lines.append(b'')
+        yield b'\n'.join(lines).decode('ascii')
+
+# 产出 [Fonts] 部分，fonts 为 附件名称 -> 字体文件路径或字体数据
+def iter_fonts_section(fonts):
+    yield '[Fonts]\n'
+    for name, font in fonts.items():
+        yield f'fontname: {name}\n'
+        if isinstance(font, (bytes, bytearray, memoryview)):
+            yield from iter_uuencoded_font(font)
+        else:
+            with open(font, 'rb') as f:
+                yield from iter_uuencoded_font(f)
+
+# 逐行改写字幕
+def iter_rewritten_subtitle(lines, font_mapping, stats=None, embedded_fonts=None):
+    R"""
+    单次遍历改写字幕，产出改写后的行，lines 可以是打开的文件对象。
+    
+    - 在 [Script Info] 后插入字体子集化信息，第一个部分不是 [Script Info] 时插入到文件开头。
+    - 样式部分只保留字体被子集化的 Style 行，并将字体替换为子集化字体名称。
+    - 删除 [Events] 部分中的 Comment 行。
+    - 所有 \fn 字体替换由一个正则完成，每行只扫描一次。
+    - embedded_fonts 为 附件名称 -> 字体文件路径或字体数据，不为空时删除原有的 [Fonts] 部分，
+      在文件末尾写入内嵌这些字体的 [Fonts] 部分。
+    - stats 用于统计删除的样式数量。
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("deleted_styles", 0)
+    fn_pattern = compile_fn_rename_pattern(font_mapping) if font_mapping else None
+    rename_fn = lambda match: f'\\fn{match.group(1)}{font_mapping[match.group(2)]}'
+    font_index = 1
+    section = None
+    line = '\n'
+    # 第一个部分之前的空行和注释行，确定字体子集化信息的位置后再产出
+    leading_lines = []
+    
+    for line in lines:
+        stripped = line.strip()
+        if leading_lines is not None:
+            if not stripped or stripped.startswith(';'):
+                leading_lines.append(line)
+                continue
+            # 第一个部分是 [Script Info] 时插入到它之后，否则插入到文件开头
+            if stripped.startswith('[Script Info]'):
+                yield from leading_lines
+                yield line
+                yield from font_subset_info_lines(font_mapping)
+                leading_lines = None
+                section = stripped.lower()
+                continue
+            yield from font_subset_info_lines(font_mapping)
+            yield from leading_lines
+            leading_lines = None
+        
+        if stripped.startswith('['):
+            # 内嵌子集化字体时删除原有的内嵌字体
+            if embedded_fonts is not None and stripped.lower() == '[fonts]':
+                section = '[fonts]'
+                continue
+            yield line
+            section = stripped.lower()
+            continue
+        
+        if section is not None and section.endswith('styles]'):
+            if line.startswith('Format:'):
+                fields = [field.strip().lower() for field in line[len('Format:'):].split(',')]
+                font_index = fields.index('fontname') if 'fontname' in fields else 1
+            elif line.startswith('Style:'):
+                # 替换 Style 行中的字体名称，删除未使用的 style
+                parts = line[len('Style:'):].split(',')
+                if len(parts) <= font_index:
+                    yield line
+                    continue
+                font_name = parts[font_index].strip()
+                vertical = font_name.startswith('@')
+                subset_font = font_mapping.get(font_name[1:] if vertical else font_name)
+                if subset_font is None:
+                    stats["deleted_styles"] += 1
+                    continue
+                parts[font_index] = f"@{subset_font}" if vertical else subset_font
+                yield 'Style:' + ','.join(parts)
+                continue
+        elif section == '[events]' and line.startswith('Comment:'):
+            # 跳过[Event]部分中的Comment行
+            continue
+        elif section == '[fonts]' and embedded_fonts is not None:
+            continue
+        
+        # 替换\fn后的字体名称
+        if fn_pattern is not None and '\\fn' in line:
+            line = fn_pattern.sub(rename_fn, line)
+        yield line
+    
+    # 文件中只有空行和注释行
+    if leading_lines is not None:
+        yield from font_subset_info_lines(font_mapping)
+        yield from leading_lines
+    
+    # 在文件末尾写入内嵌字体
+    if embedded_fonts:
+        yield '\n' if line.endswith('\n') else '\n\n'
+        yield from iter_fonts_section(embedded_fonts)
+
+# 输出的字幕文件路径：原文件名_subset.ass
+def subtitle_output_path(subtitle_file, output_dir):
+    name_without_ext = os.path.splitext(os.path.basename(subtitle_file))[0]
+    return os.path.join(output_dir, f"{name_without_ext}_subset.ass")
+
+# 修改字幕文件
+def modify_subtitle_file(subtitle_file, font_mapping, output_dir, embedded_fonts=None):
+    try:
+        output_subtitle = subtitle_output_path(subtitle_file, output_dir)
+        
+        # 读取字幕文件，使用utf-8-sig编码处理BOM，边读边写
+        stats = {}
+        with open(subtitle_file, 'r', encoding='utf-8-sig') as source, open(output_subtitle, 'w', encoding='utf-8') as f:
+            f.writelines(iter_rewritten_subtitle(source, font_mapping, stats, embedded_fonts))
         
         print(f"字幕文件已修改并保存到: {output_subtitle}")
-        print(f"删除了 {deleted_style_count} 个未使用的style")
+        if embedded_fonts:
+            print(f"内嵌了 {len(embedded_fonts)} 个字体")
+        print(f"删除了 {stats['deleted_styles']} 个未使用的style")
         print(f"删除了[Event]部分中的所有Comment行")
+        return output_subtitle
     except Exception as e:
         print(f"修改字幕文件时出错: {e}")
         raise
 
+# 确保可以通过字体索引查找字体：尚未连接字体服务也未读取字体时（如作为库使用，没有启动界面或批量处理），
+# 先尝试连接字体服务，字体服务未运行时在当前进程中读取字体
+def ensure_font_index():
+    if fonts_loaded or font_service_socket is not None:
+        return
+    with font_index_init_lock:
+        if fonts_loaded or font_service_socket is not None:
+            return
+        if not (use_font_service and connect_font_service()):
+            load_all_fonts()
+
+# 默认的字体查找函数：在字体索引中查找字体并读取字体数据，返回 (字体数据, 字体编号)，找不到时返回 None
+def index_font_resolver(font_name, weight=400, italic=False):
+    ensure_font_index()
+    resolved = resolve_font(font_name, weight, italic)
+    if resolved is None:
+        return None
+    font_path, face_index = resolved
+    with open_font_file(font_path) as f:
+        return f.read(), face_index
+
+# 在内存中子集化一个字体，返回子集化后的字体数据，face_index 为 TTC 中的字体编号
+def subset_font_bytes(font_data, chars, random_name, face_index=0, metrics=None, options=None):
+    if metrics is None:
+        metrics = {}
+    metrics["input_bytes"] = len(font_data)
+    output = io.BytesIO()
+    # 单个字体时字体编号必须为 -1
+    font_number = face_index if font_data[:4] == b'ttcf' else -1
+    subset_font_source(io.BytesIO(font_data), font_number, [ord(char) for char in chars], random_name, output, metrics, options)
+    metrics["output_bytes"] = output.tell()
+    return output.getvalue()
+
+# 字体数据中某个字体缺少的字符，与字体索引中的缺字检查相同
+def font_data_missing_chars(font_data, face_index, chars):
+    f = io.BytesIO(font_data)
+    cmap = read_sfnt_tables(f, read_sfnt_offsets(f)[face_index], (b'cmap',)).get(b'cmap')
+    bits = parse_cmap_coverage(cmap) if cmap else bytearray()
+    return "".join(sorted(char for char in chars if ord(char) >= 0x20 and not coverage_contains(bits, ord(char))))
+
+# 在内存中子集化字幕
+def subset_subtitle_bytes(subtitle, font_resolver=None, embed_fonts=False, profile=None, flavor=None):
+    R"""
+    在内存中完成解析、子集化和改写字幕，不读写磁盘，可以在多个线程中同时调用。
+    
+    - subtitle 为字幕文本（str）或 UTF-8 编码的字幕数据（bytes）。
+    - font_resolver(字体名, 字重, 斜体) 返回字体数据、(字体数据, 字体编号) 或 None（找不到字体），
+      不提供时使用字体索引中的字体（会读取字体文件）；首次调用时连接正在运行的字体服务，
+      字体服务未运行时在当前进程中读取字体。
+    - 字体命名与文件子集化相同：同一字体名称的所有字体共用一个由内容决定的8位家族名。
+    - 找不到的字体保留原名称，记录在 uninstalled_fonts 中，其他字体照常子集化。
+    - embed_fonts 为 True 时子集化字体同时内嵌到字幕的 [Fonts] 部分，profile 为子集化配置，
+      flavor 为压缩输出格式（"woff" 或 "woff2"，不能与 embed_fonts 同时使用）。
+    - 返回 {"subtitle": 改写后的字幕文本, "fonts": {文件名: 字体数据}, "font_mapping": 原字体名称 -> 子集化字体名称,
+      "uninstalled_fonts": [...], "missing_glyphs": 字体显示名称 -> 缺少的字符}。
+    """
+    if font_resolver is None:
+        font_resolver = index_font_resolver
+    check_output_flavor(flavor, embed_fonts)
+    options = subset_profile_options(profile, flavor)
+    if isinstance(subtitle, bytes):
+        subtitle = subtitle.decode('utf-8-sig')
+    lines = subtitle.splitlines(keepends=True)
+    _, dialogues = parse_ass_lines(lines)
+    
+    # 查找字体，同一字体名称中实际使用同一个字体的字重和斜体合并字符
+    families = {}
+    uninstalled_fonts = []
+    digests = {}
+    for face, chars in dialogues.items():
+        font_name = face[0]
+        if font_name in uninstalled_fonts or not chars:
+            continue
+        resolved = font_resolver(*face)
+        if resolved is None:
+            uninstalled_fonts.append(font_name)
+            families.pop(font_name, None)
+            continue
+        font_data, face_index = resolved if isinstance(resolved, tuple) else (resolved, 0)
+        # 同一份字体数据只计算一次哈希，同时保留字体数据的引用，避免 id 被重复使用
+        digest = digests.get(id(font_data))
+        if digest is None:
+            digest = digests[id(font_data)] = (hashlib.sha256(font_data).hexdigest(), font_data)
+        group = families.setdefault(font_name, {}).setdefault((digest[0], face_index), {"data": font_data, "faces": [], "chars": set()})
+        group["faces"].append(face)
+        group["chars"].update(chars)
+    
+    fonts = {}
+    font_mapping = {}
+    missing_glyphs = {}
+    for font_name, groups in families.items():
+        base_keys = [subset_cache_key(digest, face_index, group["chars"], options) for (digest, face_index), group in groups.items()]
+        random_name = generate_subset_name(hashlib.sha256('\n'.join(sorted(base_keys)).encode('ascii')).hexdigest())
+        for number, ((_, face_index), group) in enumerate(groups.items()):
+            font_data = group["data"]
+            missing = font_data_missing_chars(font_data, face_index, group["chars"])
+            if missing:
+                missing_glyphs[face_label(group["faces"][0])] = missing
+            # CFF 字体保存为 .otf，其他保存为 .ttf，家族中的其他字体在文件名后加序号
+            offset = read_sfnt_offsets(io.BytesIO(font_data))[face_index]
+            ext = subset_font_ext(options, '.otf' if font_data[offset:offset + 4] == b'OTTO' else '.ttf')
+            file_name = f"{random_name}{ext}" if number == 0 else f"{random_name}-{number}{ext}"
+            fonts[file_name] = subset_font_bytes(font_data, group["chars"], random_name, face_index, options=options)
+        font_mapping[font_name] = random_name
+    
+    return {
+        "subtitle": "".join(iter_rewritten_subtitle(lines, font_mapping, embedded_fonts={embedded_font_name(file_name): font_data for file_name, font_data in fonts.items()} if embed_fonts else None)),
+        "fonts": fonts,
+        "font_mapping": font_mapping,
+        "uninstalled_fonts": uninstalled_fonts,
+        "missing_glyphs": missing_glyphs,
+    }
+
 # 初始化函数：读取字体列表
-def initialize_app():
-    load_all_fonts()
+def initialize_app(progress=None):
+    global fonts_loaded
+    
+    # 有字体服务时由字体服务查找字体和子集化，不在当前进程中读取字体
+    if use_font_service and connect_font_service():
+        fonts_loaded = True
+        return fonts_loaded
+    load_all_fonts(progress)
+    # 之后字体目录的变化由监视线程增量更新
+    start_font_watcher()
     return fonts_loaded
 
 # 重新读取字体列表
-def reload_fonts():
-    load_all_fonts()
+def reload_fonts(progress=None):
+    handled, count = call_font_service("reload")
+    if handled:
+        return f"字体服务重新读取完成，共 {count} 个字体"
+    load_all_fonts(progress)
     return f"字体重新读取完成，共 {len(all_fonts)} 个字体"
 
+# 在后台线程中执行 fn(progress)，逐步产出进度文本，生成器的返回值为 fn 的返回值
+def run_with_progress(fn):
+    progress_queue = queue.Queue()
+    result = []
+    
+    def worker():
+        try:
+            result.append(fn(lambda processed, total: progress_queue.put(f"正在读取系统字体 {processed}/{total}...")))
+        finally:
+            progress_queue.put(None)
+    
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    while (message := progress_queue.get()) is not None:
+        yield message
+    thread.join()
+    return result[0] if result else None
+
 # 初始化应用并启用组件
 def init_and_enable():
-    success = initialize_app()
-    if success:
-        return "字体读取完成，可以上传字幕文件", gr.update(interactive=True), gr.update(interactive=True)
+    import gradio as gr
+    
+    progress_messages = run_with_progress(initialize_app)
+    for message in progress_messages:
+        yield message, gr.update(interactive=False), gr.update(interactive=False)
+    if fonts_loaded:
+        yield "字体读取完成，可以上传字幕文件", gr.update(interactive=True), gr.update(interactive=True)
     else:
-        return "字体读取失败", gr.update(interactive=False), gr.update(interactive=False)
-
-# 创建 Gradio 界面
-with gr.Blocks() as demo:
-    gr.Markdown("# 字幕字体子集化工具")
-    
-    # 初始化状态
-    initialization_status = gr.Textbox(label="初始化状态", value="正在读取系统字体...", interactive=False)
-    
-    # 上传组件（默认禁用，字体读取完成后启用）
-    file_input = gr.File(label="上传 ASS 字幕文件", file_types=[".ass"], interactive=False)
-    
-    # 保存位置选择
-    output_dir_input = gr.Textbox(label="子集化字体保存位置", value="Subset", interactive=True, placeholder="请输入保存文件夹路径")
-    
-    # 字体列表和状态
-    font_list_output = gr.JSON(label="使用的字体列表")
-    uninstalled_fonts_output = gr.JSON(label="未安装的字体")
-    all_installed_output = gr.Textbox(label="安装状态", interactive=False)
-    
-    # 按钮
-    subset_button = gr.Button("子集化", interactive=False)
-    check_button = gr.Button("再次检查字体", interactive=False)
-    reload_button = gr.Button("重新读取系统字体")
-    reload_status = gr.Textbox(label="重新读取状态", interactive=False)
-    
-    # 输出
-    result_output = gr.Textbox(label="结果", interactive=False)
-    
-    # 存储状态
-    font_list_state = gr.State([])
-    uninstalled_fonts_state = gr.State([])
-    font_paths_state = gr.State({})
-    dialogues_state = gr.State({})
-    
-    # 应用启动时执行初始化
-    demo.load(
-        fn=init_and_enable,
-        inputs=[],
-        outputs=[initialization_status, file_input, check_button]
-    )
-    
-    # 上传文件后处理
-    def on_file_upload(file):
-        if file is None:
-            return [], [], "请上传 ASS 字幕文件", [], [], {}, {}, gr.update(interactive=False), ""
-        font_list, all_installed, uninstalled_fonts, font_paths, dialogues = process_subtitle(file)
-        if all_installed:
-            status_text = "所有字体均已安装"
+        yield "字体读取失败", gr.update(interactive=False), gr.update(interactive=False)
+
+# 创建 Gradio 界面，只在启动界面时导入 gradio
+def build_ui():
+    import gradio as gr
+    
+    with gr.Blocks() as demo:
+        gr.Markdown("# 字幕字体子集化工具")
+        
+        # 初始化状态
+        initialization_status = gr.Textbox(label="初始化状态", value="正在读取系统字体...", interactive=False)
+        
+        # 上传组件（默认禁用，字体读取完成后启用）
+        file_input = gr.File(label="上传 ASS 字幕文件", file_types=[".ass"], interactive=False)
+        
+        # 保存位置选择
+        output_dir_input = gr.Textbox(label="子集化字体保存位置", value="Subset", interactive=True, placeholder="请输入保存文件夹路径")
+        
+        # 并行子集化的进程数
+        max_workers_input = gr.Number(label="并行子集化进程数", value=os.cpu_count() or 1, minimum=1, precision=0, interactive=True)
+        
+        # 低内存模式
+        low_memory_input = gr.Checkbox(label="低内存模式（适合超大字体）", value=False, interactive=True)
+        
+        # 子集化配置
+        profile_input = gr.Dropdown(label="子集化配置", choices=list(SUBSET_PROFILES), value=SUBSET_PROFILE, interactive=True)
+        
+        # 输出格式，压缩格式需要渲染器支持
+        flavor_input = gr.Dropdown(label="输出格式（WOFF/WOFF2 需要渲染器支持，不能内嵌）", choices=[("TTF/OTF", "")] + [(flavor.upper(), flavor) for flavor in SUBSET_FLAVORS],
+                                   value="", interactive=True)
+        
+        # 内嵌字体
+        embed_fonts_input = gr.Checkbox(label="将子集化字体内嵌到字幕文件中", value=False, interactive=True)
+        
+        # 字体列表和状态
+        font_list_output = gr.JSON(label="使用的字体列表")
+        uninstalled_fonts_output = gr.JSON(label="未安装的字体")
+        all_installed_output = gr.Textbox(label="安装状态", interactive=False)
+        missing_glyphs_output = gr.Textbox(label="缺字检查", interactive=False, lines=3)
+        
+        # 按钮
+        subset_button = gr.Button("子集化", interactive=False)
+        cancel_button = gr.Button("取消子集化")
+        cancel_status = gr.Textbox(label="取消状态", interactive=False)
+        check_button = gr.Button("再次检查字体", interactive=False)
+        reload_button = gr.Button("重新读取系统字体")
+        reload_status = gr.Textbox(label="重新读取状态", interactive=False)
+        
+        # 字体来源
+        font_dirs_input = gr.Textbox(label="项目字体文件夹（每行一个）", value="\n".join(project_font_dirs), lines=3, interactive=True)
+        system_fonts_input = gr.Checkbox(label="使用系统字体", value=use_system_fonts, interactive=True)
+        font_dirs_button = gr.Button("应用字体来源")
+        
+        # 子集化缓存
+        cache_info_button = gr.Button("查看子集化缓存")
+        cache_clear_button = gr.Button("清空子集化缓存")
+        font_pool_button = gr.Button("查看字体缓存池")
+        cache_status = gr.Textbox(label="子集化缓存", interactive=False)
+        
+        # 输出
+        result_output = gr.Textbox(label="结果", interactive=False)
+        
+        # 存储状态
+        font_list_state = gr.State([])
+        uninstalled_fonts_state = gr.State([])
+        font_paths_state = gr.State({})
+        dialogues_state = gr.State({})
+        report_state = gr.State({})
+        job_state = gr.State(None)
+        
+        # 应用启动时执行初始化
+        demo.load(
+            fn=init_and_enable,
+            inputs=[],
+            outputs=[initialization_status, file_input, check_button]
+        )
+        
+        # 上传文件后处理
+        def on_file_upload(file):
+            if file is None:
+                return [], [], "请上传 ASS 字幕文件", "", [], [], {}, {}, {}, gr.update(interactive=False), ""
+            # 记录解析和查找字体阶段的统计，子集化时合并到运行统计中
+            report = {}
+            font_list, all_installed, uninstalled_fonts, font_paths, dialogues = process_subtitle(file, report)
+            if all_installed:
+                status_text = "所有字体均已安装"
+            else:
+                status_text = f"有 {len(uninstalled_fonts)} 个字体未安装"
+            missing_text = format_missing_glyphs(report["missing_glyphs"])
+            return font_list, uninstalled_fonts, status_text, missing_text, font_list, uninstalled_fonts, font_paths, dialogues, report, gr.update(interactive=all_installed), ""
+        
+        # 绑定上传事件
+        file_input.change(
+            fn=on_file_upload,
+            inputs=[file_input],
+            outputs=[font_list_output, uninstalled_fonts_output, all_installed_output, missing_glyphs_output, font_list_state, uninstalled_fonts_state, font_paths_state, dialogues_state, report_state, subset_button, result_output]
+        )
+        
+        # 再次检查字体
+        def on_check_fonts(font_list):
+            if not font_list:
+                return [], "请先上传 ASS 字幕文件", gr.update(interactive=False)
+            all_installed, uninstalled_fonts = check_fonts(font_list)
+            status_text = "所有字体均已安装" if all_installed else f"有 {len(uninstalled_fonts)} 个字体未安装"
+            return uninstalled_fonts, status_text, gr.update(interactive=all_installed)
+        
+        # 绑定检查按钮事件
+        check_button.click(
+            fn=on_check_fonts,
+            inputs=[font_list_state],
+            outputs=[uninstalled_fonts_output, all_installed_output, subset_button]
+        )
+        
+        # 重新读取字体
+        def on_reload_fonts():
+            status = yield from run_with_progress(reload_fonts)
+            yield status
+        
+        # 绑定重新读取按钮事件
+        reload_button.click(
+            fn=on_reload_fonts,
+            inputs=[],
+            outputs=[reload_status]
+        )
+        
+        # 设置字体来源并读取新增目录中的字体
+        def on_set_font_dirs(font_dirs, system_fonts):
+            # 字体服务由多个客户端共用，自定义字体来源后改为在当前进程中读取字体
+            disconnect_font_service()
+            configure_font_sources(font_dirs.splitlines(), system_fonts)
+            status = yield from run_with_progress(reload_fonts)
+            yield f"{status}，字体目录: {', '.join(font_watched_dirs) or '无'}"
+        
+        # 绑定字体来源按钮事件
+        font_dirs_button.click(
+            fn=on_set_font_dirs,
+            inputs=[font_dirs_input, system_fonts_input],
+            outputs=[reload_status]
+        )
+        
+        # 绑定子集化缓存按钮事件
+        cache_info_button.click(
+            fn=subset_cache_info,
+            inputs=[],
+            outputs=[cache_status]
+        )
+        cache_clear_button.click(
+            fn=clear_subset_cache,
+            inputs=[],
+            outputs=[cache_status]
+        )
+        font_pool_button.click(
+            fn=font_pool_info,
+            inputs=[],
+            outputs=[cache_status]
+        )
+        
+        # 子集化处理：提交到任务队列，显示排队位置和每个字体的进度
+        def on_subset(dialogues, font_paths, report, file, output_dir, max_workers, low_memory, embed_fonts, profile, flavor, request: gr.Request):
+            if file is None:
+                yield "请先上传字幕文件", None
+                return
+            if not output_dir:
+                yield "请输入保存文件夹路径", None
+                return
+            if flavor and embed_fonts:
+                yield f"{flavor.upper()} 格式的字体不能内嵌到字幕中", None
+                return
+            
+            def run(progress, cancel_event):
+                report_progress = lambda font_name, completed, total: progress(f"正在子集化 {completed}/{total}: {font_name}")
+                return perform_subsetting(dialogues, font_paths, file.name, output_dir, int(max_workers) if max_workers else None,
+                                          low_memory=low_memory, report=dict(report or {}), progress=report_progress, cancel_event=cancel_event,
+                                          embed_fonts=embed_fonts, profile=profile, flavor=flavor or None)
+            
+            job = submit_subset_job(request.session_hash if request else None, run)
+            for message in iter_subset_job(job):
+                yield message, job["id"]
+        
+        # 取消子集化
+        def on_cancel_subset(job_id):
+            if job_id is None or not cancel_subset_job(job_id):
+                return "没有正在进行的子集化任务"
+            return "已请求取消子集化，正在处理的字体完成后停止"
+        
+        # 绑定子集化按钮事件，处理函数只等待任务队列，不限制并发
+        subset_button.click(
+            fn=on_subset,
+            inputs=[dialogues_state, font_paths_state, report_state, file_input, output_dir_input, max_workers_input, low_memory_input, embed_fonts_input, profile_input, flavor_input],
+            outputs=[result_output, job_state],
+            concurrency_limit=None
+        )
+        cancel_button.click(
+            fn=on_cancel_subset,
+            inputs=[job_state],
+            outputs=[cancel_status]
+        )
+        
+    return demo
+
+# 展开命令行输入：目录中的 .ass 文件、通配符和字幕文件路径
+# 返回 (字幕文件路径, 相对目录) 列表，相对目录为字幕文件相对于输入目录（通配符中不含通配字符的部分）的目录，
+# 输出时保留这一层目录结构，避免不同目录中的同名字幕互相覆盖
+def expand_subtitle_inputs(inputs, recursive=False):
+    subtitle_files = {}
+    for item in inputs:
+        if os.path.isdir(item):
+            root = item
+            pattern = os.path.join(item, '**', '*') if recursive else os.path.join(item, '*')
+            matches = sorted(glob.glob(pattern, recursive=recursive))
+        elif any(char in item for char in '*?['):
+            parts = item.replace('\\', '/').split('/')
+            prefix = []
+            for part in parts[:-1]:
+                if any(char in part for char in '*?['):
+                    break
+                prefix.append(part)
+            root = '/'.join(prefix) or '.'
+            matches = sorted(glob.glob(item, recursive=True))
         else:
-            status_text = f"有 {len(uninstalled_fonts)} 个字体未安装"
-        return font_list, uninstalled_fonts, status_text, font_list, uninstalled_fonts, font_paths, dialogues, gr.update(interactive=all_installed), ""
-    
-    # 绑定上传事件
-    file_input.change(
-        fn=on_file_upload,
-        inputs=[file_input],
-        outputs=[font_list_output, uninstalled_fonts_output, all_installed_output, font_list_state, uninstalled_fonts_state, font_paths_state, dialogues_state, subset_button, result_output]
-    )
-    
-    # 再次检查字体
-    def on_check_fonts(font_list):
-        if not font_list:
-            return [], "请先上传 ASS 字幕文件", gr.update(interactive=False)
-        all_installed, uninstalled_fonts = check_fonts(font_list)
-        status_text = "所有字体均已安装" if all_installed else f"有 {len(uninstalled_fonts)} 个字体未安装"
-        return uninstalled_fonts, status_text, gr.update(interactive=all_installed)
-    
-    # 绑定检查按钮事件
-    check_button.click(
-        fn=on_check_fonts,
-        inputs=[font_list_state],
-        outputs=[uninstalled_fonts_output, all_installed_output, subset_button]
-    )
-    
-    # 重新读取字体
-    def on_reload_fonts():
-        status = reload_fonts()
-        return status
-    
-    # 绑定重新读取按钮事件
-    reload_button.click(
-        fn=on_reload_fonts,
-        inputs=[],
-        outputs=[reload_status]
-    )
-    
-    # 子集化处理
-    def on_subset(dialogues, font_paths, file, output_dir):
-        if file is None:
-            return "请先上传字幕文件"
-        if not output_dir:
-            return "请输入保存文件夹路径"
-        result = perform_subsetting(dialogues, font_paths, file.name, output_dir)
+            subtitle_files.setdefault(item, '')
+            continue
+        for path in matches:
+            if path.lower().endswith('.ass') and os.path.isfile(path):
+                rel_dir = os.path.relpath(os.path.dirname(path), root)
+                subtitle_files.setdefault(path, '' if rel_dir == os.curdir else rel_dir)
+    return list(subtitle_files.items())
+
+# 检查输出的字幕文件是否重名，返回重名的输出路径 -> 字幕文件列表
+# 合并子集化时所有字幕输出到同一个目录，不保留目录结构
+def find_output_conflicts(subtitle_files, output_dir, merge=False):
+    targets = {}
+    for subtitle_file, rel_dir in subtitle_files:
+        target = subtitle_output_path(subtitle_file, output_dir if merge else os.path.join(output_dir, rel_dir))
+        targets.setdefault(os.path.normcase(os.path.normpath(target)), []).append(subtitle_file)
+    return {target: files for target, files in targets.items() if len(files) > 1}
+
+# 批量模式下处理单个字幕文件
+def process_subtitle_file(subtitle_file, output_dir, max_workers=None, use_cache=True, low_memory=False, embed_fonts=False, profile=None, flavor=None):
+    handled, result = call_font_service("subset", subtitle_file=os.path.abspath(subtitle_file), output_dir=os.path.abspath(output_dir), max_workers=max_workers,
+                                        use_cache=use_cache, low_memory=low_memory, embed_fonts=embed_fonts, profile=profile, flavor=flavor)
+    if handled:
+        result["subtitle"] = subtitle_file
         return result
+    # 字幕和字体都没有变化时直接使用上次的结果，不解析字幕
+    entry = up_to_date_manifest_entry(subtitle_file, output_dir, embed_fonts, profile, flavor) if use_cache else None
+    if entry is not None:
+        print(f"字幕和字体均未变化，跳过: {subtitle_file}")
+        return {"subtitle": subtitle_file, "output_subtitle": entry["output_subtitle"], "uninstalled_fonts": [], "profile": entry["profile"], "flavor": entry["flavor"],
+                "fonts": {label: {"font_name": font["font_name"], "font_path": font["font_path"], "face_index": font["face_index"], "output_path": font["output_path"],
+                                  "success": True, "reused": True} for label, font in entry["fonts"].items()},
+                "message": "字幕和字体均未变化，未重新生成"}
+    report = {}
+    try:
+        font_list, all_installed, uninstalled_fonts, font_paths, dialogues = process_subtitle(subtitle_file, report)
+    except Exception as e:
+        print(f"解析字幕文件时出错: {subtitle_file}: {e}")
+        return {"subtitle": subtitle_file, "output_subtitle": None, "fonts": {}, "uninstalled_fonts": [], "message": f"解析字幕文件时出错: {e}"}
+    if not all_installed:
+        # 与界面一致，有字体未安装时不进行子集化
+        print(f"有 {len(uninstalled_fonts)} 个字体未安装: {subtitle_file}: {', '.join(uninstalled_fonts)}")
+        return {"subtitle": subtitle_file, "output_subtitle": None, "fonts": {}, "uninstalled_fonts": uninstalled_fonts,
+                "missing_glyphs": report.get("missing_glyphs", {}), "message": f"有 {len(uninstalled_fonts)} 个字体未安装"}
+    result = run_subsetting(dialogues, font_paths, subtitle_file, output_dir, max_workers, use_cache, low_memory, report, embed_fonts=embed_fonts, profile=profile, flavor=flavor)
+    result["uninstalled_fonts"] = []
+    return result
+
+# 批量处理字幕文件，返回结果摘要，无法开始处理时返回进程退出码
+def run_batch(args):
+    start_time = time.time()
+    subtitle_files = expand_subtitle_inputs(args.inputs, args.recursive)
+    if not subtitle_files:
+        print("没有找到 ASS 字幕文件", file=sys.stderr)
+        return 2
+    conflicts = find_output_conflicts(subtitle_files, args.output, args.merge)
+    if conflicts:
+        for target, files in conflicts.items():
+            print(f"多个字幕文件会输出到同一个文件 {target}: {', '.join(files)}", file=sys.stderr)
+        return 2
     
-    # 绑定子集化按钮事件
-    subset_button.click(
-        fn=on_subset,
-        inputs=[dialogues_state, font_paths_state, file_input, output_dir_input],
-        outputs=[result_output]
-    )
+    # 有字体服务时由字体服务读取字体和子集化，否则只读取一次字体列表，所有字幕文件共用
+    if not (use_font_service and connect_font_service()):
+        load_all_fonts()
+        if not fonts_loaded:
+            print("字体读取失败", file=sys.stderr)
+            return 1
+    
+    use_cache = not args.no_cache
+    if args.memory_budget is not None:
+        set_subset_memory_budget(args.memory_budget * 1024 * 1024)
+    if args.merge:
+        results = run_merged_subsetting([subtitle_file for subtitle_file, _ in subtitle_files], args.output, args.workers, use_cache, args.low_memory, args.embed, args.profile, args.flavor)
+    else:
+        # 保留输入目录中的目录结构，每个子目录中的字幕与其字体输出到对应的子目录
+        with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+            results = list(executor.map(lambda item: process_subtitle_file(item[0], os.path.join(args.output, item[1]), args.workers, use_cache, args.low_memory, args.embed, args.profile, args.flavor),
+                                        subtitle_files))
+    
+    failed = [result["subtitle"] for result in results
+              if result["output_subtitle"] is None or not all(font["success"] for font in result["fonts"].values())]
+    summary = {
+        "version": version,
+        "output_dir": os.path.abspath(args.output),
+        "elapsed": round(time.time() - start_time, 3),
+        "succeeded": len(results) - len(failed),
+        "failed": failed,
+        "subtitles": results,
+    }
+    return summary
+
+# 文件的大小和修改时间
+def file_stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+# 监视模式：字幕文件保存后增量重新生成，新增的字幕文件也会处理，按 Ctrl+C 退出
+# 文件大小和修改时间在两次检查之间保持不变后才处理，避免读到保存了一半的文件
+def watch_subtitles(args, interval=1.0):
+    use_cache = not args.no_cache
+    stats = {}
+    for subtitle_file, _ in expand_subtitle_inputs(args.inputs, args.recursive):
+        try:
+            stats[subtitle_file] = file_stat(subtitle_file)
+        except OSError:
+            pass
+    pending = {}
+    # 字体目录的变化也由监视线程更新到字体索引中，使用字体服务时由字体服务监视
+    if font_service_socket is None:
+        start_font_watcher()
+    print(f"正在监视 {len(stats)} 个字幕文件，按 Ctrl+C 退出")
+    try:
+        while True:
+            time.sleep(interval)
+            subtitle_files = expand_subtitle_inputs(args.inputs, args.recursive)
+            for subtitle_file, rel_dir in subtitle_files:
+                try:
+                    stat = file_stat(subtitle_file)
+                except OSError:
+                    continue
+                if stats.get(subtitle_file) == stat:
+                    pending.pop(subtitle_file, None)
+                    continue
+                if pending.get(subtitle_file) != stat:
+                    pending[subtitle_file] = stat
+                    continue
+                del pending[subtitle_file]
+                stats[subtitle_file] = stat
+                # 新增的字幕文件与已有的字幕重名时不处理
+                if any(subtitle_file in files for files in find_output_conflicts(subtitle_files, args.output).values()):
+                    print(f"{subtitle_file}: 与其他字幕文件输出到同一个文件，跳过")
+                    continue
+                result = process_subtitle_file(subtitle_file, os.path.join(args.output, rel_dir), args.workers, use_cache, args.low_memory, args.embed, args.profile, args.flavor)
+                print(f"{subtitle_file}: {result['message']}")
+    except KeyboardInterrupt:
+        print("停止监视")
+    finally:
+        stop_font_watcher()
+
+# 字体服务的套接字路径
+def get_font_service_socket():
+    return os.environ.get('ASSFONTSUBSET_DAEMON_SOCKET') or os.path.join(get_cache_dir(), 'daemon.sock')
+
+# 向字体服务发送一个请求并返回结果，请求和响应都是一行 JSON
+# 无法连接时抛出 OSError，字体服务处理请求出错时抛出 RuntimeError
+def font_service_request(socket_path, op, timeout=None, **params):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(5)
+        sock.connect(socket_path)
+        sock.settimeout(timeout)
+        sock.sendall(json.dumps({"op": op, **params}, ensure_ascii=False).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("字体服务断开了连接")
+    response = json.loads(line)
+    if "error" in response:
+        raise RuntimeError(f"字体服务出错: {response['error']}")
+    return response["result"]
+
+# 连接字体服务，字体服务正在运行时之后的字体查找、缺字检查和子集化都交给字体服务，返回是否连接成功
+def connect_font_service(socket_path=None):
+    global font_service_socket
+    
+    if not hasattr(socket, 'AF_UNIX'):
+        return False
+    socket_path = socket_path or get_font_service_socket()
+    try:
+        status = font_service_request(socket_path, "ping", timeout=5)
+    except (OSError, RuntimeError, ValueError):
+        return False
+    font_service_socket = socket_path
+    print(f"使用字体服务: {socket_path}（进程 {status['pid']}，共 {status['fonts']} 个字体）")
+    return True
+
+# 不再使用字体服务，之后在当前进程中读取字体
+def disconnect_font_service():
+    global font_service_socket
+    font_service_socket = None
+
+# 使用字体服务时把请求交给字体服务，返回 (是否由字体服务处理, 结果)
+# 字体服务不可用时断开连接并在当前进程中读取字体，由调用者在当前进程中处理
+def call_font_service(op, **params):
+    socket_path = font_service_socket
+    if socket_path is None:
+        return False, None
+    try:
+        return True, font_service_request(socket_path, op, **params)
+    except OSError as e:
+        print(f"字体服务不可用，改为在当前进程中处理: {e}")
+        disconnect_font_service()
+        load_all_fonts()
+        return False, None
+
+# 字体服务重新读取字体，返回字体数
+def reload_font_service():
+    load_all_fonts()
+    return len(all_fonts)
+
+# 停止字体服务
+def stop_font_service():
+    font_service_stop.set()
+
+# 字体服务的请求：请求名 -> 处理函数，参数为请求中的其他字段，返回值转换为 JSON
+FONT_SERVICE_OPS = {
+    "ping": lambda: {"version": version, "pid": os.getpid(), "fonts": len(all_fonts)},
+    "resolve": resolve_font,
+    "coverage": font_missing_chars,
+    "subset": process_subtitle_file,
+    "merge": run_merged_subsetting,
+    "reload": reload_font_service,
+    "shutdown": stop_font_service,
+}
+
+# 处理一个客户端连接，同一个连接可以依次发送多个请求
+def handle_font_service_connection(conn):
+    with conn, conn.makefile('rb') as reader:
+        for line in reader:
+            try:
+                request = json.loads(line)
+                response = {"result": FONT_SERVICE_OPS[request.pop("op")](**request)}
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            try:
+                conn.sendall(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+            except OSError:
+                return
+
+# 运行字体服务：常驻进程持有字体索引和子集化进程池，通过 Unix 套接字为多个客户端提供字体查找、缺字检查和子集化
+# 每个连接在单独的线程中处理，按 Ctrl+C 或收到 shutdown 请求后退出
+def serve_font_service(socket_path=None):
+    if not hasattr(socket, 'AF_UNIX'):
+        print("当前系统不支持 Unix 套接字，无法启动字体服务", file=sys.stderr)
+        return 1
+    socket_path = socket_path or get_font_service_socket()
+    try:
+        font_service_request(socket_path, "ping", timeout=5)
+        print(f"字体服务已在运行: {socket_path}", file=sys.stderr)
+        return 1
+    except (OSError, RuntimeError, ValueError):
+        pass
+    # 删除上次异常退出时留下的套接字文件
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    
+    load_all_fonts()
+    if not fonts_loaded:
+        print("字体读取失败", file=sys.stderr)
+        return 1
+    start_font_watcher()
+    
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # 只允许当前用户连接
+    old_umask = os.umask(0o077)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    server.listen()
+    server.settimeout(0.5)
+    font_service_stop.clear()
+    print(f"字体服务已启动: {socket_path}，共 {len(all_fonts)} 个字体")
+    try:
+        while not font_service_stop.is_set():
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+            conn.settimeout(None)
+            threading.Thread(target=handle_font_service_connection, args=(conn,), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        stop_font_watcher()
+    print("字体服务已停止")
+    return 0
+
+# 命令行入口：提供字幕文件时批量处理，否则启动图形界面
+def main(argv=None):
+    global use_font_service
+    
+    parser = argparse.ArgumentParser(description="字幕字体子集化工具")
+    parser.add_argument('inputs', nargs='*', help='ASS 字幕文件、目录或通配符，不提供时启动图形界面')
+    parser.add_argument('-o', '--output', default='Subset', help='子集化字体和字幕的保存位置（默认: Subset）')
+    parser.add_argument('-r', '--recursive', action='store_true', help='递归查找目录中的字幕文件，输出时保留子目录结构')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='同时处理的字幕文件数（默认: 4）')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='同时运行的子集化任务数（默认和上限: 共用进程池的进程数，即 CPU 核心数或 ASSFONTSUBSET_POOL_WORKERS）')
+    parser.add_argument('-m', '--merge', action='store_true', help='合并子集化：所有字幕中同一字体的字符取并集，每个字体只生成一个子集化字体')
+    parser.add_argument('--no-cache', action='store_true', help='不使用子集化缓存')
+    parser.add_argument('--profile', choices=list(SUBSET_PROFILES), default=None,
+                        help=f'子集化配置：fastest 最快，smallest 最小，faithful 保留所有特性和名称（默认: {SUBSET_PROFILE}）')
+    parser.add_argument('--flavor', choices=SUBSET_FLAVORS, default=None,
+                        help='输出压缩的 WOFF/WOFF2 字体（WOFF2 需要 brotli），VSFilter 和很多播放器不能加载，不能与 --embed 同时使用（默认: 原格式）')
+    parser.add_argument('--embed', action='store_true', help='将子集化字体内嵌到字幕文件的 [Fonts] 部分，不保留单独的字体文件')
+    parser.add_argument('--low-memory', action='store_true', help='低内存模式：通过内存映射读取字体，只解析需要的表，不使用字体缓存池')
+    parser.add_argument('--memory-budget', type=int, default=None, help='所有子集化任务共享的内存预算（MB），包括子集化进程中的字体缓存池和压缩包缓存，0 表示不限制')
+    parser.add_argument('--font-dir', action='append', default=[], help='项目字体文件夹，会递归扫描，可以指定多次')
+    parser.add_argument('--no-system-fonts', action='store_true', help='不使用系统字体，只使用项目字体文件夹中的字体')
+    parser.add_argument('--daemon', action='store_true', help='启动字体服务：常驻后台持有字体索引和子集化进程池，供图形界面和批量处理共用')
+    parser.add_argument('--no-daemon', action='store_true', help='不使用正在运行的字体服务，在当前进程中读取字体')
+    parser.add_argument('--watch', action='store_true', help='处理完成后监视字幕文件，保存后自动增量重新生成（不能与 --merge 同时使用）')
+    parser.add_argument('--summary', default=None, help='JSON 结果摘要的保存路径，"-" 表示输出到标准输出（默认: 输出目录下的 subset_summary.json）')
+    args = parser.parse_args(argv)
+    if args.watch and args.merge:
+        parser.error("--watch 不能与 --merge 同时使用")
+    if args.flavor and args.embed:
+        parser.error("--flavor 不能与 --embed 同时使用")
+    
+    if args.font_dir or args.no_system_fonts:
+        configure_font_sources(project_font_dirs + args.font_dir, not args.no_system_fonts)
+    
+    if args.daemon:
+        if args.memory_budget is not None:
+            set_subset_memory_budget(args.memory_budget * 1024 * 1024)
+        return serve_font_service()
+    # 字体服务使用自己的字体来源，指定了字体来源时不使用字体服务
+    if args.no_daemon or args.font_dir or args.no_system_fonts:
+        use_font_service = False
+    
+    if not args.inputs:
+        build_ui().launch(share=False)
+        return 0
+    
+    # 摘要输出到标准输出时，处理过程中的信息改为输出到标准错误
+    if args.summary == '-':
+        with contextlib.redirect_stdout(sys.stderr):
+            summary = run_batch(args)
+    else:
+        summary = run_batch(args)
+    if isinstance(summary, int):
+        return summary
+    
+    summary_json = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.summary == '-':
+        print(summary_json)
+    else:
+        summary_path = args.summary or os.path.join(args.output, 'subset_summary.json')
+        os.makedirs(os.path.dirname(os.path.abspath(summary_path)), exist_ok=True)
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            f.write(summary_json)
+        print(f"处理完成：成功 {summary['succeeded']} 个，失败 {len(summary['failed'])} 个，摘要已保存到: {summary_path}")
+    if args.watch:
+        watch_subtitles(args)
+        return 0
+    return 1 if summary["failed"] else 0
 
-# 运行界面
+# 运行界面或批量处理
 if __name__ == "__main__":
-    demo.launch(share=False)
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 从仓库根目录导入 subtitle_subsetter
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
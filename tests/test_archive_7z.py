@@ -0,0 +1,94 @@
+import io
+import os
+from collections import OrderedDict
+
+import pytest
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from fontTools.ttLib import TTFont
+
+import subtitle_subsetter
+from subtitle_subsetter import (ARCHIVE_SEPARATOR, SevenZipMemberFactory, add_font_file, list_font_files,
+                                resolve_font, scan_font_files, subset_font)
+
+
+def square():
+    pen = TTGlyphPen(None)
+    pen.moveTo((0, 0))
+    pen.lineTo((0, 500))
+    pen.lineTo((500, 500))
+    pen.closePath()
+    return pen.glyph()
+
+
+def make_font(family):
+    glyphs = [".notdef", "A", "B"]
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(glyphs)
+    builder.setupCharacterMap({ord("A"): "A", ord("B"): "B"})
+    builder.setupGlyf({name: square() for name in glyphs})
+    builder.setupHorizontalMetrics({name: (600, 0) for name in glyphs})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({"familyName": family, "styleName": "Regular"})
+    builder.setupOS2()
+    builder.setupPost()
+    output = io.BytesIO()
+    builder.save(output)
+    return output.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def font_index(monkeypatch):
+    # 每个测试使用空的字体索引和压缩包缓存
+    for name in ("all_fonts", "font_files", "font_name_index", "archive_listings"):
+        monkeypatch.setattr(subtitle_subsetter, name, {})
+    monkeypatch.setattr(subtitle_subsetter, "font_name_keys", None)
+    monkeypatch.setattr(subtitle_subsetter, "font_service_socket", None)
+    monkeypatch.setattr(subtitle_subsetter, "archive_font_cache", OrderedDict())
+    monkeypatch.setattr(subtitle_subsetter, "archive_font_cache_memory", 0)
+
+
+def test_factory_hands_over_each_member_once():
+    received = []
+    factory = SevenZipMemberFactory({"a.ttf": 6, "b.ttf": 4}, lambda member, data: received.append((member, data)))
+    first = factory.create("a.ttf")
+    first.write(b"abc")
+    assert received == []
+    first.write(b"def")
+    # 写满预期大小后立即交出并释放数据
+    assert received == [("a.ttf", b"abcdef")]
+    assert first.getvalue() == b"" and first.size() == 6
+    second = factory.create("b.ttf")
+    second.write(b"gh")
+    factory.finish()
+    factory.finish()
+    assert received == [("a.ttf", b"abcdef"), ("b.ttf", b"gh")]
+
+
+def test_index_and_subset_fonts_in_7z(tmp_path, monkeypatch):
+    py7zr = pytest.importorskip("py7zr")
+    with py7zr.SevenZipFile(tmp_path / "fonts.7z", "w") as archive:
+        archive.writestr(make_font("Alpha"), "Alpha.ttf")
+        archive.writestr(make_font("Beta"), "sub/Beta.ttf")
+
+    archive_path = str(tmp_path / "fonts.7z")
+    files = list_font_files([str(tmp_path)])
+    assert sorted(files) == [f"{archive_path}{ARCHIVE_SEPARATOR}Alpha.ttf", f"{archive_path}{ARCHIVE_SEPARATOR}sub/Beta.ttf"]
+
+    # 同一个压缩包只解压一遍
+    calls = []
+    stream = subtitle_subsetter.stream_7z_members
+    monkeypatch.setattr(subtitle_subsetter, "stream_7z_members", lambda *args: calls.append(args[0]) or stream(*args))
+    scanned = dict(scan_font_files(sorted(files)))
+    assert calls == [archive_path]
+    for font_path, faces in scanned.items():
+        assert faces is not None
+        add_font_file(font_path, *files[font_path], faces)
+
+    font_path, face_index = resolve_font("Beta")
+    assert font_path == f"{archive_path}{ARCHIVE_SEPARATOR}sub/Beta.ttf"
+    output_path = str(tmp_path / "ABCDEFGH.ttf")
+    assert subset_font(font_path, "A", output_path, "ABCDEFGH", face_index=face_index)
+    font = TTFont(output_path)
+    assert set(font.getBestCmap()) == {ord("A")}
+    assert os.path.getsize(output_path) > 0
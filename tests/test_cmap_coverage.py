@@ -0,0 +1,132 @@
+import glob
+import random
+
+import pytest
+from fontTools.ttLib import TTFont, newTable
+from fontTools.ttLib.tables._c_m_a_p import CmapSubtable
+
+from subtitle_subsetter import coverage_contains, parse_cmap_coverage, read_sfnt_offsets, read_sfnt_tables
+
+GLYPH_ORDER = [".notdef"] + [f"g{i}" for i in range(1, 300)]
+
+
+def make_font():
+    font = TTFont()
+    font.setGlyphOrder(GLYPH_ORDER)
+    return font
+
+
+def make_subtable(fmt, mapping, platform_id=3, encoding_id=10):
+    subtable = CmapSubtable.newSubtable(fmt)
+    subtable.platformID, subtable.platEncID, subtable.language = platform_id, encoding_id, 0
+    subtable.cmap = mapping
+    return subtable
+
+
+def compile_cmap(*subtables):
+    table = newTable("cmap")
+    table.tableVersion = 0
+    table.tables = list(subtables)
+    return table.compile(make_font())
+
+
+def coverage_codepoints(bits):
+    return {code for code in range(len(bits) * 8) if coverage_contains(bits, code)}
+
+
+# fontTools 选择的子表中映射到非 .notdef 字形的码位
+def fonttools_codepoints(data):
+    table = newTable("cmap")
+    table.decompile(data, make_font())
+    return {code for code, glyph in (table.getBestCmap() or {}).items() if glyph != ".notdef"}
+
+
+# 格式 0 的字形编号只有一个字节，glyph_count 限制使用的字形数
+def random_mapping(rng, codes, notdef_ratio=0.1, glyph_count=len(GLYPH_ORDER)):
+    return {code: ".notdef" if rng.random() < notdef_ratio else rng.choice(GLYPH_ORDER[1:glyph_count]) for code in codes}
+
+
+def sequential_mapping(rng, start, count):
+    # 连续码位映射到连续字形，编译为范围（格式 4 的 idDelta、格式 12 的分组）
+    first = rng.randrange(1, len(GLYPH_ORDER) - count)
+    return {start + i: GLYPH_ORDER[first + i] for i in range(count)}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_format_0(seed):
+    rng = random.Random(seed)
+    data = compile_cmap(make_subtable(0, random_mapping(rng, rng.sample(range(256), 100), glyph_count=256), 3, 1))
+    assert coverage_codepoints(parse_cmap_coverage(data)) == fonttools_codepoints(data)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_format_4(seed):
+    rng = random.Random(seed)
+    mapping = random_mapping(rng, rng.sample(range(0xFFFF), 500))
+    for start in rng.sample(range(0x4E00, 0x9F00, 0x100), 5):
+        mapping.update(sequential_mapping(rng, start, 100))
+    data = compile_cmap(make_subtable(4, mapping, 3, 1))
+    assert coverage_codepoints(parse_cmap_coverage(data)) == fonttools_codepoints(data)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_format_6(seed):
+    rng = random.Random(seed)
+    start = rng.randrange(0x20, 0x3000)
+    # 范围内没有映射的码位编译为字形 0
+    data = compile_cmap(make_subtable(6, random_mapping(rng, rng.sample(range(start, start + 400), 200)), 3, 1))
+    assert coverage_codepoints(parse_cmap_coverage(data)) == fonttools_codepoints(data)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_format_12(seed):
+    rng = random.Random(seed)
+    mapping = random_mapping(rng, rng.sample(range(0x10FFFF), 500))
+    for start in rng.sample(range(0x20000, 0x2A000, 0x100), 5):
+        mapping.update(sequential_mapping(rng, start, 100))
+    data = compile_cmap(make_subtable(12, mapping))
+    assert coverage_codepoints(parse_cmap_coverage(data)) == fonttools_codepoints(data)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_format_13(seed):
+    rng = random.Random(seed)
+    mapping = {}
+    for start in rng.sample(range(0, 0x10F000, 0x1000), 20):
+        glyph = rng.choice(GLYPH_ORDER)
+        mapping.update(dict.fromkeys(range(start, start + rng.randrange(1, 300)), glyph))
+    data = compile_cmap(make_subtable(13, mapping))
+    assert coverage_codepoints(parse_cmap_coverage(data)) == fonttools_codepoints(data)
+
+
+def test_subtable_priority():
+    rng = random.Random(0)
+    data = compile_cmap(
+        make_subtable(4, random_mapping(rng, range(0x20, 0x80)), 3, 1),
+        make_subtable(12, random_mapping(rng, range(0x1F600, 0x1F650))),
+        make_subtable(0, random_mapping(rng, range(0x80, 0x100), glyph_count=256), 1, 0),
+    )
+    codepoints = coverage_codepoints(parse_cmap_coverage(data))
+    assert codepoints == fonttools_codepoints(data)
+    assert codepoints and min(codepoints) >= 0x1F600
+
+
+def test_no_unicode_subtable():
+    data = compile_cmap(make_subtable(0, {0x41: "g1"}, 1, 0))
+    assert coverage_codepoints(parse_cmap_coverage(data)) == set() == fonttools_codepoints(data)
+
+
+SYSTEM_FONTS = sorted(glob.glob("/usr/share/fonts/**/*.tt[fc]", recursive=True))[:20]
+
+
+@pytest.mark.skipif(not SYSTEM_FONTS, reason="没有可用的系统字体")
+@pytest.mark.parametrize("font_path", SYSTEM_FONTS)
+def test_system_fonts(font_path):
+    with open(font_path, "rb") as f:
+        for index, offset in enumerate(read_sfnt_offsets(f)):
+            cmap = read_sfnt_tables(f, offset, (b"cmap",)).get(b"cmap")
+            if not cmap:
+                continue
+            font = TTFont(font_path, fontNumber=index, lazy=True)
+            expected = {code for code, glyph in (font["cmap"].getBestCmap() or {}).items() if font.getGlyphID(glyph) != 0}
+            assert coverage_codepoints(parse_cmap_coverage(cmap)) == expected
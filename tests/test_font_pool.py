@@ -0,0 +1,110 @@
+import os
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+import pytest
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from fontTools.ttLib import TTFont
+
+import subtitle_subsetter
+from subtitle_subsetter import clear_font_pool, font_pool_stats, get_pooled_font, release_pooled_font, subset_font_file
+
+
+def square():
+    pen = TTGlyphPen(None)
+    pen.moveTo((0, 0))
+    pen.lineTo((0, 500))
+    pen.lineTo((500, 500))
+    pen.closePath()
+    return pen.glyph()
+
+
+def write_font(path, family):
+    glyphs = [".notdef", "A", "B"]
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(glyphs)
+    builder.setupCharacterMap({ord("A"): "A", ord("B"): "B"})
+    builder.setupGlyf({name: square() for name in glyphs})
+    builder.setupHorizontalMetrics({name: (600, 0) for name in glyphs})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({"familyName": family, "styleName": "Regular"})
+    builder.setupOS2()
+    builder.setupPost()
+    builder.save(str(path))
+    return str(path)
+
+
+def shm_exists(name):
+    try:
+        shared_memory.SharedMemory(name=name).close()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+@pytest.fixture(autouse=True)
+def font_pool(monkeypatch):
+    # 每个测试使用空的缓存池，结束时释放共享内存
+    monkeypatch.setattr(subtitle_subsetter, "font_pool", OrderedDict())
+    monkeypatch.setattr(subtitle_subsetter, "font_pool_memory", 0)
+    monkeypatch.setattr(subtitle_subsetter, "font_pool_counters", {"hits": 0, "misses": 0, "evictions": 0})
+    monkeypatch.setattr(subtitle_subsetter, "subset_memory_budget", 0)
+    yield
+    clear_font_pool()
+
+
+def test_pooled_font_is_shared_and_reused(tmp_path):
+    font_path = write_font(tmp_path / "a.ttf", "Alpha")
+    entry = get_pooled_font(font_path)
+    with open(font_path, "rb") as f:
+        assert bytes(entry["shm"].buf[:entry["length"]]) == f.read()
+    assert set(entry["cmap"]) == {ord("A"), ord("B")}
+    assert get_pooled_font(font_path) is entry
+    release_pooled_font(entry)
+    release_pooled_font(entry)
+    assert font_pool_stats()["hits"] == 1 and font_pool_stats()["misses"] == 1
+
+
+def test_evicted_font_is_freed_after_last_user(tmp_path, monkeypatch):
+    first = get_pooled_font(write_font(tmp_path / "a.ttf", "Alpha"))
+    monkeypatch.setattr(subtitle_subsetter, "FONT_POOL_MAX_BYTES", first["memory"] + 1)
+    second = get_pooled_font(write_font(tmp_path / "b.ttf", "Beta"))
+    # 正在使用的字体被淘汰后，共享内存保留到任务结束
+    assert font_pool_stats()["evictions"] == 1 and font_pool_stats()["entries"] == 1
+    name = first["shm"].name
+    assert shm_exists(name)
+    release_pooled_font(first)
+    assert not shm_exists(name)
+    release_pooled_font(second)
+    assert shm_exists(second["shm"].name)
+
+
+def test_changed_font_is_reloaded(tmp_path):
+    font_path = write_font(tmp_path / "a.ttf", "Alpha")
+    entry = get_pooled_font(font_path)
+    release_pooled_font(entry)
+    stat = os.stat(font_path)
+    os.utime(font_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    reloaded = get_pooled_font(font_path)
+    assert reloaded is not entry
+    release_pooled_font(reloaded)
+    assert not shm_exists(entry["shm"].name)
+
+
+def test_font_larger_than_pool_is_not_pooled(tmp_path, monkeypatch):
+    monkeypatch.setattr(subtitle_subsetter, "FONT_POOL_MAX_BYTES", 16)
+    assert get_pooled_font(write_font(tmp_path / "a.ttf", "Alpha")) is None
+
+
+def test_subset_from_shared_memory(tmp_path):
+    font_path = write_font(tmp_path / "a.ttf", "Alpha")
+    entry = get_pooled_font(font_path)
+    output_path = str(tmp_path / "ABCDEFGH.ttf")
+    try:
+        assert subset_font_file(font_path, "A", output_path, "ABCDEFGH", pooled=(entry["shm"].name, entry["length"]))
+    finally:
+        release_pooled_font(entry)
+    font = TTFont(output_path)
+    assert set(font.getBestCmap()) == {ord("A")}
+    assert font["name"].getDebugName(1) == "ABCDEFGH"
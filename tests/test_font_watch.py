@@ -0,0 +1,99 @@
+import os
+import zipfile
+
+import pytest
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+import subtitle_subsetter
+from subtitle_subsetter import load_all_fonts, poll_font_dirs, resolve_font
+
+
+def square():
+    pen = TTGlyphPen(None)
+    pen.moveTo((0, 0))
+    pen.lineTo((0, 500))
+    pen.lineTo((500, 500))
+    pen.closePath()
+    return pen.glyph()
+
+
+def make_font(family):
+    glyphs = [".notdef", "A"]
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(glyphs)
+    builder.setupCharacterMap({ord("A"): "A"})
+    builder.setupGlyf({name: square() for name in glyphs})
+    builder.setupHorizontalMetrics({name: (600, 0) for name in glyphs})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({"familyName": family, "styleName": "Regular"})
+    builder.setupOS2()
+    builder.setupPost()
+    builder.font.recalcTimestamp = False
+    return builder.font
+
+
+# 原地改写文件，保持所在目录的修改时间不变
+def overwrite(path, write):
+    dir_stat = os.stat(os.path.dirname(path))
+    file_stat = os.stat(path)
+    write(path)
+    os.utime(path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns + 10 ** 9))
+    os.utime(os.path.dirname(path), ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+
+
+@pytest.fixture
+def font_dir(tmp_path, monkeypatch):
+    # 只扫描临时字体目录，索引缓存写入临时目录
+    for name in ("all_fonts", "font_files", "font_name_index", "font_dir_mtimes", "archive_listings"):
+        monkeypatch.setattr(subtitle_subsetter, name, {})
+    monkeypatch.setattr(subtitle_subsetter, "font_name_keys", None)
+    monkeypatch.setattr(subtitle_subsetter, "font_service_socket", None)
+    monkeypatch.setattr(subtitle_subsetter, "font_watched_dirs", [])
+    monkeypatch.setattr(subtitle_subsetter, "use_system_fonts", False)
+    monkeypatch.setattr(subtitle_subsetter, "project_font_dirs", [str(tmp_path / "fonts")])
+    monkeypatch.setenv("ASSFONTSUBSET_CACHE_DIR", str(tmp_path / "cache"))
+    os.makedirs(tmp_path / "fonts")
+    return tmp_path / "fonts"
+
+
+def test_poll_without_changes(font_dir):
+    make_font("Alpha").save(str(font_dir / "a.ttf"))
+    load_all_fonts()
+    assert poll_font_dirs() is False
+
+
+def test_font_overwritten_in_place_is_reindexed(font_dir):
+    font_path = str(font_dir / "a.ttf")
+    make_font("Alpha").save(font_path)
+    load_all_fonts()
+    assert resolve_font("Alpha") == (font_path, 0)
+
+    overwrite(font_path, lambda path: make_font("Beta").save(path))
+    assert poll_font_dirs() is True
+    assert resolve_font("Alpha") is None
+    assert resolve_font("Beta") == (font_path, 0)
+    assert poll_font_dirs() is False
+
+
+def test_archive_overwritten_in_place_is_reindexed(font_dir):
+    archive_path = str(font_dir / "fonts.zip")
+
+    def write_archive(families):
+        def write(path):
+            with zipfile.ZipFile(path, "w") as archive:
+                for family in families:
+                    data = os.path.join(str(font_dir.parent), f"{family}.ttf")
+                    make_font(family).save(data)
+                    archive.write(data, f"{family}.ttf")
+        return write
+
+    write_archive(["Alpha", "Beta"])(archive_path)
+    load_all_fonts()
+    assert resolve_font("Beta") is not None
+
+    overwrite(archive_path, write_archive(["Alpha", "Gamma"]))
+    assert poll_font_dirs() is True
+    assert resolve_font("Alpha") is not None
+    assert resolve_font("Beta") is None
+    assert resolve_font("Gamma") == (f"{archive_path}::Gamma.ttf", 0)
@@ -0,0 +1,80 @@
+import json
+import os
+
+import pytest
+
+from subtitle_subsetter import MANIFEST_FILE, MANIFEST_VERSION, get_manifest_entry, update_build_manifest
+
+
+def make_entry(output_subtitle, *output_paths):
+    fonts = {f"Font{i}": {"font_name": f"Font{i}", "font_path": "font.ttf", "face_index": 0, "font_stat": [0, 0],
+                          "codepoints": "41", "cache_key": "key", "output_path": output_path}
+             for i, output_path in enumerate(output_paths)}
+    return {"subtitle_sha256": "0", "output_subtitle": output_subtitle, "profile": "default", "flavor": None, "embed_fonts": False,
+            "font_mapping": {}, "updated_at": "", "fonts": fonts}
+
+
+def write_manifest(output_dir, subtitles):
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "subtitles": subtitles}, f)
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    output_dir = tmp_path / "out"
+    outside = tmp_path / "outside"
+    output_dir.mkdir()
+    outside.mkdir()
+    return str(output_dir), outside
+
+
+def test_unused_subset_fonts_are_deleted(dirs):
+    output_dir, _ = dirs
+    subtitle = os.path.abspath("ep.ass")
+    for name in ("ABCDEFGH.ttf", "ABCDEFGH-1.otf", "IJKLMNOP.ttf"):
+        open(os.path.join(output_dir, name), "wb").close()
+    write_manifest(output_dir, {subtitle: make_entry("ep_subset.ass", "ABCDEFGH.ttf", "ABCDEFGH-1.otf", "IJKLMNOP.ttf")})
+    update_build_manifest(output_dir, subtitle, make_entry("ep_subset.ass", "IJKLMNOP.ttf"))
+    assert sorted(os.listdir(output_dir)) == ["IJKLMNOP.ttf", MANIFEST_FILE]
+
+
+def test_files_outside_output_dir_are_never_deleted(dirs):
+    output_dir, outside = dirs
+    subtitle = os.path.abspath("ep.ass")
+    victims = [outside / "victim.txt", outside / "ABCDEFGH.ttf"]
+    for victim in victims:
+        victim.write_text("keep")
+    os.symlink(outside / "ABCDEFGH.ttf", os.path.join(output_dir, "QRSTUVWX.ttf"))
+    open(os.path.join(output_dir, "notes.txt"), "w").close()
+    write_manifest(output_dir, {subtitle: make_entry("ep_subset.ass", str(victims[0]), "../outside/ABCDEFGH.ttf", "QRSTUVWX.ttf", "notes.txt")})
+    update_build_manifest(output_dir, subtitle, make_entry("ep_subset.ass"))
+    assert all(victim.read_text() == "keep" for victim in victims)
+    assert os.path.exists(os.path.join(output_dir, "notes.txt"))
+
+
+def test_entries_are_relative_to_output_dir(dirs, monkeypatch):
+    output_dir, outside = dirs
+    subtitle = os.path.abspath("ep.ass")
+    write_manifest(output_dir, {subtitle: make_entry("ep_subset.ass", "ABCDEFGH.ttf")})
+    monkeypatch.chdir(outside)
+    entry = get_manifest_entry(output_dir, subtitle)
+    assert entry["output_subtitle"] == os.path.join(output_dir, "ep_subset.ass")
+    assert entry["fonts"]["Font0"]["output_path"] == os.path.join(output_dir, "ABCDEFGH.ttf")
+
+
+def test_entries_with_paths_outside_output_dir_are_ignored(dirs):
+    output_dir, outside = dirs
+    subtitle = os.path.abspath("ep.ass")
+    write_manifest(output_dir, {subtitle: make_entry("ep_subset.ass", str(outside / "ABCDEFGH.ttf"))})
+    assert get_manifest_entry(output_dir, subtitle) is None
+
+
+def test_same_output_subtitle_replaces_entry(dirs):
+    output_dir, _ = dirs
+    open(os.path.join(output_dir, "ABCDEFGH.ttf"), "wb").close()
+    write_manifest(output_dir, {"/tmp/upload1/ep.ass": make_entry("ep_subset.ass", "ABCDEFGH.ttf")})
+    assert get_manifest_entry(output_dir, "/tmp/upload2/ep.ass")["fonts"]["Font0"]["output_path"] == os.path.join(output_dir, "ABCDEFGH.ttf")
+    update_build_manifest(output_dir, "/tmp/upload2/ep.ass", make_entry("ep_subset.ass"))
+    with open(os.path.join(output_dir, MANIFEST_FILE), encoding="utf-8") as f:
+        assert list(json.load(f)["subtitles"]) == ["/tmp/upload2/ep.ass"]
+    assert not os.path.exists(os.path.join(output_dir, "ABCDEFGH.ttf"))
@@ -0,0 +1,113 @@
+import pytest
+
+from subtitle_subsetter import parse_ass_lines, parse_text_with_style
+
+STYLE = ("Arial", 400, False)
+STYLES = {"Default": STYLE, "Title": ("Title Font", 700, True)}
+
+
+def parse(text, style=STYLE):
+    return {face: "".join(sorted(chars)) for face, chars in parse_text_with_style(style, text, styles=STYLES).items()}
+
+
+def test_plain_text():
+    assert parse("abc") == {STYLE: "abc"}
+
+
+def test_line_breaks_and_hard_spaces_are_removed():
+    assert parse(r"a\Nb\nc\hd") == {STYLE: "abcd"}
+
+
+def test_unclosed_brace_is_text():
+    assert parse("a{b") == {STYLE: "".join(sorted("a{b"))}
+
+
+def test_fn_switches_font_and_empty_fn_restores_style_font():
+    assert parse(r"a{\fnOther}b{\fn}c") == {STYLE: "ac", ("Other", 400, False): "b"}
+
+
+def test_fn_ignores_vertical_prefix():
+    assert parse(r"{\fn@Other}a") == {("Other", 400, False): "a"}
+
+
+@pytest.mark.parametrize("tag, weight", [(r"\b1", 700), (r"\b0", 400), (r"\b900", 900), (r"\b", 400)])
+def test_b_sets_weight(tag, weight):
+    assert parse("{" + tag + "}a") == {("Arial", weight, False): "a"}
+
+
+def test_b_without_value_restores_style_weight():
+    assert parse(r"{\b0}a{\b}b", ("Arial", 700, False)) == {("Arial", 400, False): "a", ("Arial", 700, False): "b"}
+
+
+def test_i_sets_italic():
+    assert parse(r"{\i1}a{\i0}b{\i1}c{\i}d") == {("Arial", 400, True): "ac", STYLE: "bd"}
+
+
+@pytest.mark.parametrize("tag", [r"\bord2", r"\be1", r"\blur3", r"\iclip(0,0,1,1)", r"\pos(1,2)", r"\pbo5"])
+def test_tags_starting_with_b_i_p_do_not_toggle(tag):
+    assert parse("{" + tag + "}a") == {STYLE: "a"}
+
+
+def test_later_tags_override_earlier_ones():
+    assert parse(r"{\b1\fnOther\b0}a") == {("Other", 400, False): "a"}
+
+
+def test_r_restores_line_style():
+    assert parse(r"{\fnOther\b1\i1}a{\r}b") == {("Other", 700, True): "a", STYLE: "b"}
+
+
+def test_r_with_style_name():
+    assert parse(r"a{\rTitle}b{\b0}c{\r}d") == {STYLE: "ad", ("Title Font", 700, True): "b", ("Title Font", 400, True): "c"}
+
+
+def test_r_with_unknown_style_uses_line_style():
+    assert parse(r"{\fnOther}a{\rMissing}b") == {("Other", 400, False): "a", STYLE: "b"}
+
+
+def test_b_after_r_style_restores_that_style_weight():
+    assert parse(r"{\rTitle\b0}a{\b}b") == {("Title Font", 400, True): "a", ("Title Font", 700, True): "b"}
+
+
+def test_rnd_is_not_a_reset():
+    assert parse(r"{\fnOther}a{\rnd2}b") == {("Other", 400, False): "ab"}
+
+
+def test_drawing_mode_is_not_text():
+    assert parse(r"a{\p1}m 0 0 l 100 0 100 100{\p0}b") == {STYLE: "ab"}
+
+
+def test_drawing_mode_until_end_of_line():
+    assert parse(r"a{\p2}m 0 0 l 1 1") == {STYLE: "a"}
+
+
+def test_p0_without_drawing():
+    assert parse(r"{\p0}a") == {STYLE: "a"}
+
+
+def test_animation_tags_do_not_change_font():
+    assert parse(r"{\t(0,500,\fnOther\b1\i1\p1)}a") == {STYLE: "a"}
+
+
+def test_animation_with_nested_parentheses():
+    assert parse(r"{\t(0,500,\clip(0,0,10,10)\fnOther)\b1}a") == {("Arial", 700, False): "a"}
+
+
+def test_tags_after_animation_still_apply():
+    assert parse(r"{\t(\frz30)\fnOther}a") == {("Other", 400, False): "a"}
+
+
+def test_parse_ass_lines_uses_style_fields():
+    lines = [
+        "[V4+ Styles]\n",
+        "Format: Name, Fontname, Fontsize, Bold, Italic\n",
+        "Style: Default,@Arial,20,-1,0\n",
+        "Style: Title,Title Font,30,0,1\n",
+        "[Events]\n",
+        "Format: Layer, Start, End, Style, Text\n",
+        "Dialogue: 0,0:00:00.00,0:00:01.00,Default,a{\\rTitle}b\n",
+        "Comment: 0,0:00:00.00,0:00:01.00,Default,c\n",
+        "Dialogue: 0,0:00:00.00,0:00:01.00,Missing,d\n",
+    ]
+    styles, dialogues = parse_ass_lines(lines)
+    assert styles == {"Default": ("Arial", 700, False), "Title": ("Title Font", 400, True)}
+    assert dialogues == {("Arial", 700, False): {"a"}, ("Title Font", 400, True): {"b"}}
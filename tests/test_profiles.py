@@ -0,0 +1,82 @@
+import io
+
+import pytest
+from fontTools.feaLib.builder import addOpenTypeFeaturesFromString
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from fontTools.ttLib import TTFont
+
+import subtitle_subsetter
+from subtitle_subsetter import SUBSET_PROFILES, check_output_flavor, subset_font_bytes, subset_profile_options
+
+GLYPHS = [".notdef", "A", "B", "A.vert", "B.vert", "A_B"]
+
+
+def square():
+    pen = TTGlyphPen(None)
+    pen.moveTo((0, 0))
+    pen.lineTo((0, 500))
+    pen.lineTo((500, 500))
+    pen.closePath()
+    return pen.glyph()
+
+
+# 带竖排替换（vert）和连字（liga）的测试字体
+def make_font():
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(GLYPHS)
+    builder.setupCharacterMap({ord("A"): "A", ord("B"): "B"})
+    builder.setupGlyf({name: square() for name in GLYPHS})
+    builder.setupHorizontalMetrics({name: (600, 0) for name in GLYPHS})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({"familyName": "Test", "styleName": "Regular"})
+    builder.setupOS2()
+    builder.setupPost()
+    addOpenTypeFeaturesFromString(builder.font, """
+        feature vert { sub A by A.vert; sub B by B.vert; } vert;
+        feature liga { sub A B by A_B; } liga;
+    """)
+    output = io.BytesIO()
+    builder.save(output)
+    return output.getvalue()
+
+
+# 子集化后的字形数，默认选项不保留字形名称，只能比较字形数
+def subset_glyph_count(profile, chars):
+    data = subset_font_bytes(make_font(), chars, "ABCDEFGH", options=subset_profile_options(profile))
+    return len(TTFont(io.BytesIO(data)).getGlyphOrder())
+
+
+def test_profiles_keep_original_format():
+    assert all("flavor" not in options for options in SUBSET_PROFILES.values())
+    data = subset_font_bytes(make_font(), "A", "ABCDEFGH", options=subset_profile_options("smallest"))
+    assert data[:4] == b"\0\1\0\0"
+
+
+@pytest.mark.parametrize("profile", list(SUBSET_PROFILES))
+def test_vertical_glyphs_are_kept(profile):
+    # .notdef、A、A.vert
+    assert subset_glyph_count(profile, "A") == 3
+
+
+def test_fastest_skips_other_closure():
+    # 不做字形闭包时只有连字 A_B 被删除
+    assert subset_glyph_count("fastest", "AB") == 5
+    assert subset_glyph_count("default", "AB") == 6
+
+
+def test_flavor_is_opt_in(monkeypatch):
+    assert subset_profile_options("smallest", "woff")["flavor"] == "woff"
+    data = subset_font_bytes(make_font(), "A", "ABCDEFGH", options=subset_profile_options("default", "woff"))
+    assert data[:4] == b"wOFF"
+    monkeypatch.setattr(subtitle_subsetter, "brotli", None)
+    assert subset_profile_options("default", "woff2")["flavor"] == "woff"
+    with pytest.raises(ValueError):
+        subset_profile_options("default", "svg")
+
+
+def test_flavor_cannot_be_embedded():
+    check_output_flavor(None, True)
+    check_output_flavor("woff", False)
+    with pytest.raises(ValueError):
+        check_output_flavor("woff2", True)
@@ -0,0 +1,79 @@
+import pytest
+
+import subtitle_subsetter
+from subtitle_subsetter import add_font_file, check_font_installed, resolve_font
+
+
+def make_face(index, family, subfamily, full_name, postscript_name, weight=400, italic=False):
+    return {"index": index, "family_names": [family], "subfamily_names": [subfamily], "full_names": [full_name],
+            "postscript_names": [postscript_name], "weight": weight, "italic": italic, "coverage": None}
+
+
+@pytest.fixture(autouse=True)
+def font_index(monkeypatch):
+    # 每个测试使用空的字体索引
+    for name in ("all_fonts", "font_files", "font_name_index"):
+        monkeypatch.setattr(subtitle_subsetter, name, {})
+    monkeypatch.setattr(subtitle_subsetter, "font_name_keys", None)
+    monkeypatch.setattr(subtitle_subsetter, "font_service_socket", None)
+
+
+def add_arial_family():
+    add_font_file("/fonts/arial.ttf", 1, 1, [make_face(0, "Arial", "Regular", "Arial", "ArialMT")])
+    add_font_file("/fonts/arialbd.ttf", 1, 1, [make_face(0, "Arial", "Bold", "Arial Bold", "Arial-BoldMT", 700)])
+    add_font_file("/fonts/ariali.ttf", 1, 1, [make_face(0, "Arial", "Italic", "Arial Italic", "Arial-ItalicMT", italic=True)])
+
+
+def test_family_name_selects_style():
+    add_arial_family()
+    assert resolve_font("Arial") == ("/fonts/arial.ttf", 0)
+    assert resolve_font("Arial", 700) == ("/fonts/arialbd.ttf", 0)
+    assert resolve_font("Arial", 400, True) == ("/fonts/ariali.ttf", 0)
+    # 没有粗斜体时选择最接近的字体，由渲染器模拟
+    assert resolve_font("Arial", 700, True) == ("/fonts/ariali.ttf", 0)
+
+
+def test_name_is_case_and_space_insensitive():
+    add_arial_family()
+    assert resolve_font("  arial ") == ("/fonts/arial.ttf", 0)
+    assert resolve_font("@Arial") == ("/fonts/arial.ttf", 0)
+
+
+def test_full_and_postscript_names():
+    add_arial_family()
+    assert resolve_font("Arial Bold") == ("/fonts/arialbd.ttf", 0)
+    assert resolve_font("Arial-BoldMT", 400) == ("/fonts/arialbd.ttf", 0)
+    assert resolve_font("ArialMT", 700) == ("/fonts/arial.ttf", 0)
+
+
+def test_face_in_collection():
+    add_font_file("/fonts/coll.ttc", 1, 1, [make_face(0, "Coll One", "Regular", "Coll One", "CollOne"),
+                                            make_face(1, "Coll Two", "Regular", "Coll Two", "CollTwo")])
+    assert resolve_font("Coll Two") == ("/fonts/coll.ttc", 1)
+
+
+def test_prefix_with_style_suffix():
+    # 家族名只记录在全名中时，"Gothic" 匹配 "Gothic Regular"，常规字重优先
+    add_font_file("/fonts/gothic-b.ttf", 1, 1, [make_face(0, "Gothic Bold", "Bold", "Gothic Bold", "Gothic-Bold", 700)])
+    add_font_file("/fonts/gothic-r.ttf", 1, 1, [make_face(0, "Gothic Regular", "Regular", "Gothic Regular", "Gothic-Regular")])
+    assert resolve_font("Gothic") == ("/fonts/gothic-r.ttf", 0)
+    add_font_file("/fonts/gothic-bi.ttf", 1, 1, [make_face(0, "Sans Bold Italic", "Bold Italic", "Sans Bold Italic", "Sans-BoldItalic", 700, True)])
+    assert resolve_font("Sans") == ("/fonts/gothic-bi.ttf", 0)
+
+
+def test_prefix_with_other_suffix_is_not_installed():
+    add_font_file("/fonts/ariblk.ttf", 1, 1, [make_face(0, "Arial Black", "Regular", "Arial Black", "Arial-Black", 900)])
+    assert resolve_font("Arial") is None
+    assert not check_font_installed("Arial")
+    assert resolve_font("Arial Black") == ("/fonts/ariblk.ttf", 0)
+
+
+def test_prefix_must_end_at_word_boundary():
+    add_font_file("/fonts/arialn.ttf", 1, 1, [make_face(0, "ArialNarrow", "Regular", "ArialNarrow", "ArialNarrow")])
+    assert resolve_font("Arial") is None
+
+
+def test_unknown_font():
+    add_arial_family()
+    assert resolve_font("Helvetica") is None
+    assert resolve_font("") is None
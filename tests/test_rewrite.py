@@ -0,0 +1,77 @@
+import pytest
+
+from subtitle_subsetter import iter_rewritten_subtitle
+
+HEADER = "; ----- Font Subset Information -----\n"
+HEADER_END = "; ----- Font Subset Information End -----\n"
+
+STYLES = """[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour
+Style: Default,Arial,20,&H00FFFFFF
+Style: Vertical,@Arial,20,&H00FFFFFF
+Style: Black,Arial Black,20,&H00FFFFFF
+Style: Unused,Times New Roman,20,&H00FFFFFF
+"""
+
+EVENTS = """[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+Comment: 0,0:00:00.00,0:00:01.00,Default,,0,0,0,,{\\fnArial}note
+Dialogue: 0,0:00:00.00,0:00:01.00,Default,,0,0,0,,{\\fnArial Black}a{\\fnArial}b{\\fn@Arial}c{\\fn Arial\\b1}d{\\fnArialX}e
+"""
+
+MAPPING = {"Arial": "AAAAAAAA", "Arial Black": "BBBBBBBB"}
+
+
+def rewrite(text, mapping=MAPPING, stats=None):
+    return list(iter_rewritten_subtitle(text.splitlines(keepends=True), mapping, stats))
+
+
+def header_range(lines):
+    return lines.index(HEADER), lines.index(HEADER_END)
+
+
+def test_header_after_script_info():
+    lines = rewrite("; comment\n[Script Info]\nTitle: x\n\n" + STYLES)
+    start, end = header_range(lines)
+    assert lines[:2] == ["; comment\n", "[Script Info]\n"]
+    assert start == 2
+    assert lines[end + 1] == "Title: x\n"
+
+
+@pytest.mark.parametrize("text", [
+    "Dialogue: 0,0:00:00.00,0:00:01.00,Default,,0,0,0,,text",
+    "\n; comment\nline one\nline two",
+    "; only a comment",
+    STYLES + "\n[Script Info]\nTitle: x\n",
+])
+def test_header_at_start_without_leading_script_info(text):
+    lines = rewrite(text)
+    start, end = header_range(lines)
+    assert start == 0
+    # 原有内容在字体子集化信息之后原样保留，不会与字体子集化信息连在同一行
+    assert "".join(lines[end + 1:]).startswith(text.split("\n")[0])
+    assert lines.count(HEADER) == 1
+
+
+def test_styles_are_renamed_and_unused_removed():
+    stats = {}
+    lines = rewrite("[Script Info]\n\n" + STYLES, stats=stats)
+    styles = [line for line in lines if line.startswith("Style:")]
+    assert styles == ["Style: Default,AAAAAAAA,20,&H00FFFFFF\n",
+                      "Style: Vertical,@AAAAAAAA,20,&H00FFFFFF\n",
+                      "Style: Black,BBBBBBBB,20,&H00FFFFFF\n"]
+    assert stats["deleted_styles"] == 1
+
+
+def test_fn_names_with_common_prefix():
+    lines = rewrite("[Script Info]\n\n" + EVENTS)
+    dialogue = [line for line in lines if line.startswith("Dialogue:")]
+    assert dialogue == ["Dialogue: 0,0:00:00.00,0:00:01.00,Default,,0,0,0,,"
+                        "{\\fnBBBBBBBB}a{\\fnAAAAAAAA}b{\\fn@AAAAAAAA}c{\\fn AAAAAAAA\\b1}d{\\fnArialX}e\n"]
+
+
+def test_comment_lines_removed_only_in_events():
+    text = "[Script Info]\nComment: kept\n\n" + EVENTS
+    lines = rewrite(text)
+    assert "Comment: kept\n" in lines
+    assert not any(line.startswith("Comment: 0,") for line in lines)
@@ -0,0 +1,74 @@
+import io
+import os
+
+import pytest
+
+from subtitle_subsetter import embedded_font_name, iter_fonts_section, iter_uuencoded_font
+
+# 60 字节编码为一整行 80 个字符，默认每块 1024 行
+SIZES = [0, 1, 2, 3, 4, 5, 57, 58, 59, 60, 61, 62, 63, 119, 120, 121, 180, 60 * 1024 - 1, 60 * 1024, 60 * 1024 + 1, 60 * 1024 + 2, 60 * 2048 + 61]
+
+
+# 按 ASS 规范逐组编码，不使用 base64
+def reference_encode(data):
+    chars = []
+    for i in range(0, len(data), 3):
+        group = data[i:i + 3]
+        value = int.from_bytes(group.ljust(3, b'\0'), 'big')
+        digits = [(value >> shift) & 0x3F for shift in (18, 12, 6, 0)]
+        chars.extend(chr(digit + 33) for digit in digits[:len(group) + 1])
+    text = "".join(chars)
+    return "".join(text[i:i + 80] + "\n" for i in range(0, len(text), 80))
+
+
+def decode(text):
+    encoded = "".join(text.split("\n"))
+    data = bytearray()
+    for i in range(0, len(encoded), 4):
+        group = encoded[i:i + 4]
+        value = 0
+        for char in group.ljust(4, "!"):
+            value = (value << 6) | (ord(char) - 33)
+        data.extend(value.to_bytes(3, 'big')[:len(group) - 1])
+    return bytes(data)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_round_trip(size):
+    data = os.urandom(size)
+    text = "".join(iter_uuencoded_font(data))
+    assert text == reference_encode(data)
+    assert decode(text) == data
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_line_lengths(size):
+    lines = "".join(iter_uuencoded_font(os.urandom(size))).split("\n")
+    assert lines[-1] == ""
+    assert all(len(line) == 80 for line in lines[:-2])
+    if size:
+        assert 0 < len(lines[-2]) <= 80
+
+
+@pytest.mark.parametrize("chunk_lines", [1, 2, 3, 7])
+@pytest.mark.parametrize("size", [0, 1, 59, 60, 61, 119, 120, 121, 179, 180, 181, 421])
+def test_chunk_boundaries(chunk_lines, size):
+    data = os.urandom(size)
+    chunks = list(iter_uuencoded_font(io.BytesIO(data), chunk_lines))
+    assert "".join(chunks) == reference_encode(data)
+    # 除最后一块外每块都是 chunk_lines 个整行
+    assert all(chunk.count("\n") == chunk_lines and len(chunk) == 81 * chunk_lines for chunk in chunks[:-1])
+
+
+def test_fonts_section(tmp_path):
+    first, second = os.urandom(100), os.urandom(61)
+    font_path = tmp_path / "ABCDEFGH.ttf"
+    font_path.write_bytes(first)
+    name = embedded_font_name(str(font_path))
+    assert name == "ABCDEFGH_0.ttf"
+    text = "".join(iter_fonts_section({name: str(font_path), "IJKLMNOP-1_0.ttf": second}))
+    header, rest = text.split("\n", 1)
+    assert header == "[Fonts]"
+    sections = rest.split("fontname: ")[1:]
+    assert [section.split("\n", 1)[0] for section in sections] == [name, "IJKLMNOP-1_0.ttf"]
+    assert [decode(section.split("\n", 1)[1]) for section in sections] == [first, second]